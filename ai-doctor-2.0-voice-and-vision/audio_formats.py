@@ -0,0 +1,229 @@
+"""
+Audio Output Formats
+Negotiates the output codec/bitrate for doctor audio and caches transcoded
+variants next to the original gTTS MP3.
+"""
+
+import os
+import re
+import tempfile
+
+from audio_transform_pool import transform_audio
+
+DEFAULT_AUDIO_FORMAT = "mp3"
+
+# Speech-tuned settings, all mono. The MP3 entry describes the original gTTS
+# output, which is served untouched unless a bitrate is asked for explicitly.
+AUDIO_FORMATS = {
+    "opus": {
+        "media_type": "audio/ogg; codecs=opus",
+        "extension": "ogg",
+        "muxer": "ogg",
+        "codec": "libopus",
+        "default_bitrate": "24k",
+        "min_kbps": 6,
+        "max_kbps": 128,
+        "extra_args": ["-ac", "1", "-application", "voip"],
+    },
+    "aac": {
+        "media_type": "audio/aac",
+        "extension": "aac",
+        "muxer": "adts",
+        "codec": "aac",
+        "default_bitrate": "32k",
+        "min_kbps": 16,
+        "max_kbps": 192,
+        "extra_args": ["-ac", "1"],
+    },
+    "mp3": {
+        "media_type": "audio/mpeg",
+        "extension": "mp3",
+        "muxer": "mp3",
+        "codec": "libmp3lame",
+        "default_bitrate": None,
+        "min_kbps": 8,
+        "max_kbps": 192,
+        "extra_args": ["-ac", "1"],
+    },
+}
+
+# Names and media types clients may use to ask for a format
+FORMAT_ALIASES = {
+    "opus": "opus",
+    "ogg": "opus",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "aac": "aac",
+    "m4a": "aac",
+    "audio/aac": "aac",
+    "audio/x-aac": "aac",
+    "audio/mp4": "aac",
+    "mp3": "mp3",
+    "mpeg": "mp3",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+}
+
+EXTENSION_MEDIA_TYPES = {spec["extension"]: spec["media_type"] for spec in AUDIO_FORMATS.values()}
+
+_BITRATE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(k|kbps)?$", re.IGNORECASE)
+
+
+class AudioFormatError(ValueError):
+    """Raised for unknown formats or unusable bitrates"""
+
+
+def resolve_format(name):
+    """Map a format name or media type to a key of AUDIO_FORMATS"""
+    if not name:
+        return None
+    key = name.split(";")[0].strip().lower()
+    if key not in FORMAT_ALIASES:
+        raise AudioFormatError(f"Unsupported audio format: {name}")
+    return FORMAT_ALIASES[key]
+
+
+def normalize_bitrate(fmt, bitrate):
+    """
+    Validate a bitrate such as "24k", "32kbps" or "32000" for a format.
+
+    Returns:
+        str: ffmpeg bitrate string like "24k", or None if no bitrate was given
+    """
+    if bitrate is None or str(bitrate).strip() == "":
+        return None
+
+    match = _BITRATE_PATTERN.match(str(bitrate).strip())
+    if not match:
+        raise AudioFormatError(f"Invalid bitrate: {bitrate}")
+
+    value = float(match.group(1))
+    kbps = value if match.group(2) or value < 1000 else value / 1000
+    spec = AUDIO_FORMATS[fmt]
+    if not spec["min_kbps"] <= kbps <= spec["max_kbps"]:
+        raise AudioFormatError(
+            f"Bitrate for {fmt} must be between {spec['min_kbps']}k and {spec['max_kbps']}k"
+        )
+    return f"{int(round(kbps))}k"
+
+
+def parse_accept(accept_header):
+    """
+    Return the audio formats listed in an Accept header, best first.
+
+    Only concrete audio/* media types count; wildcards leave the choice to the
+    server, which keeps MP3 for clients (e.g. Safari) that cannot play Ogg.
+    """
+    if not accept_header:
+        return []
+
+    candidates = []
+    for position, part in enumerate(accept_header.split(",")):
+        fields = [field.strip() for field in part.split(";")]
+        media_type = fields[0].lower()
+        if not media_type.startswith("audio/") or media_type == "audio/*":
+            continue
+
+        quality = 1.0
+        for field in fields[1:]:
+            if field.lower().startswith("q="):
+                try:
+                    quality = float(field[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0 or media_type not in FORMAT_ALIASES:
+            continue
+        candidates.append((-quality, position, FORMAT_ALIASES[media_type]))
+
+    return [fmt for _, _, fmt in sorted(candidates)]
+
+
+def negotiate_audio_format(accept_header=None, requested_format=None, requested_bitrate=None):
+    """
+    Pick the output format and bitrate for a client.
+
+    An explicit format parameter wins over the Accept header; without either
+    the original MP3 is used.
+
+    Returns:
+        tuple: (format key, bitrate string or None)
+    """
+    fmt = resolve_format(requested_format)
+    if fmt is None:
+        preferred = parse_accept(accept_header)
+        fmt = preferred[0] if preferred else DEFAULT_AUDIO_FORMAT
+
+    bitrate = normalize_bitrate(fmt, requested_bitrate)
+    if bitrate is None:
+        bitrate = AUDIO_FORMATS[fmt]["default_bitrate"]
+    return fmt, bitrate
+
+
+def media_type_for(path):
+    """Content-Type for an audio file based on its extension"""
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return EXTENSION_MEDIA_TYPES.get(extension, "audio/mpeg")
+
+
+def is_original(fmt, bitrate):
+    """True when the gTTS MP3 can be served without transcoding"""
+    return fmt == DEFAULT_AUDIO_FORMAT and bitrate is None
+
+
+def variant_path(original_path, fmt, bitrate):
+    """
+    Path of a transcoded variant, stored next to the original, e.g.
+    tts_output_en.mp3 -> tts_output_en.opus-24k.ogg
+    """
+    stem = os.path.splitext(original_path)[0]
+    extension = AUDIO_FORMATS[fmt]["extension"]
+    return f"{stem}.{fmt}-{bitrate or 'default'}.{extension}"
+
+
+def get_audio_variant(original_path, fmt, bitrate):
+    """
+    Return the path of the original file converted to fmt/bitrate.
+
+    Variants are reused while they are newer than the original and rebuilt
+    by the audio worker pool otherwise.
+    """
+    if is_original(fmt, bitrate):
+        return original_path
+
+    target = variant_path(original_path, fmt, bitrate)
+    try:
+        if os.path.getmtime(target) >= os.path.getmtime(original_path):
+            return target
+    except OSError:
+        pass
+
+    spec = AUDIO_FORMATS[fmt]
+    with open(original_path, "rb") as f:
+        original_audio = f.read()
+
+    result = transform_audio(
+        original_audio,
+        output_format=spec["muxer"],
+        codec=spec["codec"],
+        bitrate=bitrate,
+        extra_args=spec["extra_args"],
+    )
+
+    # Write under a unique temporary name so readers never see a partial
+    # file and concurrent requests for the same variant can't interleave
+    fd, tmp_target = tempfile.mkstemp(dir=os.path.dirname(target), prefix=os.path.basename(target) + ".",
+                                      suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(result.data)
+        os.replace(tmp_target, target)
+    except BaseException:
+        try:
+            os.remove(tmp_target)
+        except OSError:
+            pass
+        raise
+
+    print(f"Transcoded {os.path.basename(original_path)} -> {fmt} {bitrate}: "
+          f"{len(original_audio)} -> {len(result.data)} bytes in {result.cpu_time * 1000:.1f} ms CPU")
+    return target
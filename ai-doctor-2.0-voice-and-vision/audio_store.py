@@ -0,0 +1,314 @@
+"""
+Audio Store
+Content-addressed storage for generated doctor audio and HTTP serving with
+strong ETags, conditional GET, byte ranges and an in-memory LRU for small
+hot files.
+
+Files are pruned once unused for AUDIO_STORE_MAX_AGE_HOURS. "Used" means
+served or produced again (the access time is refreshed, the mtime and so
+the ETag are kept), and content-addressed responses may be cached for no
+longer than that, so a URL a client holds never outlives its file.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.responses import Response, StreamingResponse
+
+AUDIO_STORE_DIR = os.path.abspath(os.getenv("AUDIO_STORE_DIR", "audio_store"))
+AUDIO_STORE_MAX_AGE = float(os.getenv("AUDIO_STORE_MAX_AGE_HOURS", "24")) * 3600
+AUDIO_LRU_MAX_BYTES = int(os.getenv("AUDIO_LRU_MAX_BYTES", str(16 * 1024 * 1024)))
+AUDIO_LRU_MAX_FILE_BYTES = int(os.getenv("AUDIO_LRU_MAX_FILE_BYTES", str(512 * 1024)))
+AUDIO_ETAG_CACHE_ENTRIES = int(os.getenv("AUDIO_ETAG_CACHE_ENTRIES", "4096"))
+
+# Serving a file refreshes its access time at most this often
+ACCESS_TOUCH_INTERVAL = 600
+# Cached copies must expire before an unused file can be pruned
+IMMUTABLE_CACHE_CONTROL = f"public, max-age={max(int(AUDIO_STORE_MAX_AGE - ACCESS_TOUCH_INTERVAL), 0)}, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+STREAM_CHUNK_SIZE = 64 * 1024
+PRUNE_INTERVAL = 600
+
+# <prefix>_<16 hex digest>[.<format>-<bitrate>].<ext>, never rewritten once created
+CONTENT_ADDRESSED_NAME = re.compile(r"^[a-z]+_[0-9a-f]{16}(\.[a-z0-9]+-[a-z0-9]+)?\.[a-z0-9]+$")
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_etag_cache = OrderedDict()  # path -> ((mtime_ns, size), etag), large files only
+_lru = OrderedDict()
+_lru_bytes = 0
+_lock = threading.Lock()
+_last_prune = 0.0
+
+
+def ensure_store_dir():
+    """Create the audio store directory if needed and return it"""
+    os.makedirs(AUDIO_STORE_DIR, exist_ok=True)
+    return AUDIO_STORE_DIR
+
+
+def new_temp_path(suffix=".mp3"):
+    """Unique path inside the store for a file that is about to be written"""
+    ensure_store_dir()
+    return os.path.join(AUDIO_STORE_DIR, f"pending-{os.getpid()}-{time.time_ns()}{suffix}")
+
+
+def resolve_store_path(filename):
+    """
+    Map a requested filename to a path inside the store.
+
+    Returns None for anything that could escape the store directory
+    (separators, '..', absolute paths, symlinks pointing elsewhere).
+    """
+    if not filename or not _SAFE_NAME.match(filename) or ".." in filename:
+        return None
+
+    path = os.path.realpath(os.path.join(AUDIO_STORE_DIR, filename))
+    if os.path.commonpath([path, AUDIO_STORE_DIR]) != AUDIO_STORE_DIR:
+        return None
+    return path
+
+
+def is_content_addressed(path):
+    return bool(CONTENT_ADDRESSED_NAME.match(os.path.basename(path)))
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def commit_content_addressed(temp_path, prefix="tts"):
+    """
+    Rename a freshly written file to <prefix>_<content hash>.<ext>.
+
+    Identical audio maps to the same name, so a repeat is simply dropped.
+
+    Returns:
+        str: Path of the stored file
+    """
+    extension = os.path.splitext(temp_path)[1]
+    digest = _hash_file(temp_path)
+    target = os.path.join(os.path.dirname(temp_path), f"{prefix}_{digest[:16]}{extension}")
+
+    if os.path.exists(target):
+        os.remove(temp_path)
+        _touch(target)
+    else:
+        os.replace(temp_path, target)
+
+    prune_store()
+    return target
+
+
+def _touch(path, stat=None):
+    """Mark a file as used now (access time only, so its mtime and ETag stay)"""
+    try:
+        stat = stat or os.stat(path)
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def _last_used(stat):
+    return max(stat.st_atime, stat.st_mtime)
+
+
+def prune_store(force=False):
+    """Remove stored audio unused for AUDIO_STORE_MAX_AGE (runs at most every 10 minutes)"""
+    global _last_prune
+    now = time.time()
+    if not force and now - _last_prune < PRUNE_INTERVAL:
+        return 0
+    _last_prune = now
+
+    removed = 0
+    try:
+        entries = list(os.scandir(AUDIO_STORE_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and now - _last_used(entry.stat()) > AUDIO_STORE_MAX_AGE:
+                os.remove(entry.path)
+                removed += 1
+                with _lock:
+                    _etag_cache.pop(entry.path, None)
+        except OSError:
+            continue
+    return removed
+
+
+def _file_info(path):
+    """Return (size, mtime, etag, cached bytes or None), hashing each version once"""
+    global _lru_bytes
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if time.time() - _last_used(stat) > ACCESS_TOUCH_INTERVAL:
+        _touch(path, stat)
+
+    with _lock:
+        cached = _lru.get(path)
+        if cached is not None and cached[0] == key:
+            _lru.move_to_end(path)
+            return stat.st_size, stat.st_mtime, cached[1], cached[2]
+        known = _etag_cache.get(path)
+        if known is not None:
+            _etag_cache.move_to_end(path)
+
+    data = None
+    if stat.st_size <= AUDIO_LRU_MAX_FILE_BYTES:
+        with open(path, "rb") as f:
+            data = f.read()
+        etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+    elif known is not None and known[0] == key:
+        etag = known[1]
+    else:
+        etag = f'"{_hash_file(path)[:32]}"'
+
+    with _lock:
+        if data is None:
+            # Small files keep their ETag in the LRU entry instead
+            _etag_cache[path] = (key, etag)
+            _etag_cache.move_to_end(path)
+            while len(_etag_cache) > AUDIO_ETAG_CACHE_ENTRIES:
+                _etag_cache.popitem(last=False)
+        else:
+            previous = _lru.pop(path, None)
+            if previous is not None:
+                _lru_bytes -= len(previous[2])
+            _lru[path] = (key, etag, data)
+            _lru_bytes += len(data)
+            while _lru_bytes > AUDIO_LRU_MAX_BYTES and _lru:
+                _, evicted = _lru.popitem(last=False)
+                _lru_bytes -= len(evicted[2])
+
+    return stat.st_size, stat.st_mtime, etag, data
+
+
+def _etag_matches(header, etag):
+    """Weak comparison used by If-None-Match"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def _parse_range(header, size):
+    """
+    Parse a single byte range. Multi-range requests are answered with the
+    full body, which RFC 9110 allows.
+
+    Returns:
+        (start, end) inclusive, None to ignore the header, or "unsatisfiable"
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def audio_file_response(request, path, media_type, headers=None):
+    """
+    Build the response for a stored audio file.
+
+    Handles If-None-Match / If-Modified-Since (304), Range / If-Range (206,
+    416) and sets ETag, Last-Modified and Cache-Control. Content-addressed
+    files are cached as immutable, everything else must revalidate.
+    """
+    size, mtime, etag, data = _file_info(path)
+
+    base_headers = dict(headers or {})
+    base_headers.update({
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if is_content_addressed(path) else REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    })
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match is not None and _etag_matches(if_none_match, etag)) or (
+            if_none_match is None and if_modified_since and _not_modified_since(if_modified_since, mtime)):
+        return Response(status_code=304, headers=base_headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header:
+        if_range = request.headers.get("if-range")
+        # If-Range uses strong comparison for ETags; dates must match exactly
+        if if_range is None or if_range.strip() == etag or (
+                not if_range.strip().startswith('"') and _not_modified_since(if_range, mtime)):
+            byte_range = _parse_range(range_header, size)
+
+    if byte_range == "unsatisfiable":
+        base_headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=base_headers)
+
+    if byte_range is None:
+        if data is not None:
+            return Response(content=data, media_type=media_type, headers=base_headers)
+        base_headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file(path, 0, size), media_type=media_type, headers=base_headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    base_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    if data is not None:
+        return Response(content=data[start:end + 1], status_code=206, media_type=media_type, headers=base_headers)
+    base_headers["Content-Length"] = str(length)
+    return StreamingResponse(_iter_file(path, start, length), status_code=206,
+                             media_type=media_type, headers=base_headers)
+
+
+def get_store_stats():
+    """Cache occupancy for health reporting"""
+    with _lock:
+        return {
+            "directory": AUDIO_STORE_DIR,
+            "lru_files": len(_lru),
+            "lru_bytes": _lru_bytes,
+            "lru_max_bytes": AUDIO_LRU_MAX_BYTES,
+            "etag_cache_entries": len(_etag_cache),
+        }
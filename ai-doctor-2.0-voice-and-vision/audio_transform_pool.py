@@ -0,0 +1,217 @@
+"""
+Audio Transform Worker Pool
+Runs speed changes and format conversions for doctor audio in a dedicated
+process pool. Every job is a single ffmpeg pass (decode -> filter -> encode)
+fed through stdin/stdout pipes, so no temporary files touch the disk.
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+from thread_budget import thread_budget
+
+# ffmpeg's atempo filter only accepts factors in this range per instance,
+# larger or smaller changes are expressed as a chain of filters
+ATEMPO_MIN = 0.5
+ATEMPO_MAX = 2.0
+
+# Sized by the worker's thread budget (AUDIO_WORKERS / FFMPEG_THREADS override)
+AUDIO_WORKERS = thread_budget.audio_workers
+FFMPEG_THREADS = thread_budget.ffmpeg_threads
+AUDIO_JOB_TIMEOUT = float(os.getenv("AUDIO_JOB_TIMEOUT", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    "jobs": 0,
+    "failures": 0,
+    "cpu_seconds": 0.0,
+    "wall_seconds": 0.0,
+}
+
+
+class AudioTransformError(Exception):
+    """Raised when ffmpeg is missing or a transform job fails"""
+
+
+class AudioJobResult(NamedTuple):
+    data: bytes
+    cpu_time: float   # CPU seconds spent by ffmpeg for this job
+    wall_time: float  # Wall-clock seconds inside the worker
+
+
+def find_ffmpeg():
+    """Locate the ffmpeg binary (same lookup pydub uses)"""
+    return os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+
+def atempo_chain(speed):
+    """
+    Build an atempo filter chain for a speed multiplier.
+
+    atempo changes tempo without touching pitch, unlike resampling the
+    frame rate. Factors outside [0.5, 2.0] are split into several stages.
+    """
+    if speed <= 0:
+        raise ValueError("speed must be positive")
+
+    stages = []
+    remaining = float(speed)
+    while remaining > ATEMPO_MAX:
+        stages.append(ATEMPO_MAX)
+        remaining /= ATEMPO_MAX
+    while remaining < ATEMPO_MIN:
+        stages.append(ATEMPO_MIN)
+        remaining /= ATEMPO_MIN
+    if abs(remaining - 1.0) > 1e-3 or not stages:
+        stages.append(remaining)
+
+    return ",".join(f"atempo={stage:.4f}" for stage in stages)
+
+
+def build_ffmpeg_command(speed=1.0, output_format="mp3", codec=None,
+                         bitrate=None, input_format=None, extra_args=None):
+    """
+    Build a single-pass ffmpeg command reading from stdin and writing to stdout.
+
+    Args:
+        speed: Tempo multiplier (1.0 = unchanged)
+        output_format: ffmpeg muxer name for the output ("mp3", "ogg", "adts", ...)
+        codec: Audio codec (e.g. "libmp3lame", "libopus", "aac"); ffmpeg default if None
+        bitrate: Target bitrate such as "32k"; ffmpeg default if None
+        input_format: Demuxer hint for the input, probed from the stream if None
+        extra_args: Additional output arguments inserted before the output target
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise AudioTransformError("ffmpeg not found - install ffmpeg or set FFMPEG_BINARY")
+
+    cmd = [ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin", "-threads", str(FFMPEG_THREADS)]
+    if input_format:
+        cmd += ["-f", input_format]
+    cmd += ["-i", "pipe:0", "-vn"]
+
+    if speed and abs(speed - 1.0) > 1e-3:
+        cmd += ["-filter:a", atempo_chain(speed)]
+    if codec:
+        cmd += ["-c:a", codec]
+    if bitrate:
+        cmd += ["-b:a", str(bitrate)]
+    if extra_args:
+        cmd += list(extra_args)
+
+    # -threads before -i limits the decoder, here the encoder
+    cmd += ["-threads", str(FFMPEG_THREADS), "-f", output_format, "pipe:1"]
+    return cmd
+
+
+def _run_ffmpeg_job(cmd, data, timeout):
+    """Worker entry point: pipe data through ffmpeg and measure its CPU time"""
+    wall_start = time.perf_counter()
+    before = os.times()
+
+    try:
+        proc = subprocess.run(
+            cmd,
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise AudioTransformError(f"ffmpeg timed out after {timeout}s")
+
+    after = os.times()
+    # The child has been reaped by subprocess.run, so its usage is accounted
+    # in children_* (always 0 on Windows, where os.times cannot report it)
+    cpu_time = ((after.children_user - before.children_user)
+                + (after.children_system - before.children_system))
+    wall_time = time.perf_counter() - wall_start
+
+    if proc.returncode != 0:
+        message = proc.stderr.decode("utf-8", errors="replace").strip()
+        raise AudioTransformError(f"ffmpeg exited with {proc.returncode}: {message[-500:]}")
+    if not proc.stdout:
+        raise AudioTransformError("ffmpeg produced no output")
+
+    return AudioJobResult(proc.stdout, cpu_time, wall_time)
+
+
+def get_audio_pool():
+    """Return the shared process pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=max(1, AUDIO_WORKERS))
+    return _pool
+
+
+def shutdown_audio_pool():
+    """Stop the worker processes (called on application shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _record(result=None):
+    with _stats_lock:
+        if result is None:
+            _stats["failures"] += 1
+            return
+        _stats["jobs"] += 1
+        _stats["cpu_seconds"] += result.cpu_time
+        _stats["wall_seconds"] += result.wall_time
+
+
+def submit_transform(data, speed=1.0, output_format="mp3", codec=None,
+                     bitrate=None, input_format=None, extra_args=None,
+                     timeout=None):
+    """
+    Queue a transform job on the worker pool.
+
+    Returns:
+        concurrent.futures.Future resolving to an AudioJobResult
+    """
+    cmd = build_ffmpeg_command(
+        speed=speed,
+        output_format=output_format,
+        codec=codec,
+        bitrate=bitrate,
+        input_format=input_format,
+        extra_args=extra_args,
+    )
+    future = get_audio_pool().submit(_run_ffmpeg_job, cmd, data, timeout or AUDIO_JOB_TIMEOUT)
+    future.add_done_callback(
+        lambda f: _record(None if f.cancelled() or f.exception() else f.result())
+    )
+    return future
+
+
+def transform_audio(data, **kwargs):
+    """Run a transform job and wait for it (see submit_transform for arguments)"""
+    timeout = kwargs.get("timeout") or AUDIO_JOB_TIMEOUT
+    # Give the worker a little longer than ffmpeg's own timeout to report back
+    return submit_transform(data, **kwargs).result(timeout=timeout + 5)
+
+
+def get_pool_stats():
+    """Aggregate per-job timings for health reporting"""
+    with _stats_lock:
+        jobs = _stats["jobs"]
+        return {
+            "workers": AUDIO_WORKERS,
+            "jobs": jobs,
+            "failures": _stats["failures"],
+            "cpu_seconds_total": round(_stats["cpu_seconds"], 3),
+            "avg_cpu_ms": round(_stats["cpu_seconds"] / jobs * 1000, 2) if jobs else 0.0,
+            "avg_wall_ms": round(_stats["wall_seconds"] / jobs * 1000, 2) if jobs else 0.0,
+        }
@@ -18,7 +18,7 @@ def encode_image(image_path):
     return base64.b64encode(image_file.read()).decode('utf-8')
 
 #Step3: Setup Multimodal LLM 
-from groq import Groq
+# Groq is imported inside analyze_image_with_query so startup does not pay for it
 
 query="Is there something wrong with my face?"
 #model = "meta-llama/llama-4-maverick-17b-128e-instruct"
@@ -27,6 +27,8 @@ model="meta-llama/llama-4-scout-17b-16e-instruct"
 #model="llama-3.2-90b-vision-preview" #Deprecated
 
 def analyze_image_with_query(query, model, encoded_image):
+    from groq import Groq
+
     client=Groq()  
     messages=[
         {
@@ -4,13 +4,21 @@ AI Doctor FastAPI Application
 Provides endpoints for AI-powered medical image analysis and voice processing
 """
 
+import time
+BOOT_STARTED = time.perf_counter()
+
 import os
+import json
 import base64
 import tempfile
+import importlib
+import importlib.util
+import threading
 from typing import Optional
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, File, UploadFile, Form, Query, Request, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
@@ -21,14 +29,20 @@ import gc
 import psutil
 
 # Handle PyAudio availability for cloud deployment
-try:
-    import pyaudio
+# (find_spec only looks the package up, it does not load PortAudio)
+if importlib.util.find_spec("pyaudio") is not None:
     AUDIO_RECORDING_AVAILABLE = True
     print("✅ PyAudio available - audio recording enabled")
-except ImportError:
+else:
     AUDIO_RECORDING_AVAILABLE = False
     print("⚠️ PyAudio not available - audio recording disabled (cloud deployment)")
 
+# Startup mode:
+#   lazy    - heavy media/LLM libraries load on first use (default, fastest cold start)
+#   preload - same fast boot, then the libraries are imported in a background thread
+STARTUP_MODE = os.getenv("DOCTOR_STARTUP_MODE", "lazy").lower()
+PRELOAD_MODULES = ["groq", "gtts", "pydub"]
+
 # Optimize for Render's free tier
 def optimize_memory():
     """Optimize memory usage for Render's free tier"""
@@ -46,6 +60,18 @@ load_dotenv()
 from brain_of_the_doctor import encode_image, analyze_image_with_query
 from voice_of_the_patient import transcribe_with_groq
 from voice_of_the_doctor import text_to_speech_with_gtts
+from audio_transform_pool import get_pool_stats, shutdown_audio_pool
+from audio_formats import (
+    AUDIO_FORMATS, AudioFormatError, negotiate_audio_format,
+    get_audio_variant, is_original, media_type_for
+)
+from memory_governor import governor, AdmissionRejected
+from job_queue import job_queue, QueueFull, TERMINAL_STATES
+from thread_budget import thread_budget, apply_threadpool_budget
+from audio_store import (
+    new_temp_path, commit_content_addressed, resolve_store_path,
+    audio_file_response, get_store_stats
+)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -63,6 +89,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+startup_timings = {
+    "mode": STARTUP_MODE,
+    "import_ms": None,
+    "ready_ms": None,
+    "first_request_ms": None,
+}
+
+def process_uptime_ms():
+    """Milliseconds since the OS started this process (includes interpreter boot)"""
+    return (time.time() - psutil.Process().create_time()) * 1000
+
+def preload_heavy_modules():
+    """Import heavy libraries ahead of the first request (preload mode)"""
+    started = time.perf_counter()
+    for module_name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            print(f"⚠️ Preload skipped {module_name}: {e}")
+    print(f"📦 Preloaded {', '.join(PRELOAD_MODULES)} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+@app.on_event("startup")
+async def report_startup():
+    """Print how long the service took to become ready for its first request"""
+    startup_timings["ready_ms"] = round(process_uptime_ms(), 1)
+    print(f"⏱️ Ready for first request {startup_timings['ready_ms']:.0f} ms after process start "
+          f"(module import {startup_timings['import_ms']:.0f} ms, startup mode: {STARTUP_MODE})")
+    if STARTUP_MODE == "preload":
+        threading.Thread(target=preload_heavy_modules, name="preload-modules", daemon=True).start()
+
+@app.middleware("http")
+async def track_first_request(request: Request, call_next):
+    response = await call_next(request)
+    if startup_timings["first_request_ms"] is None:
+        startup_timings["first_request_ms"] = round(process_uptime_ms(), 1)
+        print(f"⏱️ First request ({request.url.path}) answered "
+              f"{startup_timings['first_request_ms']:.0f} ms after process start")
+    return response
+
+# Heavy endpoints and the kind of upload they carry, used to estimate memory
+HEAVY_ROUTES = {
+    "/analyze-image": "image",
+    "/transcribe-audio": "audio",
+    "/analyze-combined": "combined",
+    "/analyze": "image",
+}
+
+@app.middleware("http")
+async def memory_admission(request: Request, call_next):
+    """Admit, queue or reject heavy requests against the memory budget"""
+    kind = HEAVY_ROUTES.get(request.url.path) if request.method == "POST" else None
+    if kind is None:
+        return await call_next(request)
+    
+    try:
+        declared_bytes = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        declared_bytes = 0
+    
+    try:
+        ticket = await governor.acquire(request.url.path, governor.estimate(kind, declared_bytes))
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": f"Server is busy: {e.reason}"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    try:
+        return await call_next(request)
+    finally:
+        ticket.release()
+
+@app.on_event("startup")
+async def start_job_queue():
+    """Start the background job workers and resume interrupted jobs"""
+    apply_threadpool_budget()
+    job_queue.register("analyze-combined", run_combined_analysis_job)
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop the job workers and the audio transform worker processes"""
+    await job_queue.stop()
+    shutdown_audio_pool()
+
 # Pydantic models for request/response
 class ImageAnalysisRequest(BaseModel):
     query: str
@@ -84,6 +196,32 @@ class CombinedResponse(BaseModel):
     transcription: str
     analysis: str
     audio_response: Optional[str] = None
+    audio_format: Optional[str] = None
+
+def negotiate_or_400(request: Request, audio_format: Optional[str], bitrate: Optional[str]):
+    """Negotiate the output audio format, turning bad parameters into a 400"""
+    try:
+        return negotiate_audio_format(request.headers.get("accept"), audio_format, bitrate)
+    except AudioFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def synthesize_to_store(text, output_format, output_bitrate, **tts_options):
+    """
+    Generate speech into the audio store under a content-addressed name
+    and return the filename of the negotiated variant (None on failure)
+    """
+    temp_path = new_temp_path(".mp3")
+    try:
+        text_to_speech_with_gtts(input_text=text, output_filepath=temp_path, **tts_options)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    
+    if not os.path.exists(temp_path):
+        return None
+    stored_path = commit_content_addressed(temp_path, prefix="tts")
+    return os.path.basename(get_audio_variant(stored_path, output_format, output_bitrate))
 
 # Health check endpoint
 @app.get("/health")
@@ -100,6 +238,12 @@ async def health_check():
             "version": "1.0.0",
             "api_status": api_status,
             "audio_available": AUDIO_RECORDING_AVAILABLE,
+            "audio_pool": get_pool_stats(),
+            "audio_store": get_store_stats(),
+            "startup": startup_timings,
+            "memory": governor.stats(),
+            "jobs": await run_in_threadpool(job_queue.stats),
+            "thread_budget": thread_budget.as_dict(),
             "memory_usage": f"{psutil.Process().memory_info().rss / 1024 / 1024:.2f} MB"
         }
     except Exception as e:
@@ -108,6 +252,12 @@ async def health_check():
             "error": str(e)
         }
 
+# Prometheus metrics endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Memory and admission-control metrics in Prometheus text format"""
+    return PlainTextResponse(governor.render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -208,14 +358,19 @@ async def transcribe_audio(file: UploadFile = File(...)):
 # Combined analysis endpoint (image + voice)
 @app.post("/analyze-combined", response_model=CombinedResponse)
 async def analyze_combined(
+    request: Request,
     image_file: UploadFile = File(...),
     audio_file: UploadFile = File(...),
     query: str = Form("What do you see in this image?"),
-    model: str = Form("meta-llama/llama-4-scout-17b-16e-instruct")
+    model: str = Form("meta-llama/llama-4-scout-17b-16e-instruct"),
+    audio_format: Optional[str] = Form(None, alias="format"),
+    bitrate: Optional[str] = Form(None)
 ):
     """
     Combined analysis: transcribe audio and analyze image
+    The spoken reply format (opus, aac, mp3) comes from "format"/"bitrate" or an audio/* Accept header
     """
+    output_format, output_bitrate = negotiate_or_400(request, audio_format, bitrate)
     try:
         # Validate files
         if not image_file.content_type.startswith('image/'):
@@ -254,17 +409,17 @@ async def analyze_combined(
                 encoded_image=encoded_image
             )
             
-            # Generate audio response
-            audio_response_path = text_to_speech_with_gtts(
-                input_text=analysis,
-                output_filepath="response.mp3"
+            # Generate audio response (off the event loop, speed change runs in the audio pool)
+            audio_response_file = await run_in_threadpool(
+                synthesize_to_store, analysis, output_format, output_bitrate
             )
             
             return CombinedResponse(
                 success=True,
                 transcription=transcription,
                 analysis=analysis,
-                audio_response=audio_response_path if os.path.exists(audio_response_path) else None
+                audio_response=audio_response_file,
+                audio_format=output_format
             )
             
         finally:
@@ -275,28 +430,192 @@ async def analyze_combined(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in combined analysis: {str(e)}")
 
+# Background job variant of /analyze-combined
+def run_combined_analysis_job(job):
+    """
+    Stages of a combined analysis job. Each stage is checkpointed, so a job
+    resumed after a restart skips the stages it already finished.
+    """
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        raise RuntimeError("GROQ_API_KEY not configured")
+    params = job.params
+    
+    transcription = job.run_stage(
+        "transcription",
+        transcribe_with_groq,
+        GROQ_API_KEY=groq_api_key,
+        audio_filepath=job.input_path(params["audio_name"]),
+        stt_model="whisper-large-v3"
+    )
+    
+    analysis = job.run_stage(
+        "analysis",
+        lambda: analyze_image_with_query(
+            query=f"{params['query']} {transcription}",
+            model=params["model"],
+            encoded_image=encode_image(job.input_path(params["image_name"]))
+        )
+    )
+    
+    audio_response = job.run_stage(
+        "audio_response",
+        synthesize_to_store, analysis, params["audio_format"], params["audio_bitrate"]
+    )
+    
+    return {
+        "transcription": transcription,
+        "analysis": analysis,
+        "audio_response": audio_response,
+        "audio_format": params["audio_format"]
+    }
+
+@app.post("/jobs/analyze-combined", status_code=202)
+async def submit_combined_analysis_job(
+    request: Request,
+    image_file: UploadFile = File(...),
+    audio_file: UploadFile = File(...),
+    query: str = Form("What do you see in this image?"),
+    model: str = Form("meta-llama/llama-4-scout-17b-16e-instruct"),
+    audio_format: Optional[str] = Form(None, alias="format"),
+    bitrate: Optional[str] = Form(None)
+):
+    """
+    Queue a combined analysis and return a job id immediately.
+    Poll GET /jobs/{job_id}, or subscribe to /jobs/{job_id}/events (SSE)
+    or /ws/jobs/{job_id} (WebSocket). Send an Idempotency-Key header to make
+    retried submissions return the original job instead of starting a new one.
+    """
+    if not image_file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="Image file must be an image")
+    if not audio_file.content_type.startswith('audio/'):
+        raise HTTPException(status_code=400, detail="Audio file must be an audio file")
+    output_format, output_bitrate = negotiate_or_400(request, audio_format, bitrate)
+    
+    image_name = f"image.{image_file.filename.split('.')[-1]}"
+    audio_name = f"audio.{audio_file.filename.split('.')[-1]}"
+    params = {
+        "query": query,
+        "model": model,
+        "image_name": image_name,
+        "audio_name": audio_name,
+        "audio_format": output_format,
+        "audio_bitrate": output_bitrate,
+        "memory_kind": "combined"
+    }
+    
+    try:
+        job_id = await job_queue.submit(
+            "analyze-combined",
+            params,
+            files={image_name: await image_file.read(), audio_name: await audio_file.read()},
+            idempotency_key=request.headers.get("idempotency-key")
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": (await job_queue.get(job_id))["status"],
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "websocket_url": f"/ws/jobs/{job_id}"
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Current state of a background job (results are kept for JOB_RESULT_TTL seconds)"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-sent events with every state change of a job until it finishes"""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    async def event_stream():
+        updates = job_queue.subscribe(job_id)
+        try:
+            job = await job_queue.get(job_id)
+            yield f"event: job\ndata: {json.dumps(job)}\n\n"
+            while job is not None and job["status"] not in TERMINAL_STATES:
+                if await request.is_disconnected():
+                    break
+                try:
+                    job = await asyncio.wait_for(updates.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if job is not None:
+                    yield f"event: job\ndata: {json.dumps(job)}\n\n"
+        finally:
+            job_queue.unsubscribe(job_id, updates)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/jobs/{job_id}")
+async def job_websocket(websocket: WebSocket, job_id: str):
+    """Push job state changes over a WebSocket until the job finishes"""
+    await websocket.accept()
+    updates = job_queue.subscribe(job_id)
+    try:
+        job = await job_queue.get(job_id)
+        if job is None:
+            await websocket.send_json({"error": "Job not found or expired", "job_id": job_id})
+            return
+        await websocket.send_json(job)
+        while job is not None and job["status"] not in TERMINAL_STATES:
+            job = await updates.get()
+            if job is not None:
+                await websocket.send_json(job)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        job_queue.unsubscribe(job_id, updates)
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
 # Text-to-speech endpoint
 @app.post("/text-to-speech")
-async def text_to_speech(text: str = Form(...), lang: str = Form("en"), speed: float = Form(1.4)):
+async def text_to_speech(
+    request: Request,
+    text: str = Form(...),
+    lang: str = Form("en"),
+    speed: float = Form(1.4),
+    audio_format: Optional[str] = Form(None, alias="format"),
+    bitrate: Optional[str] = Form(None)
+):
     """
     Convert text to speech with language and speed support
     Supports: en (English), hi (Hindi)
     Speed: 1.0 = normal, 1.4 = 40% faster (default), 2.0 = double speed
+    Format: opus, aac or mp3 (default), from "format"/"bitrate" or an audio/* Accept header
     """
+    output_format, output_bitrate = negotiate_or_400(request, audio_format, bitrate)
     try:
-        # Generate unique filename for each language to avoid conflicts
-        output_filename = f"tts_output_{lang}.mp3"
-        audio_file_path = text_to_speech_with_gtts(
-            input_text=text,
-            output_filepath=output_filename,
+        # Content-addressed filenames never collide and can be cached forever
+        audio_file = await run_in_threadpool(
+            synthesize_to_store, text, output_format, output_bitrate,
             lang=lang,
             speed=speed
         )
         
-        if os.path.exists(audio_file_path):
+        if audio_file:
             return {
                 "success": True,
-                "audio_file": audio_file_path,
+                "audio_file": audio_file,
+                "audio_format": output_format,
+                "media_type": AUDIO_FORMATS[output_format]["media_type"],
                 "message": "Text converted to speech successfully"
             }
         else:
@@ -306,28 +625,41 @@ async def text_to_speech(text: str = Form(...), lang: str = Form("en"), speed: f
         raise HTTPException(status_code=500, detail=f"Error converting text to speech: {str(e)}")
 
 @app.get("/audio/{filename}")
-async def get_audio(filename: str):
+async def get_audio(
+    request: Request,
+    filename: str,
+    audio_format: Optional[str] = Query(None, alias="format"),
+    bitrate: Optional[str] = Query(None)
+):
     """
-    Serve audio files
+    Serve audio files from the audio store
+    Supports Range requests, ETag/Last-Modified revalidation (304) and
+    immutable caching for content-addressed files.
+    MP3 originals can be requested as opus/aac via ?format=&bitrate= or an audio/* Accept header
     """
+    output_format, output_bitrate = negotiate_or_400(request, audio_format, bitrate)
     try:
-        # Check if file exists in current directory
-        if os.path.exists(filename):
-            return FileResponse(
-                filename,
-                media_type="audio/mpeg",
-                headers={"Content-Disposition": f"inline; filename={filename}"}
-            )
+        # Only files inside the audio store directory can be served
+        file_path = resolve_store_path(filename)
+        if file_path is None or not os.path.isfile(file_path):
+            raise HTTPException(status_code=404, detail="Audio file not found")
         
-        # Check if file exists with full path
-        if os.path.exists(os.path.join(os.getcwd(), filename)):
-            return FileResponse(
-                os.path.join(os.getcwd(), filename),
-                media_type="audio/mpeg",
-                headers={"Content-Disposition": f"inline; filename={filename}"}
-            )
+        headers = {}
+        # Only MP3 originals are transcoded, existing variants are served as they are
+        if file_path.lower().endswith(".mp3"):
+            headers["Vary"] = "Accept"
+            if not is_original(output_format, output_bitrate):
+                file_path = await run_in_threadpool(
+                    get_audio_variant, file_path, output_format, output_bitrate
+                )
         
-        raise HTTPException(status_code=404, detail="Audio file not found")
+        served_name = os.path.basename(file_path)
+        headers["Content-Disposition"] = f"inline; filename={served_name}"
+        return await run_in_threadpool(
+            audio_file_response, request, file_path, media_type_for(file_path), headers
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error serving audio: {str(e)}")
 
@@ -842,6 +1174,9 @@ async def websocket_audio_stream(websocket: WebSocket):
     except WebSocketDisconnect:
         print("Client disconnected")
 
+# Everything above runs at import time; keep it free of network and disk I/O
+startup_timings["import_ms"] = round((time.perf_counter() - BOOT_STARTED) * 1000, 1)
+
 if __name__ == "__main__":
     # Check for required environment variables
     groq_api_key = os.getenv("GROQ_API_KEY")
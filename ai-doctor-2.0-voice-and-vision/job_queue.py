@@ -0,0 +1,407 @@
+"""
+Job Queue
+Background jobs for long multimodal analyses.
+
+Submitting a job stores its inputs in a spool directory and a row in a
+local SQLite journal, then returns a job id immediately. A bounded pool of
+workers runs the job's stages; every finished stage is checkpointed in the
+journal so a restarted worker resumes where it stopped instead of redoing
+completed work. Results are kept for JOB_RESULT_TTL seconds and can be
+polled or pushed to subscribers (SSE / WebSocket).
+
+Journal reads and writes are blocking SQLite calls, so coroutines only
+reach them through run_in_threadpool; nothing touches the database on the
+event loop.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+from memory_governor import governor, AdmissionRejected
+
+JOB_STORE_DIR = os.path.abspath(os.getenv("JOB_STORE_DIR", "job_store"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "50"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+SWEEP_INTERVAL = 60
+
+TERMINAL_STATES = ("completed", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    params TEXT NOT NULL,
+    outputs TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    idempotency_key TEXT UNIQUE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_expires ON jobs(expires_at);
+"""
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are waiting"""
+
+
+class JobContext:
+    """What a job handler sees: its parameters, input files and stage checkpoints"""
+
+    def __init__(self, queue, job_id, params, outputs):
+        self.queue = queue
+        self.job_id = job_id
+        self.params = params
+        self.outputs = outputs
+        self.input_dir = queue.spool_path(job_id)
+
+    def input_path(self, name):
+        return os.path.join(self.input_dir, name)
+
+    def run_stage(self, name, func, *args, **kwargs):
+        """
+        Run a stage once. If the journal already holds its output (the job
+        was interrupted after it finished) the stored value is returned.
+        """
+        if name in self.outputs:
+            return self.outputs[name]
+        self.queue.set_stage(self.job_id, name)
+        value = func(*args, **kwargs)
+        self.outputs[name] = value
+        self.queue.save_outputs(self.job_id, self.outputs)
+        return value
+
+
+class JobQueue:
+    def __init__(self, store_dir=JOB_STORE_DIR, workers=JOB_WORKERS,
+                 queue_limit=JOB_QUEUE_LIMIT, result_ttl=JOB_RESULT_TTL):
+        self.store_dir = store_dir
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+
+        self.handlers = {}
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._queue = None
+        self._loop = None
+        self._tasks = []
+        self._subscribers = {}
+
+    # ------------------------------------------------------------------
+    # Journal
+    # ------------------------------------------------------------------
+    def _connect(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        db = sqlite3.connect(os.path.join(self.store_dir, "jobs.sqlite3"), check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        return db
+
+    def _execute(self, sql, args=()):
+        with self._db_lock:
+            cursor = self._db.execute(sql, args)
+            self._db.commit()
+            return cursor
+
+    def _fetch(self, job_id):
+        with self._db_lock:
+            return self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def spool_path(self, job_id):
+        return os.path.join(self.store_dir, "inputs", job_id)
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        self._notify(job_id)
+
+    def set_stage(self, job_id, stage):
+        self._update(job_id, stage=stage)
+
+    def save_outputs(self, job_id, outputs):
+        self._update(job_id, outputs=json.dumps(outputs))
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def register(self, kind, handler):
+        """Register a sync handler(JobContext) -> result dict for a job kind"""
+        self.handlers[kind] = handler
+
+    async def start(self):
+        """Open the journal, re-queue interrupted jobs and start the workers"""
+        self._loop = asyncio.get_running_loop()
+        self._db = await run_in_threadpool(self._connect)
+        self._queue = asyncio.Queue()
+
+        resumed = await run_in_threadpool(self._recover)
+        for job_id in resumed:
+            self._queue.put_nowait(job_id)
+        if resumed:
+            print(f"🔁 Resuming {len(resumed)} interrupted job(s) from the journal")
+
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    def _recover(self):
+        """Re-queue interrupted jobs in the journal; returns the ids to run again"""
+        now = time.time()
+        with self._db_lock:
+            pending = self._db.execute(
+                "SELECT id, attempts FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        resumed = []
+        for row in pending:
+            if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                self._update(row["id"], status="failed", error="Gave up after repeated interruptions",
+                             expires_at=now + self.result_ttl)
+                continue
+            self._update(row["id"], status="queued")
+            resumed.append(row["id"])
+        return resumed
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    # ------------------------------------------------------------------
+    # Submission and lookup
+    # ------------------------------------------------------------------
+    async def submit(self, kind, params, files=None, idempotency_key=None):
+        """
+        Journal a new job and queue it.
+
+        Args:
+            kind: Registered job kind
+            params: JSON-serialisable parameters
+            files: Optional {name: bytes} inputs written to the job's spool directory
+            idempotency_key: Re-submitting with the same key returns the existing job
+
+        Returns:
+            str: Job id
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        if idempotency_key:
+            existing = await run_in_threadpool(self._find_idempotent, idempotency_key)
+            if existing is not None:
+                return existing
+
+        if self._queue.qsize() >= self.queue_limit:
+            raise QueueFull("Too many analyses are waiting, try again shortly")
+
+        # Spool writes and the insert touch disk, so they run off the event loop
+        job_id, created = await run_in_threadpool(self._journal, kind, params, files or {}, idempotency_key)
+        if created:
+            self._queue.put_nowait(job_id)
+        return job_id
+
+    def _find_idempotent(self, idempotency_key):
+        with self._db_lock:
+            row = self._db.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+        return row["id"] if row is not None else None
+
+    def _journal(self, kind, params, files, idempotency_key):
+        """
+        Spool the inputs and insert the job row.
+
+        Returns:
+            tuple: (job id, whether a new job was created). A concurrent
+            submit with the same idempotency key may win the insert; its
+            job is returned and this one's spool directory is removed.
+        """
+        job_id = uuid.uuid4().hex
+        spool = self.spool_path(job_id)
+        os.makedirs(spool, exist_ok=True)
+        try:
+            for name, data in files.items():
+                with open(os.path.join(spool, name), "wb") as f:
+                    f.write(data)
+
+            now = time.time()
+            self._execute(
+                "INSERT INTO jobs (id, kind, status, params, idempotency_key, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), idempotency_key, now, now),
+            )
+        except sqlite3.IntegrityError:
+            shutil.rmtree(spool, ignore_errors=True)
+            existing = self._find_idempotent(idempotency_key) if idempotency_key else None
+            if existing is None:
+                raise
+            return existing, False
+        except BaseException:
+            shutil.rmtree(spool, ignore_errors=True)
+            raise
+        return job_id, True
+
+    async def get(self, job_id):
+        """Public view of a job, or None if it is unknown or expired"""
+        return await run_in_threadpool(self._view, job_id)
+
+    def _view(self, job_id):
+        row = self._fetch(job_id)
+        if row is None or (row["expires_at"] and row["expires_at"] < time.time()):
+            return None
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "completed_stages": list(json.loads(row["outputs"]).keys()),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "expires_at": row["expires_at"],
+        }
+
+    def stats(self):
+        if self._db is None:
+            return {"workers": self.workers, "started": False, "queued": 0, "jobs": {}}
+        with self._db_lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {
+            "workers": self.workers,
+            "started": True,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "jobs": {row["status"]: row["n"] for row in rows},
+        }
+
+    # ------------------------------------------------------------------
+    # Push notifications
+    # ------------------------------------------------------------------
+    def subscribe(self, job_id):
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id, queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _notify(self, job_id):
+        """
+        Push the job's latest state to subscribers. Called from the thread
+        that updated the journal, which also reads the snapshot; only the
+        hand-off to the subscriber queues happens on the event loop.
+        """
+        if not self._subscribers.get(job_id) or self._loop is None:
+            return
+        snapshot = self._view(job_id)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._publish(job_id, snapshot)
+        else:
+            self._loop.call_soon_threadsafe(self._publish, job_id, snapshot)
+
+    def _publish(self, job_id, snapshot):
+        for queue in list(self._subscribers.get(job_id, ())):
+            queue.put_nowait(snapshot)
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+    async def _worker(self, index):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"❌ Job worker {index} crashed on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id):
+        row = await run_in_threadpool(self._fetch, job_id)
+        if row is None or row["status"] != "queued":
+            return
+
+        params = json.loads(row["params"])
+        outputs = json.loads(row["outputs"])
+        context = JobContext(self, job_id, params, outputs)
+
+        # Jobs go through the same memory admission as direct requests
+        spool = self.spool_path(job_id)
+        input_bytes = await run_in_threadpool(self._spool_bytes, spool)
+        estimate = governor.estimate(params.get("memory_kind", "combined"), input_bytes)
+        while True:
+            try:
+                ticket = await governor.acquire(f"job:{row['kind']}", estimate)
+                break
+            except AdmissionRejected as e:
+                await asyncio.sleep(e.retry_after)
+
+        await run_in_threadpool(self._update, job_id, status="running", attempts=row["attempts"] + 1)
+        try:
+            result = await run_in_threadpool(self.handlers[row["kind"]], context)
+            await run_in_threadpool(self._update, job_id, status="completed", stage=None,
+                                    result=json.dumps(result), expires_at=time.time() + self.result_ttl)
+        except Exception as e:
+            await run_in_threadpool(self._update, job_id, status="failed", error=str(e),
+                                    expires_at=time.time() + self.result_ttl)
+        finally:
+            ticket.release()
+            await run_in_threadpool(shutil.rmtree, spool, ignore_errors=True)
+
+    @staticmethod
+    def _spool_bytes(spool):
+        return sum(entry.stat().st_size for entry in os.scandir(spool)) if os.path.isdir(spool) else 0
+
+    async def _sweeper(self):
+        """Drop expired jobs and any spool directories they left behind"""
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                await run_in_threadpool(self._sweep)
+            except Exception as e:
+                print(f"⚠️ Job sweeper error: {e}")
+
+    def _sweep(self):
+        with self._db_lock:
+            expired = [row["id"] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )]
+        for job_id in expired:
+            shutil.rmtree(self.spool_path(job_id), ignore_errors=True)
+        if expired:
+            self._execute(
+                f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(expired))})", expired
+            )
+
+
+job_queue = JobQueue()
@@ -0,0 +1,322 @@
+"""
+Memory Governor
+Admission control for heavy requests on the 512 MB Render tier.
+
+Each heavy request declares its upload size (Content-Length); the governor
+turns that into a memory estimate and admits, queues or rejects the request
+depending on live RSS, the memory already reserved by running requests and
+the configured budget. A sampler thread records the peak RSS growth of
+every admitted request.
+
+RSS is process-wide, so a request's growth can only be told apart from
+everyone else's when it ran alone. The per-route peak histogram only
+takes requests that never overlapped another heavy request; overlapping
+ones are counted per route instead (still reserved by their process-wide
+growth for admission).
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+MB = 1024 * 1024
+
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "460"))
+MEMORY_QUEUE_LIMIT = int(os.getenv("MEMORY_QUEUE_LIMIT", "8"))
+MEMORY_QUEUE_TIMEOUT = float(os.getenv("MEMORY_QUEUE_TIMEOUT", "20"))
+MEMORY_SAMPLE_INTERVAL = float(os.getenv("MEMORY_SAMPLE_INTERVAL", "0.05"))
+
+# Working-set multipliers over the declared upload size. Images are read,
+# written to a temp file, base64 encoded and embedded in the JSON sent to
+# Groq; audio is read, spooled and re-sent as multipart.
+FOOTPRINT_MULTIPLIERS = {
+    "image": 6.0,
+    "audio": 3.0,
+    "combined": 5.0,
+}
+BASE_REQUEST_BYTES = 8 * MB
+# Requests that only carry a URL (e.g. /analyze with a Cloudinary link)
+DEFAULT_DOWNLOAD_BYTES = 4 * MB
+
+PEAK_BUCKETS_MB = [1, 2, 5, 10, 20, 50, 100, 200]
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted within the memory budget"""
+
+    def __init__(self, reason, retry_after=5):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class MemoryTicket:
+    """Reservation held by one admitted request"""
+
+    def __init__(self, governor, route, estimate, start_rss, waited):
+        self.governor = governor
+        self.route = route
+        self.estimate = estimate
+        self.start_rss = start_rss
+        self.peak_rss = start_rss
+        self.waited = waited
+        self.released = False
+        self.overlapped = False  # Another heavy request ran at the same time
+
+    @property
+    def peak_delta(self):
+        return max(0, self.peak_rss - self.start_rss)
+
+    @property
+    def outstanding(self):
+        """Part of the estimate that has not shown up in RSS yet"""
+        return max(0, self.estimate - self.peak_delta)
+
+    def release(self):
+        self.governor.release(self)
+
+
+class MemoryGovernor:
+    def __init__(self, budget_mb=MEMORY_BUDGET_MB, max_queue=MEMORY_QUEUE_LIMIT,
+                 queue_timeout=MEMORY_QUEUE_TIMEOUT, sample_interval=MEMORY_SAMPLE_INTERVAL):
+        self.budget = int(budget_mb * MB)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.sample_interval = sample_interval
+
+        self._process = psutil.Process()
+        self._lock = threading.Lock()
+        self._active = set()
+        self._waiters = deque()
+        self._queued = 0
+        self._sampler = None
+
+        self.decisions = {"admitted": 0, "queued": 0, "rejected": 0}
+        self.wait_seconds_total = 0.0
+        self.peak_rss = self.rss()
+        self.peak_counts = {}     # route -> bucket counts (last bucket is +Inf)
+        self.peak_sums = {}       # route -> total peak bytes
+        self.peak_max = {}        # route -> largest peak bytes
+        self.overlapped = {}      # route -> requests left out of the peaks (ran concurrently)
+        self.recent_peaks = deque(maxlen=50)
+
+    # ------------------------------------------------------------------
+    # Estimation
+    # ------------------------------------------------------------------
+    def estimate(self, kind, declared_bytes):
+        """Estimate a request's working set from its declared upload size"""
+        declared = declared_bytes if declared_bytes else DEFAULT_DOWNLOAD_BYTES
+        return int(BASE_REQUEST_BYTES + declared * FOOTPRINT_MULTIPLIERS.get(kind, 4.0))
+
+    def rss(self):
+        return self._process.memory_info().rss
+
+    def reserved(self):
+        with self._lock:
+            return sum(ticket.outstanding for ticket in self._active)
+
+    def _fits(self, estimate):
+        with self._lock:
+            if not self._active:
+                # Nothing else is running: admitting is the only way forward
+                return True
+            reserved = sum(ticket.outstanding for ticket in self._active)
+        return self.rss() + reserved + estimate <= self.budget
+
+    # ------------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------------
+    async def acquire(self, route, estimate):
+        """
+        Admit a request, waiting in the queue if memory is short.
+
+        Raises:
+            AdmissionRejected: queue full, or no room before the queue timeout
+        """
+        started = time.monotonic()
+        if self._queued == 0 and self._fits(estimate):
+            return self._admit(route, estimate, waited=0.0)
+
+        if self._queued >= self.max_queue:
+            self.decisions["rejected"] += 1
+            raise AdmissionRejected("Memory budget exhausted and admission queue is full")
+
+        self.decisions["queued"] += 1
+        self._queued += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                remaining = self.queue_timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.decisions["rejected"] += 1
+                    raise AdmissionRejected("Timed out waiting for memory")
+
+                # Woken by releases; also re-check periodically since RSS can
+                # drop on its own (GC, freed buffers)
+                waiter = loop.create_future()
+                self._waiters.append(waiter)
+                try:
+                    await asyncio.wait_for(waiter, timeout=min(remaining, 0.25))
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._remove_waiter(waiter)
+
+                if self._fits(estimate):
+                    waited = time.monotonic() - started
+                    self.wait_seconds_total += waited
+                    return self._admit(route, estimate, waited)
+        finally:
+            self._queued -= 1
+
+    def _remove_waiter(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _admit(self, route, estimate, waited):
+        ticket = MemoryTicket(self, route, estimate, self.rss(), waited)
+        with self._lock:
+            if self._active:
+                ticket.overlapped = True
+                for other in self._active:
+                    other.overlapped = True
+            self._active.add(ticket)
+            self._ensure_sampler()
+        self.decisions["admitted"] += 1
+        return ticket
+
+    def release(self, ticket):
+        if ticket.released:
+            return
+        ticket.released = True
+        ticket.peak_rss = max(ticket.peak_rss, self.rss())
+        with self._lock:
+            self._active.discard(ticket)
+        if ticket.overlapped:
+            self.overlapped[ticket.route] = self.overlapped.get(ticket.route, 0) + 1
+        else:
+            self._record_peak(ticket)
+
+        if self._queued:
+            for waiter in list(self._waiters):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    # ------------------------------------------------------------------
+    # Peak tracking
+    # ------------------------------------------------------------------
+    def _ensure_sampler(self):
+        """Start the sampler thread if it is not running (caller holds the lock)"""
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="memory-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                tickets = list(self._active)
+                if not tickets:
+                    self._sampler = None
+                    return
+            rss = self.rss()
+            self.peak_rss = max(self.peak_rss, rss)
+            for ticket in tickets:
+                if rss > ticket.peak_rss:
+                    ticket.peak_rss = rss
+            time.sleep(self.sample_interval)
+
+    def _record_peak(self, ticket):
+        peak = ticket.peak_delta
+        counts = self.peak_counts.setdefault(ticket.route, [0] * (len(PEAK_BUCKETS_MB) + 1))
+        for index, bound in enumerate(PEAK_BUCKETS_MB):
+            if peak <= bound * MB:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        self.peak_sums[ticket.route] = self.peak_sums.get(ticket.route, 0) + peak
+        self.peak_max[ticket.route] = max(self.peak_max.get(ticket.route, 0), peak)
+        self.recent_peaks.append((ticket.route, peak, ticket.estimate))
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+    def stats(self):
+        """Summary for /health"""
+        rss = self.rss()
+        return {
+            "budget_mb": round(self.budget / MB, 1),
+            "rss_mb": round(rss / MB, 1),
+            "peak_rss_mb": round(max(self.peak_rss, rss) / MB, 1),
+            "reserved_mb": round(self.reserved() / MB, 1),
+            "active_requests": len(self._active),
+            "queued_requests": self._queued,
+            "decisions": dict(self.decisions),
+            "peak_request_mb": {
+                route: round(peak / MB, 1) for route, peak in self.peak_max.items()
+            },
+            "overlapped_requests": dict(self.overlapped),
+            "recent_requests": [
+                {"route": route, "peak_mb": round(peak / MB, 1), "estimate_mb": round(estimate / MB, 1)}
+                for route, peak, estimate in list(self.recent_peaks)[-5:]
+            ],
+        }
+
+    def render_metrics(self):
+        """Prometheus text exposition for /metrics"""
+        lines = [
+            "# HELP doctor_memory_rss_bytes Resident set size of the service process.",
+            "# TYPE doctor_memory_rss_bytes gauge",
+            f"doctor_memory_rss_bytes {self.rss()}",
+            "# HELP doctor_memory_budget_bytes Configured memory budget for admission control.",
+            "# TYPE doctor_memory_budget_bytes gauge",
+            f"doctor_memory_budget_bytes {self.budget}",
+            "# HELP doctor_memory_reserved_bytes Estimated memory still expected by running requests.",
+            "# TYPE doctor_memory_reserved_bytes gauge",
+            f"doctor_memory_reserved_bytes {self.reserved()}",
+            "# HELP doctor_admission_active_requests Heavy requests currently admitted.",
+            "# TYPE doctor_admission_active_requests gauge",
+            f"doctor_admission_active_requests {len(self._active)}",
+            "# HELP doctor_admission_queue_depth Heavy requests waiting for memory.",
+            "# TYPE doctor_admission_queue_depth gauge",
+            f"doctor_admission_queue_depth {self._queued}",
+            "# HELP doctor_admission_decisions_total Admission decisions by outcome.",
+            "# TYPE doctor_admission_decisions_total counter",
+        ]
+        for decision, count in self.decisions.items():
+            lines.append(f'doctor_admission_decisions_total{{decision="{decision}"}} {count}')
+
+        lines += [
+            "# HELP doctor_admission_wait_seconds_total Time queued requests spent waiting.",
+            "# TYPE doctor_admission_wait_seconds_total counter",
+            f"doctor_admission_wait_seconds_total {self.wait_seconds_total:.3f}",
+            "# HELP doctor_request_peak_memory_bytes Peak RSS growth of admitted requests that ran alone.",
+            "# TYPE doctor_request_peak_memory_bytes histogram",
+        ]
+        for route, counts in self.peak_counts.items():
+            cumulative = 0
+            for bound, count in zip(PEAK_BUCKETS_MB, counts):
+                cumulative += count
+                lines.append(f'doctor_request_peak_memory_bytes_bucket{{route="{route}",le="{bound * MB}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'doctor_request_peak_memory_bytes_bucket{{route="{route}",le="+Inf"}} {cumulative}')
+            lines.append(f'doctor_request_peak_memory_bytes_sum{{route="{route}"}} {self.peak_sums[route]}')
+            lines.append(f'doctor_request_peak_memory_bytes_count{{route="{route}"}} {cumulative}')
+
+        lines += [
+            "# HELP doctor_request_peak_memory_overlapped_total Admitted requests left out of the peak histogram (ran concurrently).",
+            "# TYPE doctor_request_peak_memory_overlapped_total counter",
+        ]
+        for route, count in self.overlapped.items():
+            lines.append(f'doctor_request_peak_memory_overlapped_total{{route="{route}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+
+governor = MemoryGovernor()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Import-time budget test for the AI Doctor service
+
+Imports fastapi_app in a fresh interpreter with `python -X importtime` and
+checks that:
+  - the cumulative import time stays under IMPORT_TIME_BUDGET_MS
+  - heavy media/LLM libraries are not imported at startup
+  - importing the app writes no files (e.g. the old gtts_testing.mp3)
+
+Run with pytest or directly: python test_import_time.py
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+LAZY_MODULES = ["gtts", "pydub", "speech_recognition", "pyaudio", "groq"]
+
+
+def measure_import(module="fastapi_app"):
+    """
+    Import a module in a clean interpreter inside an empty working directory.
+
+    Returns:
+        tuple: (cumulative import time in ms, lazily-imported modules that
+                were loaded anyway, files created in the working directory)
+    """
+    probe = (
+        "import sys; import {module}; "
+        "print('LOADED:' + ','.join(m for m in {lazy!r} if m in sys.modules))"
+    ).format(module=module, lazy=LAZY_MODULES)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SERVICE_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env.setdefault("GROQ_API_KEY", "import-time-test")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", probe],
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+        created_files = sorted(os.listdir(workdir))
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            cumulative_us = int(parts[1])
+
+    if cumulative_us is None:
+        raise RuntimeError(f"No -X importtime entry found for {module}")
+
+    loaded = []
+    for line in result.stdout.splitlines():
+        if line.startswith("LOADED:"):
+            loaded = [name for name in line[len("LOADED:"):].split(",") if name]
+    return cumulative_us / 1000, loaded, created_files
+
+
+def test_import_time_budget():
+    """fastapi_app must import within the configured budget"""
+    import_ms, _, _ = measure_import()
+    print(f"⏱️ fastapi_app import: {import_ms:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+    assert import_ms <= IMPORT_TIME_BUDGET_MS, (
+        f"fastapi_app took {import_ms:.0f} ms to import, budget is {IMPORT_TIME_BUDGET_MS:.0f} ms"
+    )
+
+
+def test_heavy_modules_are_lazy():
+    """Media and LLM client libraries must not load at import time"""
+    _, loaded, _ = measure_import()
+    assert not loaded, f"Imported at startup but should be lazy: {', '.join(loaded)}"
+
+
+def test_import_has_no_file_side_effects():
+    """Importing the app must not write files into the working directory"""
+    _, _, created_files = measure_import()
+    assert not created_files, f"Import created files: {', '.join(created_files)}"
+
+
+def main():
+    """Run all checks and report like the other deployment scripts"""
+    print("🚀 AI Doctor Import-Time Test")
+    print("=" * 40)
+
+    tests = [
+        test_import_time_budget,
+        test_heavy_modules_are_lazy,
+        test_import_has_no_file_side_effects,
+    ]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+            passed += 1
+        except (AssertionError, RuntimeError) as e:
+            print(f"❌ {test.__name__}: {e}")
+
+    print("=" * 40)
+    print(f"📊 Test Results: {passed}/{len(tests)} passed")
+    return 0 if passed == len(tests) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+Thread Budget
+Sizes the AI Doctor's thread and process pools from one number: the CPU
+cores each worker process may use.
+
+By default the anyio thread pool, the audio transform process pool and
+every ffmpeg it launches size themselves independently, which
+oversubscribes the CPU once several workers and requests run at once.
+From THREAD_BUDGET_CORES (default: usable cores divided by
+WEB_CONCURRENCY) the budget derives:
+
+  audio_workers       ffmpeg transform processes (half the cores, at most 2)
+  ffmpeg_threads      threads per ffmpeg job (audio codecs gain little from more)
+  threadpool_tokens   anyio threads behind run_in_threadpool; these mostly
+                      wait on the Groq/gTTS APIs and the job queue, so
+                      several per core and never fewer than anyio's own
+                      default of 40
+
+Every value can still be overridden on its own (AUDIO_WORKERS,
+FFMPEG_THREADS, THREAD_BUDGET_THREADPOOL_TOKENS).
+"""
+
+import os
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+THREAD_BUDGET_CORES = int(os.getenv("THREAD_BUDGET_CORES", "0"))
+THREADPOOL_TOKENS_PER_CORE = int(os.getenv("THREADPOOL_TOKENS_PER_CORE", "8"))
+# anyio's default limiter size; blocking I/O calls queue behind each other below it
+ANYIO_DEFAULT_TOKENS = 40
+
+
+def usable_cores():
+    """Cores this process may run on (respects CPU affinity / cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def cores_per_worker():
+    if THREAD_BUDGET_CORES > 0:
+        return THREAD_BUDGET_CORES
+    return max(1, usable_cores() // max(1, WEB_CONCURRENCY))
+
+
+class ThreadBudget:
+    def __init__(self, cores):
+        self.cores = max(1, cores)
+        self.audio_workers = int(os.getenv("AUDIO_WORKERS", str(max(1, min(2, self.cores // 2)))))
+        self.ffmpeg_threads = int(os.getenv("FFMPEG_THREADS", "1"))
+        self.threadpool_tokens = int(os.getenv(
+            "THREAD_BUDGET_THREADPOOL_TOKENS", str(max(ANYIO_DEFAULT_TOKENS, self.cores * THREADPOOL_TOKENS_PER_CORE))
+        ))
+
+    def as_dict(self):
+        return {
+            "cores": self.cores,
+            "workers": WEB_CONCURRENCY,
+            "audio_workers": self.audio_workers,
+            "ffmpeg_threads": self.ffmpeg_threads,
+            "threadpool_tokens": self.threadpool_tokens,
+        }
+
+
+thread_budget = ThreadBudget(cores_per_worker())
+
+
+def apply_threadpool_budget(budget=thread_budget):
+    """Size the anyio pool behind run_in_threadpool (needs a running event loop)"""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = budget.threadpool_tokens
+    print(f"🧵 Thread budget: {budget.cores} core(s) per worker -> audio workers {budget.audio_workers}, "
+          f"ffmpeg threads {budget.ffmpeg_threads}, threadpool {budget.threadpool_tokens}")
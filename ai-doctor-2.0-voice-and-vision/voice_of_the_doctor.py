@@ -3,10 +3,13 @@
 # load_dotenv()
 
 #Step1a: Setup Text to Speech–TTS–model with gTTS
+# gTTS is imported inside the functions so importing this module stays
+# fast and does no network or disk I/O
 import os
-from gtts import gTTS
 
 def text_to_speech_with_gtts_old(input_text, output_filepath):
+    from gtts import gTTS
+
     language="en"
 
     audioobj= gTTS(
@@ -17,17 +20,12 @@ def text_to_speech_with_gtts_old(input_text, output_filepath):
     audioobj.save(output_filepath)
 
 
-input_text="Hi this is Ai with Hassan!"
-text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
-
 #Step1b: ElevenLabs functionality removed - using only Google TTS 
 
 #Step2: Use Model for Text output to Voice
 
-import subprocess
-import platform
-from pydub import AudioSegment
-from pydub.playback import play
+from io import BytesIO
+from audio_transform_pool import transform_audio
 
 def text_to_speech_with_gtts(input_text, output_filepath, lang="en", speed=1.4):
     """
@@ -38,12 +36,15 @@ def text_to_speech_with_gtts(input_text, output_filepath, lang="en", speed=1.4):
         output_filepath: Path to save the audio file
         lang: Language code (default: "en")
               Supported: "en" (English), "hi" (Hindi), "mr" (Marathi), etc.
-        speed: Playback speed multiplier (default: 1.67)
-               1.0 = normal, 1.67 = 67% faster, 2.0 = double speed
+        speed: Playback speed multiplier (default: 1.4)
+               1.0 = normal, 1.4 = 40% faster, 2.0 = double speed
+               Applied by the audio worker pool without changing pitch
     
     Returns:
         str: Path to the generated audio file
     """
+    from gtts import gTTS
+
     # Generate TTS audio
     audioobj = gTTS(
         text=input_text,
@@ -51,51 +52,44 @@ def text_to_speech_with_gtts(input_text, output_filepath, lang="en", speed=1.4):
         slow=False
     )
     
-    # Save to temporary file first
-    temp_filepath = output_filepath.replace('.mp3', '_temp.mp3')
-    audioobj.save(temp_filepath)
-    
     # Speed up the audio if speed != 1.0
     if speed != 1.0:
+        # Keep the MP3 in memory and pipe it through the audio worker pool
+        buffer = BytesIO()
+        audioobj.write_to_fp(buffer)
+        original_audio = buffer.getvalue()
+
         try:
-            # Load audio
-            audio = AudioSegment.from_mp3(temp_filepath)
-            
-            # Change speed (increase frame rate)
-            # speed > 1.0 = faster, speed < 1.0 = slower
-            new_frame_rate = int(audio.frame_rate * speed)
-            
-            # Apply speed change
-            fast_audio = audio._spawn(audio.raw_data, overrides={
-                "frame_rate": new_frame_rate
-            })
-            
-            # Convert back to original frame rate (maintains speed but correct pitch)
-            fast_audio = fast_audio.set_frame_rate(audio.frame_rate)
-            
-            # Export final audio
-            fast_audio.export(output_filepath, format="mp3")
-            
-            # Clean up temp file
-            import os
-            os.remove(temp_filepath)
-            
+            # Single ffmpeg pass with atempo: tempo changes, pitch stays the same
+            result = transform_audio(
+                original_audio,
+                speed=speed,
+                output_format="mp3",
+                input_format="mp3"
+            )
+            with open(output_filepath, "wb") as f:
+                f.write(result.data)
+            print(f"Audio speed {speed}x applied in {result.cpu_time * 1000:.1f} ms CPU "
+                  f"({result.wall_time * 1000:.1f} ms wall)")
+
         except Exception as e:
             print(f"Warning: Could not apply speed change: {e}")
             # If speed change fails, use original
-            import os
-            os.rename(temp_filepath, output_filepath)
+            with open(output_filepath, "wb") as f:
+                f.write(original_audio)
     else:
-        # No speed change needed, just rename
-        import os
-        os.rename(temp_filepath, output_filepath)
+        # No speed change needed, write directly
+        audioobj.save(output_filepath)
     
     # Return the file path so Gradio can use it
     return output_filepath
 
 
-input_text="Hi this is Ai with Hassan, autoplay testing!"
-#text_to_speech_with_gtts(input_text=input_text, output_filepath="gtts_testing_autoplay.mp3")
+# ElevenLabs function removed - using only Google TTS
 
 
-# ElevenLabs function removed - using only Google TTS
\ No newline at end of file
+if __name__ == "__main__":
+    # Manual smoke test, only when run directly (makes a network request)
+    input_text="Hi this is Ai with Hassan!"
+    text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
+    #text_to_speech_with_gtts(input_text="Hi this is Ai with Hassan, autoplay testing!", output_filepath="gtts_testing_autoplay.mp3")
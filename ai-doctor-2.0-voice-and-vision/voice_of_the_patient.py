@@ -4,9 +4,9 @@
 
 #Step1: Setup Audio recorder (ffmpeg & portaudio)
 # ffmpeg, portaudio, pyaudio
+# speech_recognition and pydub are only needed for local recording and are
+# imported on first use to keep service startup fast
 import logging
-import speech_recognition as sr
-from pydub import AudioSegment
 from io import BytesIO
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,6 +20,9 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
     timeout (int): Maximum time to wait for a phrase to start (in seconds).
     phrase_time_lfimit (int): Maximum time for the phrase to be recorded (in seconds).
     """
+    import speech_recognition as sr
+    from pydub import AudioSegment
+
     recognizer = sr.Recognizer()
     
     try:
@@ -47,12 +50,13 @@ audio_filepath="patient_voice_test_for_patient.mp3"
 
 #Step2: Setup Speech to text–STT–model for transcription
 import os
-from groq import Groq
 
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 stt_model="whisper-large-v3"
 
 def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
+    from groq import Groq
+
     client=Groq(api_key=GROQ_API_KEY)
     
     audio_file=open(audio_filepath, "rb")
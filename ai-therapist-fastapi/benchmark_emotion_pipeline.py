@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the emotion hot path
+
+Times each stage of a frame's way through the therapist service:
+decode, Haar face detection (full frame and tracked region), ROI crop,
+model-input preprocessing, the fallback heuristic and model inference,
+at several resolutions and model batch sizes. Frames are synthetic
+(webcam-like background with a drawn face, as in test_emotion_detection.py)
+or taken from a local clip with --clip. Model stages are skipped when
+no model can be loaded from EMOTION_MODEL_PATH.
+
+Results can be saved as a JSON baseline and later runs compared against
+it; the comparison exits with status 1 when a stage's median got slower
+than the tolerance allows.
+
+Usage:
+    python benchmark_emotion_pipeline.py --output baseline.json
+    python benchmark_emotion_pipeline.py --compare baseline.json [--tolerance 0.15]
+    python benchmark_emotion_pipeline.py --clip session.webm --resolutions native
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from thread_budget import thread_budget, usable_cores
+
+DEFAULT_RESOLUTIONS = ["640x480", "1280x720", "1920x1080"]
+DEFAULT_BATCH_SIZES = [1, 4, 16, 64]
+DEFAULT_TOLERANCE = 0.15
+# Slowdowns smaller than this are timer noise on sub-microsecond stages
+MIN_REGRESSION_MS = 0.05
+WARMUP_RUNS = 3
+
+
+def synthetic_frame(width, height, seed=7):
+    """JPEG bytes of a webcam-like frame with a simple drawn face"""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    image = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    cx, cy, r = width // 2, height // 2, min(width, height) // 5
+    cv2.circle(image, (cx, cy), r, (190, 200, 220), -1)  # Face
+    cv2.circle(image, (cx - r // 3, cy - r // 4), r // 8, (0, 0, 0), -1)  # Left eye
+    cv2.circle(image, (cx + r // 3, cy - r // 4), r // 8, (0, 0, 0), -1)  # Right eye
+    cv2.ellipse(image, (cx, cy + r // 3), (r // 2, r // 4), 0, 0, 180, (0, 0, 0), 3)  # Smile
+    _, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return encoded.tobytes()
+
+
+def clip_frame(path, resolution):
+    """JPEG bytes of the middle frame of a clip, resized unless resolution is 'native'"""
+    capture = cv2.VideoCapture(path)
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.set(cv2.CAP_PROP_POS_FRAMES, max(frame_count // 2, 0))
+    ok, image = capture.read()
+    capture.release()
+    if not ok:
+        raise SystemExit(f"❌ Cannot read a frame from {path}")
+    if resolution != "native":
+        width, height = (int(value) for value in resolution.split("x"))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    _, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return encoded.tobytes(), f"{image.shape[1]}x{image.shape[0]}"
+
+
+def time_stage(function, iterations):
+    """Median and p95 wall time of a callable, in ms"""
+    for _ in range(WARMUP_RUNS):
+        function()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(timings[len(timings) // 2], 4),
+        "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)], 4),
+        "iterations": iterations,
+    }
+
+
+def centre_box(frame):
+    """Stand-in face box (detection-scale pixels) when the cascade finds none"""
+    height, width = frame.gray.shape
+    return width * 3 // 8, height * 3 // 10, width // 4, height * 2 // 5
+
+
+def benchmark_frame_stages(main, label, jpeg, iterations):
+    from face_tracker import FaceTracker
+    from frame_pipeline import decode_frame, to_model_input
+
+    results = {f"decode/{label}": time_stage(lambda: decode_frame(jpeg), iterations)}
+    frame = decode_frame(jpeg)
+
+    tracker = FaceTracker(main.face_detector)
+    results[f"detect_full/{label}"] = time_stage(lambda: tracker._full_detect(frame), iterations)
+    faces = tracker._full_detect(frame)
+    x, y, w, h = max(faces, key=lambda rect: rect[2] * rect[3]) if faces else centre_box(frame)
+
+    # Tracked search around a known box, as for every frame of a live session
+    tracker.forget("benchmark")
+    tracker._update("benchmark", None, [(x, y, w, h)], frame.scale, False)
+    track = tracker._tracks["benchmark"]
+    results[f"detect_tracked/{label}"] = time_stage(lambda: tracker._tracked_detect(frame, track), iterations)
+
+    def crop():
+        new_x, new_y, new_w, new_h = main.expand_roi(x, y, w, h, 1.3, 1.5, frame.shape)
+        return (frame.color[new_y:new_y + new_h, new_x:new_x + new_w],
+                frame.gray[new_y:new_y + new_h, new_x:new_x + new_w])
+
+    results[f"roi_crop/{label}"] = time_stage(crop, iterations)
+    face_roi, gray_roi = crop()
+    results[f"preprocess/{label}"] = time_stage(lambda: to_model_input(face_roi), iterations)
+    # The heuristic logs every call; keep the formatting cost but not the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        results[f"fallback/{label}"] = time_stage(lambda: main.predict_emotion_fallback(face_roi, gray_roi), iterations)
+    return results
+
+
+def benchmark_model(batch_sizes, iterations):
+    """Model inference per batch size, or ({}, None) without a model"""
+    from emotion_runtime import EMOTION_INPUT_SIZE, EMOTION_MODEL_PATH, load_backend
+    try:
+        model = load_backend(EMOTION_MODEL_PATH)
+    except Exception as e:
+        print(f"⚠️ Model stages skipped: {e}")
+        return {}, None
+
+    results = {}
+    rng = np.random.default_rng(0)
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size, EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3), dtype=np.float32)
+        result = time_stage(lambda: model.predict(batch), max(3, iterations // batch_size))
+        result["per_crop_ms"] = round(result["median_ms"] / batch_size, 4)
+        results[f"inference/batch{batch_size}"] = result
+    return results, model.name
+
+
+def compare(current, baseline, tolerance):
+    """Print stage-by-stage medians; returns the stages that regressed"""
+    regressions = []
+    print(f"{'stage':<32}{'baseline ms':>13}{'current ms':>12}{'change':>10}")
+    for stage, result in current["results"].items():
+        before = baseline["results"].get(stage)
+        if before is None:
+            print(f"{stage:<32}{'-':>13}{result['median_ms']:>12.3f}{'new':>10}")
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        marker = ""
+        if change > tolerance and result["median_ms"] - before["median_ms"] > MIN_REGRESSION_MS:
+            regressions.append(stage)
+            marker = "  ❌"
+        print(f"{stage:<32}{before['median_ms']:>13.3f}{result['median_ms']:>12.3f}{change:>+10.1%}{marker}")
+    for stage in baseline["results"]:
+        if stage not in current["results"]:
+            print(f"{stage:<32}{baseline['results'][stage]['median_ms']:>13.3f}{'-':>12}{'missing':>10}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emotion detection hot path")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--resolutions", nargs="+", default=DEFAULT_RESOLUTIONS,
+                        help="WIDTHxHEIGHT values, or 'native' with --clip")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--clip", help="Local video to take frames from instead of synthetic ones")
+    parser.add_argument("--output", help="Write results as JSON (use as a baseline)")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed median slowdown before a stage counts as regressed (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    import main as therapist  # Face detector, ROI and fallback of the live service
+
+    print("🚀 Emotion Pipeline Benchmark")
+    print("=" * 66)
+    results = {}
+    for resolution in args.resolutions:
+        if args.clip:
+            jpeg, label = clip_frame(args.clip, resolution)
+        else:
+            width, height = (int(value) for value in resolution.split("x"))
+            jpeg, label = synthetic_frame(width, height), resolution
+        results.update(benchmark_frame_stages(therapist, label, jpeg, args.iterations))
+    model_results, backend = benchmark_model(args.batch_sizes, args.iterations)
+    results.update(model_results)
+
+    current = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "usable_cores": usable_cores(),
+            "thread_budget": thread_budget.as_dict(),
+            "model_backend": backend,
+            "frames": args.clip or "synthetic",
+        },
+        "results": results,
+    }
+
+    for stage, result in results.items():
+        extra = f"  ({result['per_crop_ms']:.3f} ms/crop)" if "per_crop_ms" in result else ""
+        print(f"{stage:<32}median {result['median_ms']:>9.3f} ms   p95 {result['p95_ms']:>9.3f} ms{extra}")
+    print("=" * 66)
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(current, handle, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        if baseline.get("environment", {}).get("machine") != current["environment"]["machine"]:
+            print("⚠️ Baseline was recorded on a different machine type; timings may not be comparable")
+        print(f"\n📊 Compared with {args.compare} (tolerance {args.tolerance:.0%})")
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+            return 1
+        print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark the emotion frame preprocessing pipeline
+
+Compares the previous per-frame path (full-resolution decode, separate
+grayscale conversion, contiguous ROI copy, float64 normalisation) with the
+decode-once pipeline in frame_pipeline.py on synthetic webcam JPEGs.
+Face detection is excluded so only preprocessing is measured.
+
+Usage:
+    python benchmark_frame_pipeline.py [--frames 200]
+"""
+
+import argparse
+import base64
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from frame_pipeline import decode_frame, to_model_input
+
+FRAME_SIZES = [(640, 480), (1280, 720), (1920, 1080)]
+
+
+def make_frame(width, height, seed=7):
+    """Base64 JPEG that compresses like a real webcam frame"""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+    image = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.ellipse(image, (width // 2, height // 2), (width // 8, height // 5), 0, 0, 360, (150, 170, 200), -1)
+    _, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return base64.b64encode(encoded.tobytes()).decode()
+
+
+def face_box(shape):
+    """Fixed centred face box standing in for a detection result"""
+    height, width = shape[:2]
+    return width * 3 // 8, height * 3 // 10, width // 4, height * 2 // 5
+
+
+def legacy_preprocess(image_data):
+    image = cv2.imdecode(np.frombuffer(base64.b64decode(image_data), np.uint8), cv2.IMREAD_COLOR)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    x, y, w, h = face_box(image.shape)
+    face_roi = np.ascontiguousarray(image[y:y + h, x:x + w])
+    final_image = cv2.resize(face_roi, (224, 224))
+    final_image = np.expand_dims(final_image, axis=0)
+    final_image = final_image / 255.0
+    final_image = np.ascontiguousarray(final_image)
+    return gray, final_image
+
+
+def pipeline_preprocess(image_data):
+    frame = decode_frame(image_data)
+    x, y, w, h = face_box(frame.shape)
+    return frame.gray, to_model_input(frame.color[y:y + h, x:x + w])
+
+
+def measure(function, image_data, frames):
+    function(image_data)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function(image_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for _ in range(frames):
+        function(image_data)
+    wall_ms = (time.perf_counter() - started) * 1000 / frames
+    cpu_ms = (time.process_time() - cpu_started) * 1000 / frames
+    return wall_ms, cpu_ms, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark emotion frame preprocessing")
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    print("🚀 Frame Pipeline Benchmark")
+    print("=" * 78)
+    print(f"{'frame':<11}{'path':<10}{'wall ms':>10}{'cpu ms':>10}{'peak alloc KB':>16}{'cpu speedup':>14}")
+    for width, height in FRAME_SIZES:
+        image_data = make_frame(width, height)
+        legacy = measure(legacy_preprocess, image_data, args.frames)
+        pipeline = measure(pipeline_preprocess, image_data, args.frames)
+        label = f"{width}x{height}"
+        print(f"{label:<11}{'legacy':<10}{legacy[0]:>10.2f}{legacy[1]:>10.2f}{legacy[2] / 1024:>16.0f}")
+        print(f"{'':<11}{'pipeline':<10}{pipeline[0]:>10.2f}{pipeline[1]:>10.2f}{pipeline[2] / 1024:>16.0f}"
+              f"{legacy[1] / pipeline[1]:>13.1f}x")
+    print("=" * 78)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
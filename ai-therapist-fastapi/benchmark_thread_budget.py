@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark emotion throughput under different thread budgets
+
+Each setting runs in a fresh interpreter (OpenMP/BLAS/TF read their
+thread counts at import) and pushes synthetic webcam frames through
+decode -> full face detection -> model input -> model predict from
+several request threads at once. The emotion model is used when one can
+be loaded from EMOTION_MODEL_PATH; otherwise the model step is skipped.
+
+Usage:
+    python benchmark_thread_budget.py [--frames 200] [--concurrency 1 4 8]
+                                      [--cores 1 2 4]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_setting(frames, concurrency):
+    """Child process: measure one budget (configured through the environment)"""
+    from thread_budget import thread_budget, apply_thread_budget
+    import cv2
+    import numpy as np
+    from benchmark_frame_pipeline import make_frame, face_box
+    from emotion_runtime import EMOTION_MODEL_PATH, load_backend
+    from frame_pipeline import decode_frame, to_model_input
+
+    apply_thread_budget()
+    detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    try:
+        model = load_backend(EMOTION_MODEL_PATH)
+    except Exception:
+        model = None
+    image_data = make_frame(1280, 720)
+
+    def process(_):
+        started = time.perf_counter()
+        frame = decode_frame(image_data)
+        detector.detectMultiScale(frame.gray, 1.1, 5, minSize=(30, 30))
+        x, y, w, h = face_box(frame.shape)
+        tensor = to_model_input(frame.color[y:y + h, x:x + w])
+        if model is not None:
+            model.predict(tensor[np.newaxis])
+        return time.perf_counter() - started
+
+    for _ in range(3):
+        process(None)
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(process, range(frames)))
+    wall = time.perf_counter() - started
+    return {
+        "budget": thread_budget.as_dict(),
+        "model": model.name if model is not None else None,
+        "frames_per_second": round(frames / wall, 1),
+        "cpu_ms_per_frame": round((time.process_time() - cpu_started) * 1000 / frames, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def measure(frames, concurrency, env_overrides):
+    env = dict(os.environ, **env_overrides)
+    for name in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS", "EMOTION_MODEL_THREADS"]:
+        if name not in env_overrides:
+            env.pop(name, None)
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", "--frames", str(frames), "--concurrency", str(concurrency)],
+        env=env, cwd=SERVICE_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark emotion throughput per thread budget")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--cores", type=int, nargs="+", default=None,
+                        help="Cores-per-worker values to try (default: 1 and all usable cores)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_setting(args.frames, args.concurrency[0])))
+        return 0
+
+    from thread_budget import usable_cores
+    all_cores = usable_cores()
+    cores_values = args.cores or sorted({1, all_cores})
+
+    # "unmanaged" lets every library size itself from the core count, as before
+    settings = [("unmanaged", {"THREAD_BUDGET_CORES": str(all_cores),
+                               "THREAD_BUDGET_CV2_THREADS": str(all_cores),
+                               "THREAD_BUDGET_BLAS_THREADS": str(all_cores)})]
+    settings += [(f"budget {cores} core(s)", {"THREAD_BUDGET_CORES": str(cores)}) for cores in cores_values]
+
+    print(f"🚀 Thread Budget Benchmark ({all_cores} usable cores, {args.frames} frames per run)")
+    print("=" * 86)
+    print(f"{'setting':<20}{'threads':>9}{'model':>9}{'cv2':>6}{'frames/s':>11}{'cpu ms':>9}{'p50 ms':>9}{'p95 ms':>9}")
+    for label, overrides in settings:
+        for concurrency in args.concurrency:
+            result = measure(args.frames, concurrency, overrides)
+            budget = result["budget"]
+            print(f"{label:<20}{concurrency:>9}{budget['model_threads']:>9}{budget['cv2_threads']:>6}"
+                  f"{result['frames_per_second']:>11.1f}{result['cpu_ms_per_frame']:>9.2f}"
+                  f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}")
+    print("=" * 86)
+    print(f"Model: {result['model'] or 'not available (model step skipped)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Emotion Aggregator
+Incremental per-session emotion aggregates, updated in O(1) per prediction.
+
+For every session it keeps:
+  - exponentially weighted class probabilities (time-based half-life), so
+    single-frame flickers don't flip the label used for the conversation
+  - label counts over the last EMOTION_WINDOW_SIZE detections
+  - the dominant (smoothed) emotion, since when it has held and how stable
+    it is within the window
+Readers get a ready-made snapshot instead of rescanning the history.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from emotion_runtime import EMOTION_LABELS
+from emotion_store import EMOTION_SESSION_TTL_SECONDS
+
+EMOTION_SMOOTHING_HALF_LIFE = float(os.getenv("EMOTION_SMOOTHING_HALF_LIFE", "10"))
+EMOTION_WINDOW_SIZE = int(os.getenv("EMOTION_WINDOW_SIZE", "30"))
+# Lower bound on each update's weight, so bursts of frames with the same
+# timestamp still move the average
+EMOTION_SMOOTHING_MIN_ALPHA = float(os.getenv("EMOTION_SMOOTHING_MIN_ALPHA", "0.05"))
+
+# "Calm" comes from the heuristic fallback
+AGGREGATE_LABELS = EMOTION_LABELS + ["Calm"]
+NO_FACE = "No Face"
+_LABEL_INDEX = {label: index for index, label in enumerate(AGGREGATE_LABELS)}
+_NO_FACE_CODE = len(AGGREGATE_LABELS)
+
+
+def label_distribution(emotion, confidence):
+    """
+    Probability vector for a (label, confidence) prediction: the confidence
+    on the label and the remainder spread evenly over the other classes.
+    """
+    others = len(AGGREGATE_LABELS) - 1
+    confidence = min(max(float(confidence), 0.0), 1.0)
+    distribution = np.full(len(AGGREGATE_LABELS), (1.0 - confidence) / others)
+    distribution[_LABEL_INDEX[emotion]] = confidence
+    return distribution
+
+
+class SessionAggregate:
+    __slots__ = ("probabilities", "last_update", "window", "window_counts", "total_counts",
+                 "dominant", "dominant_since", "dominant_streak", "updates", "last_active")
+
+    def __init__(self, window_size):
+        self.probabilities = None
+        self.last_update = None
+        self.window = deque(maxlen=window_size)
+        # One slot per label plus one for "No Face"
+        self.window_counts = np.zeros(len(AGGREGATE_LABELS) + 1, dtype=np.int32)
+        self.total_counts = np.zeros(len(AGGREGATE_LABELS) + 1, dtype=np.int64)
+        self.dominant = None
+        self.dominant_since = None
+        self.dominant_streak = 0
+        self.updates = 0
+        self.last_active = time.monotonic()
+
+
+class EmotionAggregator:
+    def __init__(self, half_life=EMOTION_SMOOTHING_HALF_LIFE, window_size=EMOTION_WINDOW_SIZE,
+                 idle_ttl=EMOTION_SESSION_TTL_SECONDS):
+        self.half_life = half_life
+        self.window_size = max(1, window_size)
+        self.idle_ttl = idle_ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def update(self, session_id, emotion, confidence, probabilities=None, timestamp=None):
+        """
+        Fold one prediction into the session's aggregates.
+
+        Args:
+            probabilities: Full model output over EMOTION_LABELS, if available;
+                otherwise a distribution is derived from (emotion, confidence)
+            timestamp: Epoch seconds of the frame (defaults to now)
+        """
+        now = time.time() if timestamp is None else timestamp
+        with self._lock:
+            aggregate = self._sessions.get(session_id)
+            if aggregate is None:
+                aggregate = SessionAggregate(self.window_size)
+                self._sessions[session_id] = aggregate
+            aggregate.last_active = time.monotonic()
+            aggregate.updates += 1
+
+            code = _LABEL_INDEX.get(emotion, _NO_FACE_CODE)
+            if len(aggregate.window) == aggregate.window.maxlen:
+                aggregate.window_counts[aggregate.window[0]] -= 1
+            aggregate.window.append(code)
+            aggregate.window_counts[code] += 1
+            aggregate.total_counts[code] += 1
+
+            if code == _NO_FACE_CODE:
+                # Nothing to learn about the emotion from an empty frame
+                self._maybe_evict()
+                return
+
+            if probabilities is not None:
+                observed = np.zeros(len(AGGREGATE_LABELS))
+                observed[:len(EMOTION_LABELS)] = probabilities
+            else:
+                observed = label_distribution(emotion, confidence)
+
+            if aggregate.probabilities is None:
+                aggregate.probabilities = observed
+            else:
+                # Time-aware EWMA: a frame half_life seconds later carries half the weight
+                elapsed = max(now - aggregate.last_update, 0.0)
+                alpha = 1.0 - 0.5 ** (elapsed / self.half_life) if self.half_life > 0 else 1.0
+                alpha = max(alpha, EMOTION_SMOOTHING_MIN_ALPHA)
+                aggregate.probabilities += alpha * (observed - aggregate.probabilities)
+            aggregate.last_update = now
+
+            dominant = int(np.argmax(aggregate.probabilities))
+            if dominant == aggregate.dominant:
+                aggregate.dominant_streak += 1
+            else:
+                aggregate.dominant = dominant
+                aggregate.dominant_since = now
+                aggregate.dominant_streak = 1
+            self._maybe_evict()
+
+    def snapshot(self, session_id):
+        """Precomputed aggregates for a session, or {} if it has none"""
+        with self._lock:
+            aggregate = self._sessions.get(session_id)
+            if aggregate is None:
+                return {}
+            window_total = len(aggregate.window)
+            counts = aggregate.window_counts
+            result = {
+                "updates": aggregate.updates,
+                "window_size": window_total,
+                "window_counts": {
+                    label: int(counts[index]) for index, label in enumerate(AGGREGATE_LABELS) if counts[index]
+                },
+                "face_presence": round(1 - counts[_NO_FACE_CODE] / window_total, 3) if window_total else 0.0,
+                "smoothed_emotion": None,
+                "smoothed_confidence": None,
+                "smoothed_probabilities": {},
+                "dominant_since": None,
+                "dominant_streak": 0,
+                "stability": 0.0,
+            }
+            if aggregate.probabilities is not None:
+                dominant = aggregate.dominant
+                result.update({
+                    "smoothed_emotion": AGGREGATE_LABELS[dominant],
+                    "smoothed_confidence": round(float(aggregate.probabilities[dominant]), 3),
+                    "smoothed_probabilities": {
+                        label: round(float(value), 3)
+                        for label, value in zip(AGGREGATE_LABELS, aggregate.probabilities)
+                    },
+                    "dominant_since": aggregate.dominant_since,
+                    "dominant_streak": aggregate.dominant_streak,
+                    # Share of recent frames that agree with the smoothed label
+                    "stability": round(int(counts[dominant]) / window_total, 3) if window_total else 0.0,
+                })
+            return result
+
+    def describe(self, session_id):
+        """One-line summary for prompts, e.g. 'mostly Sad (70% of last 30 frames, steady for 45s)'"""
+        snapshot = self.snapshot(session_id)
+        if not snapshot or snapshot["smoothed_emotion"] is None:
+            return None
+        steady_for = max(0, int(time.time() - snapshot["dominant_since"]))
+        return (f"mostly {snapshot['smoothed_emotion']} ({snapshot['stability']:.0%} of last "
+                f"{snapshot['window_size']} frames, steady for {steady_for}s)")
+
+    def _maybe_evict(self):
+        """Drop idle sessions (caller holds the lock)"""
+        now = time.monotonic()
+        if now - self._last_eviction < 60:
+            return
+        self._last_eviction = now
+        for session_id in [key for key, value in self._sessions.items() if now - value.last_active > self.idle_ttl]:
+            del self._sessions[session_id]
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
@@ -0,0 +1,221 @@
+"""
+Emotion Model Runtime
+Inference backends for the MobileNetV2 emotion classifier.
+
+The exported TFLite (int8 / float16) and ONNX artefacts produced by
+export_emotion_model.py run on tflite-runtime or onnxruntime, so the
+service never has to import full TensorFlow. The original Keras .h5 is
+still supported as a last resort.
+
+Every backend exposes the same call: predict(batch) takes a float32 NHWC
+batch scaled to [0, 1] and returns an (N, 7) array of probabilities.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from thread_budget import thread_budget
+
+EMOTION_LABELS = ["Angry", "Disgust", "Fear", "Happy", "Surprise", "Sad", "Neutral"]
+EMOTION_INPUT_SIZE = 224
+
+EMOTION_MODEL_PATH = os.getenv(
+    "EMOTION_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AI THERAPIST", "mobile_net_v2_firstmodel.h5"),
+)
+EMOTION_MODEL_WARMUP_RUNS = int(os.getenv("EMOTION_MODEL_WARMUP_RUNS", "3"))
+
+# auto | tflite | onnx | keras
+EMOTION_MODEL_BACKEND = os.getenv("EMOTION_MODEL_BACKEND", "auto").lower()
+# Defaults to the worker's thread budget; 0 leaves the thread count to the runtime
+EMOTION_MODEL_THREADS = int(os.getenv("EMOTION_MODEL_THREADS", str(thread_budget.model_threads)))
+
+# Exported artefacts looked for next to the .h5, fastest first
+EXPORT_SUFFIXES = [".int8.tflite", ".fp16.tflite", ".onnx"]
+
+
+class BackendUnavailable(RuntimeError):
+    """Raised when an artefact exists but its runtime is not installed"""
+
+
+def _load_tflite_interpreter(allow_tensorflow=False):
+    """Interpreter class from the smallest runtime that is installed"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    if allow_tensorflow:
+        try:
+            import tensorflow as tf
+            return tf.lite.Interpreter
+        except ImportError:
+            pass
+    raise BackendUnavailable("tflite-runtime is not installed")
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, path, threads=EMOTION_MODEL_THREADS, allow_tensorflow=None):
+        if allow_tensorflow is None:
+            # Explicitly asking for TFLite accepts full TensorFlow as the provider
+            allow_tensorflow = EMOTION_MODEL_BACKEND == "tflite"
+        Interpreter = _load_tflite_interpreter(allow_tensorflow)
+        self.path = path
+        self.interpreter = Interpreter(model_path=path, num_threads=threads or None)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter holds per-invocation state and is not thread-safe
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        shape = list(self._input["shape"])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self._input["index"], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._resize(batch.shape[0])
+
+            dtype = self._input["dtype"]
+            if dtype != np.float32:
+                # Fully integer model: quantize the input with its own parameters
+                scale, zero_point = self._input["quantization"]
+                info = np.iinfo(dtype)
+                batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+
+            if output.dtype != np.float32:
+                scale, zero_point = self._output["quantization"]
+                output = (output.astype(np.float32) - zero_point) * scale
+            return np.array(output, dtype=np.float32)
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path, threads=EMOTION_MODEL_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise BackendUnavailable("onnxruntime is not installed")
+        self.path = path
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: batch})[0]
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, path, threads=EMOTION_MODEL_THREADS):
+        try:
+            import tensorflow as tf
+            from keras.models import load_model
+        except ImportError:
+            raise BackendUnavailable("tensorflow/keras is not installed")
+        if threads:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        self.path = path
+        self.model = load_model(path, compile=False)
+
+    def predict(self, batch):
+        # Calling the model directly skips predict()'s per-call dataset setup
+        return np.asarray(self.model(batch, training=False))
+
+
+BACKENDS = {
+    ".tflite": TFLiteBackend,
+    ".onnx": OnnxBackend,
+    ".h5": KerasBackend,
+    ".keras": KerasBackend,
+}
+
+
+def candidate_paths(model_path, backend=EMOTION_MODEL_BACKEND):
+    """
+    Artefacts to try for a configured model path, in order of preference.
+
+    Pointing EMOTION_MODEL_PATH at a .tflite/.onnx file uses it directly;
+    pointing it at the .h5 prefers exported siblings, e.g.
+    mobile_net_v2_firstmodel.int8.tflite, and falls back to the .h5.
+    """
+    stem, extension = os.path.splitext(model_path)
+    if extension.lower() not in (".h5", ".keras"):
+        return [model_path]
+
+    candidates = [stem + suffix for suffix in EXPORT_SUFFIXES] + [model_path]
+    if backend != "auto":
+        candidates = [path for path in candidates if BACKENDS[os.path.splitext(path)[1].lower()].name == backend]
+    return candidates
+
+
+def load_backend(model_path, backend=EMOTION_MODEL_BACKEND, threads=EMOTION_MODEL_THREADS):
+    """
+    Load the best available backend for a model.
+
+    Returns:
+        Backend instance with .name, .path and .predict(batch)
+
+    Raises:
+        FileNotFoundError: no artefact exists for the model
+        BackendUnavailable: artefacts exist but none of their runtimes is installed
+    """
+    errors = []
+    for path in candidate_paths(model_path, backend):
+        if not os.path.exists(path):
+            continue
+        backend_class = BACKENDS.get(os.path.splitext(path)[1].lower())
+        if backend_class is None:
+            errors.append(f"{os.path.basename(path)}: unknown model format")
+            continue
+        try:
+            return backend_class(path, threads=threads)
+        except BackendUnavailable as e:
+            errors.append(f"{os.path.basename(path)}: {e}")
+
+    if not errors:
+        raise FileNotFoundError(f"No emotion model found for {model_path}")
+    raise BackendUnavailable("; ".join(errors))
+
+
+def warm_up_emotion_model(model, runs=EMOTION_MODEL_WARMUP_RUNS):
+    """
+    Run dummy 224x224 inferences so graph building and kernel selection
+    happen before real frames arrive.
+
+    Returns:
+        list: Latency of each warmup run in ms
+    """
+    dummy = np.zeros((1, EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3), dtype=np.float32)
+    latencies = []
+    for _ in range(max(1, runs)):
+        started = time.perf_counter()
+        model.predict(dummy)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
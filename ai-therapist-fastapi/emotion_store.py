@@ -0,0 +1,332 @@
+"""
+Emotion Store
+Compact, bounded per-session emotion history.
+
+Each session keeps a ring buffer of small integer label codes, float32
+confidences and int64 epoch-microsecond timestamps instead of a list of
+dicts with ISO strings. Buffers grow on demand up to EMOTION_HISTORY_MAX_EVENTS
+and then overwrite the oldest entries. Sessions idle for longer than
+EMOTION_SESSION_TTL_SECONDS are evicted.
+
+Every recorded event gets a per-session sequence number (0, 1, 2, ...)
+that keeps counting after old events are overwritten; it is the cursor for
+delta sync (page) and the event id of the SSE stream (subscribe).
+
+Labels come from a fixed vocabulary, so codes never run out: detections
+are model classes, the fallback's "Calm" or "No Face"; client moods are
+normalised to the lower-case form of one of those (normalise_mood) and
+anything else is rejected.
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from emotion_runtime import EMOTION_LABELS
+
+EMOTION_HISTORY_MAX_EVENTS = int(os.getenv("EMOTION_HISTORY_MAX_EVENTS", "3600"))
+EMOTION_SESSION_TTL_SECONDS = float(os.getenv("EMOTION_SESSION_TTL_SECONDS", "3600"))
+INITIAL_CAPACITY = 64
+EVICTION_INTERVAL = 60
+
+# Event kinds: detections from the camera, moods set by the client
+KIND_EMOTION = 0
+KIND_MOOD = 1
+
+# Everything a detection can be labelled with
+DETECTION_LABELS = EMOTION_LABELS + ["Calm", "No Face"]
+MOOD_LABELS = [label.lower() for label in EMOTION_LABELS + ["Calm"]]
+# Adjective forms clients use for the same moods
+MOOD_ALIASES = {"fearful": "fear", "surprised": "surprise", "disgusted": "disgust"}
+
+
+def normalise_mood(mood):
+    """Canonical lower-case mood, or None if it is not a known one"""
+    if not isinstance(mood, str):
+        return None
+    mood = mood.strip().lower()
+    mood = MOOD_ALIASES.get(mood, mood)
+    return mood if mood in MOOD_LABELS else None
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+def _isoformat(timestamp_us):
+    """Local ISO timestamp, same format as datetime.now().isoformat()"""
+    seconds, micros = divmod(int(timestamp_us), 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micros).isoformat()
+
+
+class SessionHistory:
+    """Ring buffer of one session's events"""
+
+    __slots__ = ("codes", "kinds", "confidences", "timestamps", "count", "total",
+                 "current", "last_active")
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.codes = np.empty(capacity, dtype=np.uint16)
+        self.kinds = np.empty(capacity, dtype=np.uint8)
+        self.confidences = np.empty(capacity, dtype=np.float32)
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.count = 0        # events currently held
+        self.total = 0        # events ever recorded (next sequence number)
+        self.current = None   # (code, confidence, timestamp_us) of the latest detection
+        self.last_active = time.monotonic()
+
+    @property
+    def capacity(self):
+        return len(self.codes)
+
+    def _grow(self, max_events):
+        capacity = min(self.capacity * 2, max_events)
+        for name in ("codes", "kinds", "confidences", "timestamps"):
+            array = getattr(self, name)
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.count] = array[:self.count]
+            setattr(self, name, grown)
+
+    def append(self, code, kind, confidence, timestamp_us, max_events):
+        if self.count == self.capacity and self.capacity < max_events:
+            self._grow(max_events)
+        index = self.total % self.capacity if self.count == self.capacity else self.count
+        self.codes[index] = code
+        self.kinds[index] = kind
+        self.confidences[index] = confidence
+        self.timestamps[index] = timestamp_us
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+        if kind == KIND_EMOTION:
+            self.current = (code, confidence, timestamp_us)
+        self.last_active = time.monotonic()
+        return self.total - 1
+
+    def order(self, start_seq=None, limit=None):
+        """
+        Buffer indexes in chronological order, optionally starting at a
+        sequence number and capped at limit entries.
+
+        Returns:
+            tuple: (indexes, sequence number of the first index)
+        """
+        first_seq = self.total - self.count
+        start = first_seq if start_seq is None else min(max(start_seq, first_seq), self.total)
+        stop = self.total if limit is None else min(self.total, start + limit)
+        if self.count < self.capacity:
+            return np.arange(start, stop), start
+        return np.arange(start, stop) % self.capacity, start
+
+    def nbytes(self):
+        return self.codes.nbytes + self.kinds.nbytes + self.confidences.nbytes + self.timestamps.nbytes
+
+
+class EmotionStore:
+    def __init__(self, max_events=EMOTION_HISTORY_MAX_EVENTS, idle_ttl=EMOTION_SESSION_TTL_SECONDS):
+        self.max_events = max(1, max_events)
+        self.idle_ttl = idle_ttl
+        self._sessions = {}
+        self._labels = DETECTION_LABELS + MOOD_LABELS
+        self._codes = {label: code for code, label in enumerate(self._labels)}
+        self._lock = threading.RLock()
+        self._last_eviction = time.monotonic()
+        self.evicted = 0
+        self._subscribers = {}
+
+    # ------------------------------------------------------------------
+    # Label codes
+    # ------------------------------------------------------------------
+    def _code(self, label):
+        code = self._codes.get(label)
+        if code is None:
+            raise ValueError(f"Unknown emotion label: {label!r}")
+        return code
+
+    def label(self, code):
+        return self._labels[code]
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def _record(self, session_id, label, kind, confidence, timestamp_us):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = SessionHistory(min(INITIAL_CAPACITY, self.max_events))
+                self._sessions[session_id] = session
+            seq = session.append(self._code(label), kind, confidence,
+                                 timestamp_us or _now_us(), self.max_events)
+        self._notify(session_id)
+        self._maybe_evict()
+        return seq
+
+    def record_emotion(self, session_id, emotion, confidence, timestamp_us=None):
+        """Store a detection; returns its sequence number"""
+        return self._record(session_id, emotion, KIND_EMOTION, confidence, timestamp_us)
+
+    def record_mood(self, session_id, mood, timestamp_us=None):
+        """
+        Store a client-reported mood; returns its sequence number
+
+        Raises:
+            ValueError: mood is not one normalise_mood() accepts
+        """
+        label = normalise_mood(mood)
+        if label is None:
+            raise ValueError(f"Unknown mood: {mood!r}")
+        return self._record(session_id, label, KIND_MOOD, 0.0, timestamp_us)
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def _entry(self, session, index):
+        key = "mood" if session.kinds[index] == KIND_MOOD else "emotion"
+        return {key: self._labels[session.codes[index]], "timestamp": _isoformat(session.timestamps[index])}
+
+    def history(self, session_id, since=None, limit=None):
+        """
+        Events in the original JSON shape: {"emotion"|"mood", "timestamp"}.
+
+        Args:
+            since: First sequence number to return (older events are skipped)
+            limit: Maximum number of events
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            indexes, _ = session.order(since, limit)
+            return [self._entry(session, index) for index in indexes]
+
+    def page(self, session_id, since=None, limit=None):
+        """
+        Cursor-based slice of a session's events for delta sync.
+
+        Returns:
+            dict: events (each with its "seq"), next_cursor to pass as since
+            on the next call, has_more, first_available (oldest sequence
+            number still held) and total events ever recorded
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return {"events": [], "next_cursor": since or 0, "has_more": False,
+                        "first_available": 0, "total": 0}
+            indexes, start = session.order(since, limit)
+            events = []
+            for offset, index in enumerate(indexes):
+                entry = self._entry(session, index)
+                entry["seq"] = start + offset
+                events.append(entry)
+            next_cursor = start + len(events)
+            return {
+                "events": events,
+                "next_cursor": next_cursor,
+                "has_more": next_cursor < session.total,
+                "first_available": session.total - session.count,
+                "total": session.total,
+            }
+
+    def recent(self, session_id, n):
+        """Last n events, oldest first"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            return self.history(session_id, since=max(session.total - n, 0))
+
+    def current(self, session_id):
+        """Latest detection as {"emotion", "confidence", "timestamp"}, or {}"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.current is None:
+                return {}
+            code, confidence, timestamp_us = session.current
+            return {
+                "emotion": self._labels[code],
+                "confidence": float(confidence),
+                "timestamp": _isoformat(timestamp_us),
+            }
+
+    def count(self, session_id):
+        """Events ever recorded for a session"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.total if session is not None else 0
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    # ------------------------------------------------------------------
+    # Change notifications
+    # ------------------------------------------------------------------
+    def subscribe(self, session_id, loop, event):
+        """Set an asyncio.Event (on its loop) whenever the session records an event"""
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add((loop, event))
+
+    def unsubscribe(self, session_id, loop, event):
+        with self._lock:
+            subscribers = self._subscribers.get(session_id)
+            if subscribers:
+                subscribers.discard((loop, event))
+                if not subscribers:
+                    del self._subscribers[session_id]
+
+    def _notify(self, session_id):
+        """Wake subscribers; safe from worker threads as well as the event loop"""
+        subscribers = self._subscribers.get(session_id)
+        if not subscribers:
+            return
+        for loop, event in list(subscribers):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop already closed
+                self.unsubscribe(session_id, loop, event)
+
+    # ------------------------------------------------------------------
+    # Eviction and reporting
+    # ------------------------------------------------------------------
+    def _maybe_evict(self):
+        if time.monotonic() - self._last_eviction >= EVICTION_INTERVAL:
+            self.evict_idle()
+
+    def evict_idle(self):
+        """Drop sessions with no events for idle_ttl seconds; returns how many"""
+        now = time.monotonic()
+        with self._lock:
+            self._last_eviction = now
+            idle = [session_id for session_id, session in self._sessions.items()
+                    if now - session.last_active > self.idle_ttl]
+            for session_id in idle:
+                del self._sessions[session_id]
+            self.evicted += len(idle)
+        return len(idle)
+
+    def memory_bytes(self):
+        """Approximate memory held by the store (buffers plus per-session overhead)"""
+        with self._lock:
+            total = sys.getsizeof(self._sessions)
+            for session_id, session in self._sessions.items():
+                total += session.nbytes() + sys.getsizeof(session) + sys.getsizeof(session_id)
+            total += sum(sys.getsizeof(label) for label in self._labels)
+        return total
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._sessions)
+            events = sum(session.count for session in self._sessions.values())
+        return {
+            "sessions": sessions,
+            "events": events,
+            "max_events_per_session": self.max_events,
+            "idle_ttl_seconds": self.idle_ttl,
+            "evicted_sessions": self.evicted,
+            "memory_bytes": self.memory_bytes(),
+        }
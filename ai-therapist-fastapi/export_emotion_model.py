@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Export the MobileNetV2 emotion classifier to lightweight inference formats
+
+Converts mobile_net_v2_firstmodel.h5 to int8 / float16 TFLite (and ONNX when
+tf2onnx is installed), then compares every artefact against the Keras model
+on a fixed evaluation set and writes an accuracy / speed report.
+
+Usage:
+    python export_emotion_model.py
+    python export_emotion_model.py --eval-dir eval_faces --formats int8 fp16 onnx
+
+The evaluation directory holds one sub-folder per label (Angry, Happy, ...)
+with face crops. Without it a seeded synthetic set is used, which still
+measures agreement with the Keras model but not accuracy.
+
+Exported files are written next to the .h5 with the suffixes the service
+looks for (see emotion_runtime.EXPORT_SUFFIXES), so restarting the
+therapist service picks them up automatically.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from emotion_runtime import EMOTION_LABELS, EMOTION_INPUT_SIZE, OnnxBackend, TFLiteBackend
+
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "AI THERAPIST", "mobile_net_v2_firstmodel.h5"
+)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def preprocess(image):
+    """Same preprocessing as predict_emotion in main.py"""
+    resized = cv2.resize(image, (EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE))
+    return resized.astype(np.float32) / 255.0
+
+
+def load_eval_set(eval_dir=None, synthetic_count=200, seed=1234):
+    """
+    Load the fixed evaluation set.
+
+    Returns:
+        tuple: (float32 images N x 224 x 224 x 3, label indices or None)
+    """
+    if eval_dir:
+        images, labels = [], []
+        label_lookup = {label.lower(): index for index, label in enumerate(EMOTION_LABELS)}
+        for folder in sorted(os.listdir(eval_dir)):
+            index = label_lookup.get(folder.lower())
+            folder_path = os.path.join(eval_dir, folder)
+            if index is None or not os.path.isdir(folder_path):
+                continue
+            for name in sorted(os.listdir(folder_path)):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                image = cv2.imread(os.path.join(folder_path, name), cv2.IMREAD_COLOR)
+                if image is None:
+                    continue
+                images.append(preprocess(image))
+                labels.append(index)
+        if not images:
+            raise ValueError(f"No labelled images found in {eval_dir}")
+        return np.stack(images), np.array(labels)
+
+    # Smooth random "faces": blurred noise looks more like real crops to the
+    # network than raw noise, so agreement numbers are meaningful
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(synthetic_count):
+        noise = rng.integers(0, 256, size=(EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3), dtype=np.uint8)
+        images.append(preprocess(cv2.GaussianBlur(noise, (0, 0), sigmaX=rng.uniform(2, 8))))
+    return np.stack(images), None
+
+
+def export_tflite(model, output_path, mode, representative_images):
+    """Convert a Keras model to TFLite with float16 or int8 weights"""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        def representative_dataset():
+            for image in representative_images[:100]:
+                yield [image[np.newaxis, ...]]
+
+        # Integer kernels inside, float32 in/out so callers need no changes
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f"Unknown TFLite mode: {mode}")
+
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def export_onnx(model, output_path):
+    """Convert a Keras model to ONNX (requires tf2onnx)"""
+    import tensorflow as tf
+    import tf2onnx
+
+    signature = (tf.TensorSpec((None, EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=output_path)
+    return output_path
+
+
+def run_batches(predict, images, batch_size=32):
+    return np.concatenate([predict(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+
+
+def measure_latency(predict, images, runs=50):
+    """Single-frame latency, the way the service calls the model"""
+    predict(images[:1])
+    timings = []
+    for index in range(runs):
+        frame = images[index % len(images)][np.newaxis, ...]
+        started = time.perf_counter()
+        predict(frame)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    mean_ms = sum(timings) / len(timings)
+    return {
+        "mean_ms": round(mean_ms, 2),
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "frames_per_second": round(1000 / mean_ms, 1),
+    }
+
+
+def compare(reference, candidate, labels):
+    """Agreement with the Keras model and, with labels, accuracy"""
+    reference_top = reference.argmax(axis=1)
+    candidate_top = candidate.argmax(axis=1)
+    difference = np.abs(reference - candidate)
+    result = {
+        "top1_agreement": round(float((reference_top == candidate_top).mean()), 4),
+        "mean_abs_prob_diff": round(float(difference.mean()), 5),
+        "max_abs_prob_diff": round(float(difference.max()), 5),
+    }
+    if labels is not None:
+        result["accuracy"] = round(float((candidate_top == labels).mean()), 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the emotion model to TFLite / ONNX")
+    parser.add_argument("--model", default=os.getenv("EMOTION_MODEL_PATH", DEFAULT_MODEL_PATH),
+                        help="Path to mobile_net_v2_firstmodel.h5")
+    parser.add_argument("--formats", nargs="+", default=["int8", "fp16", "onnx"],
+                        choices=["int8", "fp16", "onnx"])
+    parser.add_argument("--eval-dir", help="Labelled evaluation images (one folder per emotion)")
+    parser.add_argument("--synthetic", type=int, default=200, help="Synthetic images when no --eval-dir is given")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Inference threads while benchmarking (1 = frames/sec per core)")
+    parser.add_argument("--report", help="Where to write the JSON report (default: next to the model)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"❌ Model not found: {args.model}")
+        return 1
+
+    print("🚀 Emotion Model Export")
+    print("=" * 60)
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from keras.models import load_model
+
+    model = load_model(args.model, compile=False)
+    images, labels = load_eval_set(args.eval_dir, args.synthetic)
+    print(f"📊 Evaluation set: {len(images)} images ({'labelled' if labels is not None else 'synthetic'})")
+
+    def keras_predict(batch):
+        return np.asarray(model(batch, training=False))
+
+    reference = run_batches(keras_predict, images)
+    report = {
+        "model": os.path.abspath(args.model),
+        "eval_set": {
+            "source": os.path.abspath(args.eval_dir) if args.eval_dir else f"synthetic:{args.synthetic}",
+            "images": len(images),
+        },
+        "threads": args.threads,
+        "artefacts": {
+            "keras": {
+                "path": os.path.abspath(args.model),
+                "size_bytes": os.path.getsize(args.model),
+                "latency": measure_latency(keras_predict, images),
+                **compare(reference, reference, labels),
+            }
+        },
+    }
+
+    stem = os.path.splitext(args.model)[0]
+    for fmt in args.formats:
+        output_path = f"{stem}.{fmt}.tflite" if fmt in ("int8", "fp16") else f"{stem}.onnx"
+        try:
+            if fmt == "onnx":
+                export_onnx(model, output_path)
+                backend = OnnxBackend(output_path, threads=args.threads)
+            else:
+                export_tflite(model, output_path, fmt, images)
+                backend = TFLiteBackend(output_path, threads=args.threads, allow_tensorflow=True)
+        except ImportError as e:
+            print(f"⚠️ Skipping {fmt}: {e}")
+            continue
+
+        outputs = run_batches(backend.predict, images)
+        report["artefacts"][fmt] = {
+            "path": os.path.abspath(output_path),
+            "size_bytes": os.path.getsize(output_path),
+            "latency": measure_latency(backend.predict, images),
+            **compare(reference, outputs, labels),
+        }
+        print(f"✅ Exported {fmt}: {output_path}")
+
+    keras_fps = report["artefacts"]["keras"]["latency"]["frames_per_second"]
+    print("=" * 60)
+    print(f"{'artefact':<10}{'size MB':>9}{'agree':>8}{'accuracy':>10}{'ms/frame':>10}{'fps':>8}{'speedup':>9}")
+    for name, entry in report["artefacts"].items():
+        latency = entry["latency"]
+        entry["speedup_vs_keras"] = round(latency["frames_per_second"] / keras_fps, 2)
+        accuracy = f"{entry['accuracy']:.3f}" if "accuracy" in entry else "-"
+        print(f"{name:<10}{entry['size_bytes'] / 1e6:>9.1f}{entry['top1_agreement']:>8.3f}{accuracy:>10}"
+              f"{latency['mean_ms']:>10.2f}{latency['frames_per_second']:>8.1f}{entry['speedup_vs_keras']:>8.2f}x")
+
+    report_path = args.report or f"{stem}.export_report.json"
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Report written to {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Face Tracker
+Per-session face tracking between webcam frames.
+
+During a therapy session the face barely moves, so scanning the whole
+image pyramid on every frame is wasted work. Each session remembers its
+last face box; the next frame is searched only inside an expanded region
+around it and only at scales close to the last face size. A full-frame
+detection still runs every FACE_TRACK_FULL_DETECT_EVERY frames, and
+immediately whenever the tracked search loses the face.
+
+MultiFaceTracker is the group-session variant: every face in the frame
+is found with one full-frame pass and matched to the session's previous
+faces by box overlap, so each person keeps the same track id from frame
+to frame.
+"""
+
+import os
+import threading
+import time
+
+import cv2
+
+from therapist_metrics import Counter, Histogram
+
+FACE_TRACK_FULL_DETECT_EVERY = int(os.getenv("FACE_TRACK_FULL_DETECT_EVERY", "15"))
+# Search region = last box grown by this fraction of its size on every side
+FACE_TRACK_SEARCH_MARGIN = float(os.getenv("FACE_TRACK_SEARCH_MARGIN", "0.5"))
+# Accepted face sizes relative to the last box
+FACE_TRACK_MIN_SCALE = float(os.getenv("FACE_TRACK_MIN_SCALE", "0.75"))
+FACE_TRACK_MAX_SCALE = float(os.getenv("FACE_TRACK_MAX_SCALE", "1.33"))
+FACE_TRACK_IDLE_SECONDS = float(os.getenv("FACE_TRACK_IDLE_SECONDS", "300"))
+# Multi-face mode: faces analysed per frame (largest first)
+MULTI_FACE_MAX = int(os.getenv("MULTI_FACE_MAX", "8"))
+# Minimum box overlap (IoU) for a face to keep its previous track id
+MULTI_FACE_MATCH_IOU = float(os.getenv("MULTI_FACE_MATCH_IOU", "0.3"))
+# Frames a face may go undetected before its track id is retired
+MULTI_FACE_LOST_FRAMES = int(os.getenv("MULTI_FACE_LOST_FRAMES", "5"))
+
+# Original detectMultiScale settings
+SCALE_FACTOR = 1.1
+MIN_NEIGHBORS = 3
+MIN_FACE_SIZE = 30
+MAX_FACE_SIZE = 300
+# Smallest window the frontal-face cascade can evaluate
+CASCADE_WINDOW = 24
+
+face_detections = Counter(
+    "therapist_face_detections_total",
+    "Face detection passes by mode (full frame, tracked region, tracked miss, multi-face).",
+)
+face_detect_seconds = Histogram(
+    "therapist_face_detect_seconds",
+    "CPU time spent in Haar face detection per frame.",
+    [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1],
+)
+
+
+class FaceTrack:
+    """Last known face of one session, in full-resolution pixel coordinates"""
+
+    __slots__ = ("box", "frames_since_full", "last_seen")
+
+    def __init__(self, box):
+        self.box = box
+        self.frames_since_full = 0
+        self.last_seen = time.monotonic()
+
+
+class FaceTracker:
+    def __init__(self, detector, full_detect_every=FACE_TRACK_FULL_DETECT_EVERY,
+                 margin=FACE_TRACK_SEARCH_MARGIN, idle_seconds=FACE_TRACK_IDLE_SECONDS):
+        self.detector = detector
+        self.full_detect_every = max(1, full_detect_every)
+        self.margin = margin
+        self.idle_seconds = idle_seconds
+        self._tracks = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def _detect(self, gray, min_side, max_side):
+        return self.detector.detectMultiScale(
+            gray,
+            scaleFactor=SCALE_FACTOR,
+            minNeighbors=MIN_NEIGHBORS,
+            minSize=(min_side, min_side),
+            maxSize=(max_side, max_side),
+            flags=cv2.CASCADE_SCALE_IMAGE,
+        )
+
+    def _full_detect(self, frame):
+        # Size limits are for full-resolution frames
+        min_side = max(CASCADE_WINDOW, MIN_FACE_SIZE // frame.scale)
+        max_side = MAX_FACE_SIZE // frame.scale
+        return [tuple(int(v) for v in face) for face in self._detect(frame.gray, min_side, max_side)]
+
+    def _tracked_detect(self, frame, track):
+        """Search only around the last box, at sizes close to it"""
+        scale = frame.scale
+        x, y, w, h = (value // scale for value in track.box)
+        if w < CASCADE_WINDOW or h < CASCADE_WINDOW:
+            return []
+
+        height, width = frame.gray.shape
+        pad_x, pad_y = int(w * self.margin), int(h * self.margin)
+        left, top = max(x - pad_x, 0), max(y - pad_y, 0)
+        right, bottom = min(x + w + pad_x, width), min(y + h + pad_y, height)
+
+        min_side = max(CASCADE_WINDOW, int(min(w, h) * FACE_TRACK_MIN_SCALE))
+        max_side = min(int(max(w, h) * FACE_TRACK_MAX_SCALE), right - left, bottom - top)
+        if max_side < min_side:
+            return []
+
+        faces = self._detect(frame.gray[top:bottom, left:right], min_side, max_side)
+        return [(int(fx) + left, int(fy) + top, int(fw), int(fh)) for fx, fy, fw, fh in faces]
+
+    def detect(self, frame, session_id=None):
+        """
+        Face boxes (x, y, w, h) in the frame's pixel coordinates.
+
+        Without a session id every call is a full-frame detection, which is
+        the original behaviour.
+        """
+        started = time.process_time()
+        track = None
+        if session_id is not None:
+            with self._lock:
+                track = self._tracks.get(session_id)
+
+        faces = []
+        if track is not None and track.frames_since_full < self.full_detect_every:
+            faces = self._tracked_detect(frame, track)
+            face_detections.inc(mode="tracked" if faces else "tracked_miss")
+
+        tracked = bool(faces)
+        if not tracked:
+            faces = self._full_detect(frame)
+            face_detections.inc(mode="full")
+        face_detect_seconds.observe(time.process_time() - started)
+
+        if session_id is not None:
+            self._update(session_id, track, faces, frame.scale, tracked)
+        return faces
+
+    def _update(self, session_id, track, faces, scale, tracked):
+        now = time.monotonic()
+        with self._lock:
+            if not faces:
+                self._tracks.pop(session_id, None)
+            else:
+                x, y, w, h = max(faces, key=lambda rect: rect[2] * rect[3])
+                box = (x * scale, y * scale, w * scale, h * scale)
+                if track is None:
+                    track = FaceTrack(box)
+                self._tracks[session_id] = track
+                track.box = box
+                track.last_seen = now
+                track.frames_since_full = track.frames_since_full + 1 if tracked else 0
+
+            if now - self._last_sweep > 60:
+                self._last_sweep = now
+                for idle_id in [key for key, value in self._tracks.items()
+                                if now - value.last_seen > self.idle_seconds]:
+                    del self._tracks[idle_id]
+
+    def forget(self, session_id):
+        with self._lock:
+            self._tracks.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            active = len(self._tracks)
+        return {
+            "tracked_sessions": active,
+            "full_detections": face_detections.value(mode="full"),
+            "tracked_detections": face_detections.value(mode="tracked"),
+            "tracked_misses": face_detections.value(mode="tracked_miss"),
+            "mean_detect_ms": round(face_detect_seconds.mean() * 1000, 3),
+        }
+
+
+def _overlap(a, b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / (a[2] * a[3] + b[2] * b[3] - intersection)
+
+
+class FaceGroup:
+    """Faces of one multi-face session: track id -> [box, frames missed]"""
+
+    __slots__ = ("faces", "next_id", "last_seen")
+
+    def __init__(self):
+        self.faces = {}
+        self.next_id = 1
+        self.last_seen = time.monotonic()
+
+
+class MultiFaceTracker(FaceTracker):
+    def __init__(self, detector, max_faces=MULTI_FACE_MAX, match_iou=MULTI_FACE_MATCH_IOU,
+                 lost_frames=MULTI_FACE_LOST_FRAMES, idle_seconds=FACE_TRACK_IDLE_SECONDS):
+        super().__init__(detector, idle_seconds=idle_seconds)
+        self.max_faces = max(1, max_faces)
+        self.match_iou = match_iou
+        self.lost_frames = lost_frames
+
+    def detect(self, frame, session_id=None):
+        """
+        Up to max_faces faces, largest first, as (track_id, box) pairs.
+
+        Boxes are in the frame's pixel coordinates. Without a session id
+        track ids are just 1..n for this frame.
+        """
+        started = time.process_time()
+        faces = sorted(self._full_detect(frame), key=lambda rect: rect[2] * rect[3], reverse=True)
+        faces = faces[:self.max_faces]
+        face_detections.inc(mode="multi")
+        face_detect_seconds.observe(time.process_time() - started)
+
+        if session_id is None:
+            return list(enumerate(faces, start=1))
+        return self._assign(session_id, faces, frame.scale)
+
+    def _assign(self, session_id, faces, scale):
+        """Give each face the id of the previous face it overlaps most"""
+        boxes = [tuple(value * scale for value in face) for face in faces]
+        now = time.monotonic()
+        with self._lock:
+            group = self._tracks.get(session_id)
+            if group is None:
+                group = self._tracks[session_id] = FaceGroup()
+            group.last_seen = now
+
+            pairs = sorted(
+                ((_overlap(box, track[0]), index, track_id)
+                 for index, box in enumerate(boxes) for track_id, track in group.faces.items()),
+                reverse=True,
+            )
+            ids = [None] * len(boxes)
+            matched = set()
+            for iou, index, track_id in pairs:
+                if iou < self.match_iou:
+                    break
+                if ids[index] is None and track_id not in matched:
+                    ids[index] = track_id
+                    matched.add(track_id)
+
+            for track_id, track in list(group.faces.items()):
+                if track_id not in matched:
+                    track[1] += 1
+                    if track[1] > self.lost_frames:
+                        del group.faces[track_id]
+            for index, box in enumerate(boxes):
+                if ids[index] is None:
+                    ids[index] = group.next_id
+                    group.next_id += 1
+                group.faces[ids[index]] = [box, 0]
+
+            if now - self._last_sweep > 60:
+                self._last_sweep = now
+                for idle_id in [key for key, value in self._tracks.items()
+                                if now - value.last_seen > self.idle_seconds]:
+                    del self._tracks[idle_id]
+        return list(zip(ids, faces))
+
+    def stats(self):
+        with self._lock:
+            sessions = len(self._tracks)
+            faces = sum(len(group.faces) for group in self._tracks.values())
+        return {
+            "sessions": sessions,
+            "tracked_faces": faces,
+            "max_faces": self.max_faces,
+            "detections": face_detections.value(mode="multi"),
+        }
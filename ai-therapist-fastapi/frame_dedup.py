@@ -0,0 +1,158 @@
+"""
+Frame Dedup
+Per-session near-duplicate frame detection.
+
+A still patient produces webcam frames that are almost identical, yet
+each one would go through face detection and the emotion model. For every
+session we keep tiny grayscale thumbnails of the last analysed frame: the
+whole frame (32 x 24) and the face region (24 x 24). A new frame whose
+thumbnails differ from those by less than the thresholds (mean absolute
+difference in gray levels) reuses the previous result. The face
+thumbnail has the lower threshold, so expression changes still trigger a
+new analysis. Results are never reused for longer than
+FRAME_DEDUP_MAX_AGE_SECONDS, nor across emotion model swaps (results are
+tagged with the model generation they were produced by).
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from therapist_metrics import Counter
+
+FRAME_DEDUP_ENABLED = os.getenv("FRAME_DEDUP_ENABLED", "1") != "0"
+FRAME_DEDUP_FRAME_THRESHOLD = float(os.getenv("FRAME_DEDUP_FRAME_THRESHOLD", "4.0"))
+FRAME_DEDUP_FACE_THRESHOLD = float(os.getenv("FRAME_DEDUP_FACE_THRESHOLD", "2.5"))
+FRAME_DEDUP_MAX_AGE_SECONDS = float(os.getenv("FRAME_DEDUP_MAX_AGE_SECONDS", "5"))
+FRAME_DEDUP_IDLE_SECONDS = float(os.getenv("FRAME_DEDUP_IDLE_SECONDS", "300"))
+
+FRAME_THUMBNAIL = (32, 24)
+FACE_THUMBNAIL = (24, 24)
+# Weight of each new sample in the running mean cost of an analysis
+COST_SMOOTHING = 0.1
+
+frame_dedup_frames = Counter(
+    "therapist_frame_dedup_frames_total",
+    "Frames by dedup outcome (analysed, skipped as near-duplicate).",
+)
+frame_dedup_cpu_saved = Counter(
+    "therapist_frame_dedup_cpu_saved_seconds_total",
+    "Estimated CPU time saved by reusing results for near-duplicate frames.",
+)
+
+
+def _thumbnail(gray, size):
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def _difference(a, b):
+    return float(np.mean(np.abs(a - b)))
+
+
+class AnalysedFrame:
+    """Thumbnails and result of a session's last fully analysed frame"""
+
+    __slots__ = ("frame_thumb", "face_thumb", "box", "result", "generation", "analysed_at")
+
+    def __init__(self, frame_thumb, face_thumb, box, result, generation):
+        self.frame_thumb = frame_thumb
+        self.face_thumb = face_thumb
+        self.box = box
+        self.result = result
+        self.generation = generation
+        self.analysed_at = time.monotonic()
+
+
+class FrameDeduplicator:
+    def __init__(self, frame_threshold=FRAME_DEDUP_FRAME_THRESHOLD, face_threshold=FRAME_DEDUP_FACE_THRESHOLD,
+                 max_age=FRAME_DEDUP_MAX_AGE_SECONDS, idle_seconds=FRAME_DEDUP_IDLE_SECONDS):
+        self.frame_threshold = frame_threshold
+        self.face_threshold = face_threshold
+        self.max_age = max_age
+        self.idle_seconds = idle_seconds
+        self._frames = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.analysis_cost = None  # Running mean CPU seconds of one full analysis
+
+    @staticmethod
+    def _face_thumb(frame, box):
+        """Thumbnail of a full-resolution box in this frame, or None"""
+        if box is None:
+            return None
+        x, y, w, h = (value // frame.scale for value in box)
+        region = frame.gray[y:y + h, x:x + w]
+        if region.shape[0] < 4 or region.shape[1] < 4:
+            return None
+        return _thumbnail(region, FACE_THUMBNAIL)
+
+    def lookup(self, session_id, frame, generation=None):
+        """
+        The previous result if this frame is a near-duplicate of the
+        session's last analysed frame (analysed by the same model
+        generation), else None.
+        """
+        with self._lock:
+            last = self._frames.get(session_id)
+        if last is None or last.generation != generation or time.monotonic() - last.analysed_at > self.max_age:
+            return None
+
+        started = time.thread_time()
+        if _difference(_thumbnail(frame.gray, FRAME_THUMBNAIL), last.frame_thumb) > self.frame_threshold:
+            return None
+        if last.face_thumb is not None:
+            face_thumb = self._face_thumb(frame, last.box)
+            if face_thumb is None or _difference(face_thumb, last.face_thumb) > self.face_threshold:
+                return None
+
+        frame_dedup_frames.inc(outcome="skipped")
+        if self.analysis_cost is not None:
+            frame_dedup_cpu_saved.inc(max(self.analysis_cost - (time.thread_time() - started), 0.0))
+        return last.result
+
+    def remember(self, session_id, frame, result, box=None, cpu_seconds=None, generation=None):
+        """
+        Store a fully analysed frame.
+
+        Args:
+            result: Value lookup() returns for near-duplicates of this frame
+            box: Face box (x, y, w, h) in full-resolution pixels, if any
+            cpu_seconds: CPU time the analysis took (for the savings estimate)
+            generation: Model generation the result came from; lookups
+                under another generation miss
+        """
+        frame_dedup_frames.inc(outcome="analysed")
+        if cpu_seconds is not None:
+            self.analysis_cost = cpu_seconds if self.analysis_cost is None else (
+                self.analysis_cost + COST_SMOOTHING * (cpu_seconds - self.analysis_cost))
+        analysed = AnalysedFrame(_thumbnail(frame.gray, FRAME_THUMBNAIL), self._face_thumb(frame, box), box, result,
+                                 generation)
+
+        now = time.monotonic()
+        with self._lock:
+            self._frames[session_id] = analysed
+            if now - self._last_sweep > 60:
+                self._last_sweep = now
+                for idle_id in [key for key, value in self._frames.items()
+                                if now - value.analysed_at > self.idle_seconds]:
+                    del self._frames[idle_id]
+
+    def forget(self, session_id):
+        with self._lock:
+            self._frames.pop(session_id, None)
+
+    def stats(self):
+        skipped = frame_dedup_frames.value(outcome="skipped")
+        analysed = frame_dedup_frames.value(outcome="analysed")
+        total = skipped + analysed
+        return {
+            "enabled": FRAME_DEDUP_ENABLED,
+            "frames_analysed": analysed,
+            "frames_skipped": skipped,
+            "skip_rate": round(skipped / total, 3) if total else 0.0,
+            "mean_analysis_cpu_ms": round(self.analysis_cost * 1000, 2) if self.analysis_cost else None,
+            "cpu_saved_seconds": round(frame_dedup_cpu_saved.value(), 3),
+        }
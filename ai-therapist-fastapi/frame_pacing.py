@@ -0,0 +1,101 @@
+"""
+Frame Pacing
+Recommends how long a client should wait before sending its next frame.
+
+Every emotion result carries next_frame_interval_ms:
+  - while the emotion is changing (the latest label disagrees with the
+    smoothed one, or the smoothed label is new) clients sample at the
+    fastest rate so changes are picked up quickly
+  - the steadier the smoothed emotion and the higher its confidence, the
+    longer the interval, up to FRAME_INTERVAL_STABLE_MS
+  - every interval, the fastest one included, is then stretched by server
+    load: active sessions per core above FRAME_PACING_SESSIONS_PER_CORE
+    and the inference queue backlog beyond one batch both lengthen it, up
+    to FRAME_INTERVAL_MAX_MS
+"""
+
+import os
+import threading
+import time
+
+from therapist_metrics import Histogram
+from thread_budget import thread_budget
+
+FRAME_INTERVAL_MIN_MS = int(os.getenv("FRAME_INTERVAL_MIN_MS", "500"))
+FRAME_INTERVAL_STABLE_MS = int(os.getenv("FRAME_INTERVAL_STABLE_MS", "3000"))
+FRAME_INTERVAL_NO_FACE_MS = int(os.getenv("FRAME_INTERVAL_NO_FACE_MS", "2000"))
+FRAME_INTERVAL_MAX_MS = int(os.getenv("FRAME_INTERVAL_MAX_MS", "10000"))
+FRAME_PACING_SESSIONS_PER_CORE = float(os.getenv("FRAME_PACING_SESSIONS_PER_CORE", "8"))
+# Sessions that sent a frame within this window count as active
+FRAME_PACING_ACTIVE_SECONDS = float(os.getenv("FRAME_PACING_ACTIVE_SECONDS", "30"))
+# A smoothed label needs this many consecutive agreeing frames to count as settled
+SETTLED_STREAK = 3
+
+frame_interval_histogram = Histogram(
+    "therapist_frame_interval_ms",
+    "Recommended next-frame interval sent to clients.",
+    [250, 500, 1000, 2000, 3000, 5000, 10000],
+)
+
+
+class FramePacer:
+    def __init__(self, batch_size, capacity_cores=thread_budget.cores):
+        self.batch_size = max(1, batch_size)
+        self.session_capacity = max(1.0, capacity_cores * FRAME_PACING_SESSIONS_PER_CORE)
+        self._last_seen = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def active_sessions(self):
+        return len(self._last_seen)
+
+    def _touch(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._last_seen[session_id] = now
+            if now - self._last_sweep > FRAME_PACING_ACTIVE_SECONDS:
+                self._last_sweep = now
+                for idle_id in [key for key, seen in self._last_seen.items()
+                                if now - seen > FRAME_PACING_ACTIVE_SECONDS]:
+                    del self._last_seen[idle_id]
+
+    def load_factor(self, queue_depth):
+        """1.0 when unloaded, growing with session count and inference backlog"""
+        session_load = self.active_sessions() / self.session_capacity
+        backlog = queue_depth / self.batch_size
+        return max(1.0, session_load, backlog)
+
+    def next_interval(self, session_id, emotion, confidence, aggregates, queue_depth=0):
+        """
+        Recommended delay in ms before the session's next frame.
+
+        Args:
+            emotion, confidence: This frame's result
+            aggregates: EmotionAggregator snapshot for the session
+            queue_depth: Crops waiting for the emotion model
+        """
+        self._touch(session_id)
+
+        smoothed = aggregates.get("smoothed_emotion")
+        if emotion == "No Face":
+            interval = FRAME_INTERVAL_NO_FACE_MS
+        elif smoothed is None or emotion != smoothed or aggregates.get("dominant_streak", 0) < SETTLED_STREAK:
+            # Emotion is changing: sample fast
+            interval = FRAME_INTERVAL_MIN_MS
+        else:
+            steadiness = aggregates.get("stability", 0.0) * min(max(confidence, 0.0), 1.0)
+            interval = FRAME_INTERVAL_MIN_MS + (FRAME_INTERVAL_STABLE_MS - FRAME_INTERVAL_MIN_MS) * steadiness
+
+        # Load stretches every interval, the fast "changing" one included
+        interval = min(max(interval * self.load_factor(queue_depth), FRAME_INTERVAL_MIN_MS), FRAME_INTERVAL_MAX_MS)
+        interval = int(round(interval))
+        frame_interval_histogram.observe(interval)
+        return interval
+
+    def stats(self, queue_depth=0):
+        return {
+            "active_sessions": self.active_sessions(),
+            "session_capacity": round(self.session_capacity, 1),
+            "load_factor": round(self.load_factor(queue_depth), 2),
+            "mean_interval_ms": round(frame_interval_histogram.mean(), 1),
+        }
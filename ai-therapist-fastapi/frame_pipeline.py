@@ -0,0 +1,147 @@
+"""
+Frame Pipeline
+Decode-once preprocessing for webcam frames sent to the therapist service.
+
+A frame is base64-decoded and JPEG-decoded exactly once, at reduced
+resolution when it is much larger than face detection needs. The colour
+image and its grayscale conversion are then shared by the face detector,
+the emotion model and the heuristic fallback. Model inputs are resized and
+normalised into per-thread float32 buffers instead of fresh float64 copies.
+"""
+
+import base64
+import binascii
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from emotion_runtime import EMOTION_INPUT_SIZE
+
+# Frames whose longer side is at least twice this are decoded at 1/2, 1/4
+# or 1/8 scale; webcam frames (640x480) are decoded at full size
+FRAME_TARGET_SIZE = int(os.getenv("FRAME_TARGET_SIZE", "640"))
+
+_REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+_buffers = threading.local()
+
+
+class Frame:
+    """One decoded frame: colour image, shared grayscale view and decode scale"""
+
+    __slots__ = ("color", "gray", "scale")
+
+    def __init__(self, color, scale=1):
+        self.color = color
+        self.gray = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self.color.shape
+
+
+def jpeg_size(data):
+    """
+    Read (width, height) from a JPEG header without decoding it.
+
+    Returns:
+        tuple or None if the data is not a JPEG or the header is cut short
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    index = 2
+    length = len(data)
+    while index + 4 <= length:
+        if data[index] != 0xFF:
+            return None
+        marker = data[index + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            index += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            index += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            if index + 9 > length:
+                return None
+            height = int.from_bytes(data[index + 5:index + 7], "big")
+            width = int.from_bytes(data[index + 7:index + 9], "big")
+            return width, height
+        segment_length = int.from_bytes(data[index + 2:index + 4], "big")
+        index += 2 + segment_length
+    return None
+
+
+def reduction_for(size, target=FRAME_TARGET_SIZE):
+    """Largest JPEG decode reduction (1, 2, 4, 8) that keeps the longer side >= target"""
+    if size is None or target <= 0:
+        return 1
+    longer = max(size)
+    scale = 1
+    while scale < 8 and longer // (scale * 2) >= target:
+        scale *= 2
+    return scale
+
+
+def decode_frame(image_data):
+    """
+    Decode a frame sent as base64 text or raw bytes.
+
+    Returns:
+        Frame, or None if the data is not a decodable image
+    """
+    if isinstance(image_data, str):
+        if image_data.startswith("data:"):
+            # Data URL from canvas.toDataURL()
+            image_data = image_data.split(",", 1)[-1]
+        try:
+            image_data = base64.b64decode(image_data)
+        except (binascii.Error, ValueError):
+            return None
+
+    buffer = np.frombuffer(image_data, np.uint8)
+    if buffer.size == 0:
+        return None
+
+    scale = reduction_for(jpeg_size(image_data))
+    color = cv2.imdecode(buffer, _REDUCED_COLOR_FLAGS[scale])
+    if color is None:
+        return None
+    return Frame(color, scale)
+
+
+def _thread_buffers():
+    """Per-thread resize/normalise buffers, allocated once per worker thread"""
+    buffers = getattr(_buffers, "value", None)
+    if buffers is None:
+        buffers = (
+            np.empty((EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3), dtype=np.uint8),
+            np.empty((EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3), dtype=np.float32),
+        )
+        _buffers.value = buffers
+    return buffers
+
+
+def to_model_input(face_roi):
+    """
+    Resize a BGR face crop to the model input and scale it to [0, 1].
+
+    The result is a per-thread float32 buffer: it stays valid until the same
+    thread prepares its next crop, so callers must finish with it (or copy
+    it) before that.
+    """
+    resized, normalized = _thread_buffers()
+    cv2.resize(face_roi, (EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE), dst=resized)
+    np.multiply(resized, np.float32(1.0 / 255.0), out=normalized, casting="unsafe")
+    return normalized
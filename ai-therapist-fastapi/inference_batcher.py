@@ -0,0 +1,157 @@
+"""
+Inference Batcher
+Cross-session micro-batching for the emotion model.
+
+Face crops from every session are queued here instead of each request
+running its own batch-of-one predict. A single worker thread takes the
+oldest crop, keeps collecting for up to EMOTION_BATCH_MAX_WAIT_MS or until
+EMOTION_BATCH_MAX_SIZE crops are waiting, runs one batched predict and
+hands each caller its own row of probabilities.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from therapist_metrics import Counter, Gauge, Histogram
+
+EMOTION_BATCH_MAX_SIZE = int(os.getenv("EMOTION_BATCH_MAX_SIZE", "16"))
+EMOTION_BATCH_MAX_WAIT_MS = float(os.getenv("EMOTION_BATCH_MAX_WAIT_MS", "5"))
+EMOTION_PREDICT_TIMEOUT = float(os.getenv("EMOTION_PREDICT_TIMEOUT", "10"))
+
+batch_size_histogram = Histogram(
+    "therapist_emotion_batch_size",
+    "Face crops per batched emotion model call.",
+    [1, 2, 4, 8, 16, 32, 64],
+)
+queue_wait_histogram = Histogram(
+    "therapist_emotion_queue_wait_seconds",
+    "Time a face crop waited in the batching queue before inference started.",
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0],
+)
+batch_latency_histogram = Histogram(
+    "therapist_emotion_batch_inference_seconds",
+    "Wall time of one batched emotion model call.",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+batch_errors = Counter(
+    "therapist_emotion_batch_errors_total",
+    "Batched emotion model calls that raised.",
+)
+
+
+class _PendingCrop:
+    __slots__ = ("model", "tensor", "future", "enqueued")
+
+    def __init__(self, model, tensor):
+        self.model = model
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    def __init__(self, max_batch_size=EMOTION_BATCH_MAX_SIZE, max_wait_ms=EMOTION_BATCH_MAX_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = queue.Queue()
+        self._carry = None
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="emotion-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, model, tensor):
+        """
+        Queue one preprocessed crop (224 x 224 x 3 float32) for a model.
+
+        Returns:
+            concurrent.futures.Future resolving to that crop's probabilities
+        """
+        self._ensure_worker()
+        pending = _PendingCrop(model, tensor)
+        self._queue.put(pending)
+        return pending.future
+
+    def predict(self, model, tensor, timeout=EMOTION_PREDICT_TIMEOUT):
+        """Blocking helper for code running in worker threads"""
+        return self.submit(model, tensor).result(timeout=timeout)
+
+    def predict_many(self, model, tensors, timeout=EMOTION_PREDICT_TIMEOUT):
+        """
+        Several crops at once (e.g. every face of one frame). They are all
+        queued before waiting, so they share one batched call.
+        """
+        futures = [self.submit(model, tensor) for tensor in tensors]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        """Block for the next crop, then gather a batch for the same model"""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                pending = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if pending.model is not first.model:
+                # A model switch happened: finish this batch on the old model
+                # and start the next one with this crop
+                self._carry = pending
+                break
+            batch.append(pending)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for pending in batch:
+                queue_wait_histogram.observe(started - pending.enqueued)
+            batch_size_histogram.observe(len(batch))
+
+            try:
+                probabilities = batch[0].model.predict(np.stack([pending.tensor for pending in batch]))
+            except Exception as e:
+                batch_errors.inc()
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+            batch_latency_histogram.observe(time.perf_counter() - started)
+
+            for pending, row in zip(batch, probabilities):
+                pending.future.set_result(row)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "queue_depth": self.queue_depth(),
+            "batches": batch_size_histogram.count,
+            "mean_batch_size": round(batch_size_histogram.mean(), 2),
+            "mean_queue_wait_ms": round(queue_wait_histogram.mean() * 1000, 2),
+        }
+
+
+emotion_batcher = MicroBatcher()
+
+Gauge(
+    "therapist_emotion_queue_depth",
+    "Face crops waiting for the emotion model.",
+    emotion_batcher.queue_depth,
+)
@@ -0,0 +1,331 @@
+"""
+Inference Server
+One process that owns the emotion model for every API worker.
+
+With several uvicorn workers each one would otherwise load its own copy
+of the model. Instead, run this once per host:
+
+    python inference_server.py
+
+and start the API workers with EMOTION_INFERENCE_SOCKET set to the same
+socket path. Each worker creates a shared-memory block of
+EMOTION_SHM_SLOTS crop slots (224 x 224 x 3 float32 in, 7 float32 out)
+and tells the server its name. Per batch, only a tiny message with the
+slot count crosses the Unix socket. The server reads the pixels straight
+out of shared memory, runs them through the same MicroBatcher (so crops
+from different workers share model calls), writes the probabilities back
+into the slots and replies. Pixel data is never pickled or copied through
+the socket, and model memory stays constant as workers are added.
+
+Only the user running the server can connect. The default socket lives
+in a private (0700) per-user directory, the socket itself is 0600, and
+connections are authenticated with a key: EMOTION_INFERENCE_AUTHKEY if
+set, otherwise a random key the server writes to <socket>.key (0600) on
+every start and workers read when they connect.
+"""
+
+import os
+import secrets
+import stat
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+import numpy as np
+
+from emotion_runtime import (
+    EMOTION_INPUT_SIZE,
+    EMOTION_LABELS,
+    EMOTION_MODEL_PATH,
+    load_backend,
+    warm_up_emotion_model,
+)
+from inference_batcher import EMOTION_PREDICT_TIMEOUT, emotion_batcher
+
+EMOTION_INFERENCE_SOCKET = os.getenv("EMOTION_INFERENCE_SOCKET", "")
+DEFAULT_SOCKET_DIR = os.path.join(tempfile.gettempdir(), f"therapist-inference-{os.getuid()}")
+DEFAULT_SOCKET = os.path.join(DEFAULT_SOCKET_DIR, "inference.sock")
+EMOTION_INFERENCE_AUTHKEY = os.getenv("EMOTION_INFERENCE_AUTHKEY", "")
+EMOTION_SHM_SLOTS = int(os.getenv("EMOTION_SHM_SLOTS", "32"))
+RECONNECT_INTERVAL = 5
+
+INPUT_SHAPE = (EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE, 3)
+INPUT_BYTES = int(np.prod(INPUT_SHAPE)) * 4
+OUTPUT_BYTES = len(EMOTION_LABELS) * 4
+
+
+def authkey_path(socket_path):
+    return socket_path + ".key"
+
+
+def _private_dir(path):
+    """Create the socket directory (0700); refuse one that others can reach"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{path} must be a directory owned by this user with mode 0700")
+
+
+def _write_authkey(socket_path):
+    """Fresh random key in <socket>.key, readable by this user only"""
+    key = secrets.token_bytes(32)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(socket_path) or ".", prefix=".authkey-")  # 0600
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(key)
+    os.replace(temporary, authkey_path(socket_path))
+    return key
+
+
+def read_authkey(socket_path):
+    """Key for connecting to the server at socket_path"""
+    if EMOTION_INFERENCE_AUTHKEY:
+        return EMOTION_INFERENCE_AUTHKEY.encode("utf-8")
+    with open(authkey_path(socket_path), "rb") as handle:
+        return handle.read()
+
+
+def slot_views(buffer, slots):
+    """(inputs, outputs) arrays laid over a shared-memory buffer"""
+    inputs = np.ndarray((slots,) + INPUT_SHAPE, dtype=np.float32, buffer=buffer)
+    outputs = np.ndarray((slots, len(EMOTION_LABELS)), dtype=np.float32, buffer=buffer,
+                         offset=slots * INPUT_BYTES)
+    return inputs, outputs
+
+
+def _attach(name):
+    """Open a worker's block without letting this process unlink it on exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attachment with the resource tracker
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+# ----------------------------------------------------------------------
+# Server
+# ----------------------------------------------------------------------
+class InferenceServer:
+    def __init__(self, socket_path=DEFAULT_SOCKET, model_path=EMOTION_MODEL_PATH):
+        self.socket_path = socket_path
+        self.model_path = model_path
+        self.model = None
+        self.status = {"state": "not_started", "path": model_path, "backend": None, "error": None}
+        self.clients = 0
+        self.crops = 0
+        self._stats_lock = threading.Lock()  # Counters are updated from every client thread
+
+    def load_model(self):
+        self.status["state"] = "loading"
+        try:
+            started = time.perf_counter()
+            model = load_backend(self.model_path)
+            self.status.update(path=model.path, backend=model.name, state="warming_up")
+            latencies = warm_up_emotion_model(model)
+            self.model = model
+            self.status.update(state="ready", load_ms=round((time.perf_counter() - started) * 1000, 1),
+                               warmup_steady_ms=round(latencies[-1], 1))
+            print(f"[SUCCESS] Inference server model ready on {model.name} backend ({self.status['load_ms']} ms)")
+        except Exception as e:
+            self.status.update(state="failed", error=str(e))
+            print(f"[ERROR] Inference server could not load the model: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            clients, crops = self.clients, self.crops
+        return dict(self.status, clients=clients, crops=crops, batcher=emotion_batcher.stats())
+
+    def _serve_client(self, connection):
+        block = None
+        with self._stats_lock:
+            self.clients += 1
+        try:
+            _, name, slots = connection.recv()  # ("hello", shm name, slot count)
+            block = _attach(name)
+            if not isinstance(slots, int) or not 0 < slots <= block.size // (INPUT_BYTES + OUTPUT_BYTES):
+                raise ValueError(f"bad slot count {slots!r} for a {block.size} byte block")
+            inputs, outputs = slot_views(block.buf, slots)
+            connection.send(("ready", self.stats()))
+
+            while True:
+                message = connection.recv()
+                if message[0] == "status":
+                    connection.send(("status", self.stats()))
+                    continue
+
+                _, count = message  # ("infer", crops in slots 0..count-1)
+                if not isinstance(count, int) or not 0 < count <= slots:
+                    connection.send(("error", f"bad crop count {count!r} (client registered {slots} slots)"))
+                    continue
+                model = self.model
+                if model is None:
+                    connection.send(("error", f"model not ready ({self.status['state']})"))
+                    continue
+                try:
+                    # Copies: after a timeout the client reuses its slots while the batcher may still hold these
+                    futures = [emotion_batcher.submit(model, inputs[slot].copy()) for slot in range(count)]
+                    for slot, future in enumerate(futures):
+                        outputs[slot] = future.result(timeout=EMOTION_PREDICT_TIMEOUT)
+                    with self._stats_lock:
+                        self.crops += count
+                    connection.send(("ok", count))
+                except Exception as e:
+                    connection.send(("error", str(e)))
+        except (EOFError, OSError):
+            pass
+        except (ValueError, TypeError) as e:
+            print(f"[ERROR] Dropping inference client: {e}")
+        finally:
+            with self._stats_lock:
+                self.clients -= 1
+            connection.close()
+            if block is not None:
+                # Drop array views before closing the mapping
+                inputs = outputs = None
+                block.close()
+
+    def serve_forever(self):
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if socket_dir == DEFAULT_SOCKET_DIR or not os.path.exists(socket_dir):
+            _private_dir(socket_dir)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        authkey = EMOTION_INFERENCE_AUTHKEY.encode("utf-8") if EMOTION_INFERENCE_AUTHKEY else _write_authkey(self.socket_path)
+        threading.Thread(target=self.load_model, name="inference-model-loader", daemon=True).start()
+
+        previous_umask = os.umask(0o177)  # Socket file is created 0600
+        try:
+            listener = Listener(self.socket_path, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(previous_umask)
+        with listener:
+            print(f"[INFO] Inference server listening on {self.socket_path}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    print(f"[ERROR] Rejected inference client: {e}")
+                    continue
+                threading.Thread(target=self._serve_client, args=(connection,),
+                                 name="inference-client", daemon=True).start()
+
+
+# ----------------------------------------------------------------------
+# Client (used by API workers in place of a local model)
+# ----------------------------------------------------------------------
+class InferenceUnavailable(RuntimeError):
+    pass
+
+
+class RemoteEmotionModel:
+    """
+    Backend-compatible proxy: predict(batch) runs on the inference server.
+
+    Calls are serialised per worker (the local MicroBatcher already merges
+    this worker's crops into one call), so the slots are reused in order
+    and no allocator is needed.
+    """
+
+    name = "shared"
+
+    def __init__(self, socket_path=EMOTION_INFERENCE_SOCKET or DEFAULT_SOCKET, slots=EMOTION_SHM_SLOTS):
+        self.socket_path = socket_path
+        self.path = socket_path
+        self.slots = max(1, slots)
+        self._block = shared_memory.SharedMemory(create=True, size=self.slots * (INPUT_BYTES + OUTPUT_BYTES))
+        self._inputs, self._outputs = slot_views(self._block.buf, self.slots)
+        self._connection = None
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self.server_status = {}
+
+    def _connect(self):
+        if self._connection is not None:
+            return self._connection
+        if time.monotonic() - self._last_attempt < RECONNECT_INTERVAL and self._last_attempt:
+            raise InferenceUnavailable("inference server unreachable")
+        self._last_attempt = time.monotonic()
+        try:
+            # Re-read on every connect: a restarted server writes a new key
+            connection = Client(self.socket_path, family="AF_UNIX", authkey=read_authkey(self.socket_path))
+            connection.send(("hello", self._block.name, self.slots))
+            _, self.server_status = connection.recv()
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise InferenceUnavailable(f"inference server unreachable: {e}")
+        self._connection = connection
+        return connection
+
+    def _request(self, message):
+        connection = self._connect()
+        try:
+            connection.send(message)
+            return connection.recv()
+        except (OSError, EOFError) as e:
+            # Server restarted: reconnect (and re-send the block name) next time
+            self._connection = None
+            raise InferenceUnavailable(f"inference server connection lost: {e}")
+
+    def status(self):
+        with self._lock:
+            _, self.server_status = self._request(("status",))
+            return self.server_status
+
+    def predict(self, batch):
+        results = np.empty((len(batch), len(EMOTION_LABELS)), dtype=np.float32)
+        with self._lock:
+            for start in range(0, len(batch), self.slots):
+                chunk = batch[start:start + self.slots]
+                self._inputs[:len(chunk)] = chunk
+                reply = self._request(("infer", len(chunk)))
+                if reply[0] != "ok":
+                    raise InferenceUnavailable(reply[1])
+                scores = self._outputs[:len(chunk)]
+                if reply[1] != len(chunk) or not np.isfinite(scores).all():
+                    raise InferenceUnavailable(f"inference server returned an invalid reply for {len(chunk)} crops")
+                results[start:start + len(chunk)] = scores
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._inputs = self._outputs = None
+            self._block.close()
+            self._block.unlink()
+
+
+def connect_remote_model(timeout=60):
+    """
+    Connect to the inference server and wait for its model to be ready.
+
+    Returns:
+        RemoteEmotionModel
+
+    Raises:
+        InferenceUnavailable: server unreachable, or its model failed to load
+    """
+    model = RemoteEmotionModel()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            status = model.status()
+        except InferenceUnavailable:
+            status = {}
+            model._last_attempt = 0.0  # Server may still be starting; keep trying
+        if status.get("state") == "ready":
+            model.name = f"shared:{status.get('backend')}"
+            return model
+        if status.get("state") == "failed" or time.monotonic() >= deadline:
+            model.close()
+            raise InferenceUnavailable(
+                f"inference server model failed: {status.get('error')}" if status.get("state") == "failed"
+                else "timed out waiting for the inference server"
+            )
+        time.sleep(0.5)
+
+if __name__ == "__main__":
+    InferenceServer(EMOTION_INFERENCE_SOCKET or DEFAULT_SOCKET).serve_forever()
@@ -1,4 +1,8 @@
-from fastapi import FastAPI, WebSocket, HTTPException
+# Sets OpenMP/BLAS/TF thread counts, so it must be imported before numpy/cv2
+from thread_budget import thread_budget, apply_thread_budget, apply_threadpool_budget
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import cv2
@@ -9,12 +13,26 @@ import os
 from groq import Groq
 from dotenv import load_dotenv
 import re
+import hmac
 import uuid
 from datetime import datetime, timedelta
 import asyncio
-import tensorflow as tf
+import threading
 from collections import Counter
 import time
+from typing import List, Optional
+from emotion_runtime import EMOTION_LABELS, EMOTION_MODEL_PATH, load_backend, warm_up_emotion_model
+from inference_batcher import emotion_batcher
+from frame_pacing import FramePacer
+from frame_pipeline import decode_frame, to_model_input
+from face_tracker import FaceTracker, MultiFaceTracker
+from frame_dedup import FrameDeduplicator, FRAME_DEDUP_ENABLED
+from session_channel import EmotionPushFilter, LatestFrameQueue, ws_frames
+from state_backend import create_state_backend, affinity_key, STATE_POLL_SECONDS, WORKER_ID
+from emotion_aggregator import EmotionAggregator
+from emotion_store import MOOD_LABELS, normalise_mood
+from therapist_metrics import render_metrics
+from session_persistence import session_repository, SESSION_HISTORY_PAGE_SIZE, SESSION_HISTORY_MAX_PAGE_SIZE
 
 # Load environment variables
 load_dotenv('config.env')
@@ -33,9 +51,10 @@ app.add_middleware(
 # Global variables
 emotion_model = None
 face_detector = None
-current_emotions = {}
-emotion_history = {}
-active_sessions = {}
+emotion_store = create_state_backend()  # Per-session emotion/mood history (THERAPIST_STATE_BACKEND)
+emotion_aggregator = EmotionAggregator()  # Smoothed per-session aggregates, updated per detection
+frame_pacer = FramePacer(emotion_batcher.max_batch_size)  # Recommends each client's next frame interval
+active_sessions = {}  # WebSockets connected to this worker
 groq_client = None  # ✅ Add Groq client
 
 # Pydantic models
@@ -47,6 +66,21 @@ class EmotionDetectionResponse(BaseModel):
     emotion: str
     confidence: float
     session_id: str
+    next_frame_interval_ms: int
+
+class FaceEmotion(BaseModel):
+    track_id: int
+    emotion: str
+    confidence: float
+    box: List[int]  # x, y, w, h in full-resolution pixels
+
+class MultiFaceEmotionResponse(BaseModel):
+    faces: List[FaceEmotion]  # Largest face first
+    emotion: str  # Largest face's emotion, recorded as the session's
+    confidence: float
+    primary_track_id: Optional[int]
+    session_id: str
+    next_frame_interval_ms: int
 
 class ChatRequest(BaseModel):
     message: str
@@ -68,6 +102,9 @@ except Exception as e:
     print(f"❌ Error initializing Groq AI: {e}")
     groq_client = None
 
+# Keep OpenCV/BLAS/model thread pools within this worker's share of the CPU
+apply_thread_budget()
+
 # Initialize OpenCV face detector
 try:
     face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
@@ -80,30 +117,126 @@ except Exception as e:
     print(f"[ERROR] Error initializing face detector: {e}")
     face_detector = None
 
-# Load the emotion detection model
-def load_emotion_model():
+# Per-session tracking so steady webcam streams skip full-frame detection
+face_tracker = FaceTracker(face_detector) if face_detector is not None else None
+# Group sessions: every face per frame, with stable per-person track ids
+multi_face_tracker = MultiFaceTracker(face_detector) if face_detector is not None else None
+frame_dedup = FrameDeduplicator()  # Reuses results for near-identical frames of a session
+
+# Emotion model lifecycle
+# Set to the inference_server.py socket to share one model across workers
+EMOTION_INFERENCE_SOCKET = os.getenv("EMOTION_INFERENCE_SOCKET", "")
+# Load state reported by /health. predict_emotion keeps using the heuristic
+# fallback until load_emotion_model() has finished warming the model up.
+model_status = {
+    "state": "not_started",   # not_started | loading | warming_up | ready | reloading | failed
+    "path": EMOTION_MODEL_PATH,
+    "backend": None,
+    "generation": 0,          # Models swapped in so far
+    "loaded_at": None,
+    "load_ms": None,
+    "warmup_first_ms": None,
+    "warmup_steady_ms": None,
+    "error": None,
+}
+# One load or reload at a time
+model_load_lock = threading.Lock()
+# /admin/reload-model is only enabled with a token, sent as X-Reload-Token
+EMOTION_MODEL_RELOAD_TOKEN = os.getenv("EMOTION_MODEL_RELOAD_TOKEN", "")
+
+def _model_load_failed(error):
+    """Record a failed (re)load; a model that is already serving stays in place"""
+    if emotion_model is None:
+        print("[INFO] Using fallback emotion detection (no ML model)")
+        model_status.update(state="failed", error=error)
+    else:
+        print(f"[INFO] Keeping the current {model_status['backend']} model")
+        model_status.update(state="ready", error=error)
+    return False
+
+def load_emotion_model(model_path=EMOTION_MODEL_PATH):
+    """
+    Load and warm up the emotion model, then switch predictions over to it
+
+    Also used to hot-reload: the current model (or the fallback) keeps
+    serving until the new one is warm, and requests already running finish
+    on the model they started with.
+    """
+    with model_load_lock:
+        return _load_emotion_model(model_path)
+
+def _load_emotion_model(model_path):
     global emotion_model
+    model_status.update(state="reloading" if emotion_model is not None else "loading", error=None)
     try:
-        # Try to load the model from the AI THERAPIST directory
-        model_path = "../AI THERAPIST/mobile_net_v2_firstmodel.h5"
-        if os.path.exists(model_path):
-            from keras.models import load_model
-            try:
-                emotion_model = load_model(model_path, compile=False)
-                print("[SUCCESS] Emotion model loaded successfully from AI THERAPIST directory")
-                return True
-            except Exception as model_error:
-                print(f"[ERROR] Model loading failed due to compatibility issues: {model_error}")
-                print("[INFO] Using fallback emotion detection (no ML model)")
-                return False
-        else:
+        started = time.perf_counter()
+        if EMOTION_INFERENCE_SOCKET:
+            return connect_inference_server(started)
+        try:
+            # Prefers exported TFLite/ONNX artefacts next to the .h5
+            model = load_backend(model_path)
+        except FileNotFoundError:
             print("[ERROR] Model file not found at:", model_path)
-            print("[INFO] Using fallback emotion detection (no ML model)")
-            return False
+            return _model_load_failed("Model file not found")
+        except Exception as model_error:
+            print(f"[ERROR] Model loading failed: {model_error}")
+            return _model_load_failed(str(model_error))
+        load_ms = round((time.perf_counter() - started) * 1000, 1)
+
+        if emotion_model is None:
+            model_status["state"] = "warming_up"
+        latencies = warm_up_emotion_model(model)
+
+        # Single reference assignment: requests see either the previous model
+        # (or the fallback) or a fully warmed new one, never a half-initialised
+        # one. Requests holding the old reference finish on it, and the
+        # batcher never mixes two models in one batch.
+        emotion_model = model
+        model_status.update(
+            state="ready", path=model.path, backend=model.name, generation=model_status["generation"] + 1,
+            loaded_at=datetime.now().isoformat(timespec="seconds"), load_ms=load_ms,
+            warmup_first_ms=round(latencies[0], 1), warmup_steady_ms=round(latencies[-1], 1),
+        )
+        print(f"[SUCCESS] Emotion model ready on {model.name} backend (load {model_status['load_ms']} ms, "
+              f"warmup first {model_status['warmup_first_ms']} ms, steady {model_status['warmup_steady_ms']} ms)")
+        return True
     except Exception as e:
         print(f"[ERROR] Error loading emotion model: {e}")
-        print("[INFO] Using fallback emotion detection (no ML model)")
-        return False
+        return _model_load_failed(str(e))
+
+def connect_inference_server(started):
+    """Shared mode: use the inference server's model instead of loading one here"""
+    global emotion_model
+    from inference_server import connect_remote_model, InferenceUnavailable
+    try:
+        model = connect_remote_model()
+    except InferenceUnavailable as e:
+        print(f"[ERROR] Inference server unavailable: {e}")
+        return _model_load_failed(str(e))
+    model_status.update(path=model.path, backend=model.name, state="ready", generation=model_status["generation"] + 1,
+                        loaded_at=datetime.now().isoformat(timespec="seconds"),
+                        load_ms=round((time.perf_counter() - started) * 1000, 1))
+    emotion_model = model
+    print(f"[SUCCESS] Using shared inference server at {model.path} ({model.name})")
+    return True
+
+@app.on_event("startup")
+async def start_emotion_model_loading():
+    """Load the model in the background so the API starts serving immediately"""
+    apply_threadpool_budget()
+    threading.Thread(target=load_emotion_model, name="emotion-model-loader", daemon=True).start()
+
+@app.on_event("shutdown")
+async def flush_saved_sessions():
+    """Write out sessions still queued for the database"""
+    await run_in_threadpool(session_repository.close)
+
+@app.on_event("shutdown")
+async def release_emotion_model():
+    """Free the shared-memory slots used to talk to the inference server"""
+    if hasattr(emotion_model, "close"):
+        emotion_model.close()
+
 def clean_text(text):
     """Clean text by removing emojis and special characters"""
     import re
@@ -113,77 +246,65 @@ def clean_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def predict_emotion(face_image):
-    """Predict emotion using the MobileNetV2 model or fallback method"""
+def predict_emotion(face_image, gray_face=None):
+    """
+    Predict emotion using the MobileNetV2 model or fallback method
+
+    Args:
+        face_image: BGR face crop (a view into the decoded frame)
+        gray_face: Matching grayscale crop, reused by the fallback if given
+    """
     try:
-        if emotion_model is None:
-            return predict_emotion_fallback(face_image)
-        
-        # Decode the image if it's base64
-        if isinstance(face_image, str):
-            face_image = base64.b64decode(face_image)
-        
-        # Convert to numpy array
-        if not isinstance(face_image, np.ndarray):
-            face_image = cv2.imdecode(np.frombuffer(face_image, np.uint8), cv2.IMREAD_COLOR)
-        
-        # Ensure array is C-contiguous
-        face_image = np.ascontiguousarray(face_image)
-        
-        # Resize to model input size (224x224)
-        final_image = cv2.resize(face_image, (224, 224))
-        final_image = np.expand_dims(final_image, axis=0)
-        final_image = final_image / 255.0  # Normalize
-        final_image = np.ascontiguousarray(final_image)
-
-        # Make prediction
-        predictions = emotion_model.predict(final_image, verbose=0)
-        
-        # Emotion labels (same as in the original AI THERAPIST)
-        emotion_labels = ["Angry", "Disgust", "Fear", "Happy", "Surprise", "Sad", "Neutral"]
-        predicted_emotion = emotion_labels[np.argmax(predictions)]
+        # Snapshot the reference so a concurrent model switch can't split this call
+        model = emotion_model
+        if model is None:
+            return predict_emotion_fallback(face_image, gray_face)
+
+        # Resize + normalise into this thread's reusable float32 buffer
+        final_image = to_model_input(face_image)
+
+        # Batched together with crops from other sessions
+        predictions = emotion_batcher.predict(model, final_image)
+
+        predicted_emotion = EMOTION_LABELS[np.argmax(predictions)]
         confidence = float(np.max(predictions))
-        
+
         return predicted_emotion, confidence
-        
+
     except Exception as e:
         print(f"Model prediction failed: {e}")
-        return predict_emotion_fallback(face_image)
+        return predict_emotion_fallback(face_image, gray_face)
 
-def predict_emotion_fallback(face_image):
+def predict_emotion_fallback(face_image, gray_face=None):
     """Fallback emotion detection using basic image analysis"""
     try:
-        # Decode the image if it's base64
-        if isinstance(face_image, str):
-            face_image = base64.b64decode(face_image)
-        
-        # Convert to numpy array
-        face_image = cv2.imdecode(np.frombuffer(face_image, np.uint8), cv2.IMREAD_COLOR)
-        
-        if face_image is None:
+        if face_image is None or face_image.size == 0:
             return "Neutral", 0.3
-        
-        # Ensure array is C-contiguous
-        face_image = np.ascontiguousarray(face_image)
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
-        
+
+        # Reuse the grayscale crop from face detection when we have it
+        if gray_face is not None:
+            gray = gray_face
+        elif face_image.ndim == 2:
+            gray = face_image
+        else:
+            gray = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
+
         # Calculate basic features
-        brightness = np.mean(gray)
-        contrast = np.std(gray)
-        
+        brightness, contrast = cv2.meanStdDev(gray)
+        brightness = float(brightness[0][0])
+        contrast = float(contrast[0][0])
+
         # Calculate additional features for better emotion detection
         # Edge detection for facial expressions
         edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
-        
+        edge_density = cv2.countNonZero(edges) / (edges.shape[0] * edges.shape[1])
+
         # Calculate variance for expression intensity
-        variance = np.var(gray)
-        
+        variance = contrast * contrast
+
         # Debug information
         print(f"Fallback analysis - Brightness: {brightness:.2f}, Contrast: {contrast:.2f}, Edge density: {edge_density:.3f}, Variance: {variance:.2f}")
-        
+
         # Improved heuristics based on image features
         if brightness > 120 and edge_density > 0.1:
             return "Happy", 0.7
@@ -205,150 +326,203 @@ def predict_emotion_fallback(face_image):
                 return "Sad", 0.5
             else:
                 return "Neutral", 0.5
-        
+
     except Exception as e:
         print(f"Fallback prediction failed: {e}")
         return "Neutral", 0.5
-    """Detect emotion from a single image using face detection + emotion prediction"""
+
+def expand_roi(x, y, w, h, scale_w, scale_h, img_shape):
+    """Grow a face box around its centre, clipped to the image"""
+    new_x = max(int(x - w * (scale_w - 1) / 2), 0)
+    new_y = max(int(y - h * (scale_h - 1) / 2), 0)
+    new_w = min(int(w * scale_w), img_shape[1] - new_x)
+    new_h = min(int(h * scale_h), img_shape[0] - new_y)
+    return new_x, new_y, new_w, new_h
+
+def detect_emotion_from_image(image_data, session_id=None):
+    """
+    Detect emotion from a single image using face detection + emotion prediction
+
+    With a session_id the face is tracked between that session's frames and
+    near-duplicates of the last analysed frame reuse its result.
+    """
     try:
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
+        # Decode once (at reduced resolution for oversized frames)
+        frame = decode_frame(image_data)
+
+        if frame is None:
             return "Neutral", 0.3
-        
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
+
         # Detect faces
-        if face_detector is None:
+        if face_tracker is None:
             return "Neutral", 0.3
-            
-        faces = face_detector.detectMultiScale(
-            gray, 
-            scaleFactor=1.1,   # Original sensitivity
-            minNeighbors=3,    # Original strictness
-            minSize=(30, 30),  # Original minimum size
-            maxSize=(300, 300), # Original maximum size
-            flags=cv2.CASCADE_SCALE_IMAGE
-        )
-        
-        if len(faces) == 0:
-            return "No Face", 0.0
-        
-        # Get the largest face
-        largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
-        x, y, w, h = largest_face
-        
-        # Validate face size - should be reasonable for a full face
-        if w < 20 or h < 20:
-            return "No Face", 0.0
-        
-        # Expand ROI for better emotion detection
-        def expand_roi(x, y, w, h, scale_w, scale_h, img_shape):
-            new_x = max(int(x - w * (scale_w - 1) / 2), 0)
-            new_y = max(int(y - h * (scale_h - 1) / 2), 0)
-            new_w = min(int(w * scale_w), img_shape[1] - new_x)
-            new_h = min(int(h * scale_h), img_shape[0] - new_y)
-            return new_x, new_y, new_w, new_h
-        
-        scale_w = 1.3  # Original horizontal expansion
-        scale_h = 1.5  # Original vertical expansion
-        new_x, new_y, new_w, new_h = expand_roi(x, y, w, h, scale_w, scale_h, image.shape)
-        
-        # Extract face region
-        face_roi = image[new_y:new_y+new_h, new_x:new_x+new_w]
-        # Ensure face ROI is C-contiguous before processing
-        face_roi = np.ascontiguousarray(face_roi)
-        
-        # Predict emotion
-        emotion, confidence = predict_emotion(face_roi)
-        
-        # Convert Surprise to Neutral (as in original)
-        if emotion == "Surprise":
-            emotion = "Neutral"
-            
-        print(f"Face detected: {w}x{h} at ({x},{y}) - Emotion: {emotion} ({confidence:.2f})")
-        
+
+        dedup = FRAME_DEDUP_ENABLED and session_id is not None
+        # Results from a replaced model must not be reused
+        generation = model_status["generation"]
+        if dedup:
+            cached = frame_dedup.lookup(session_id, frame, generation)
+            if cached is not None:
+                return cached
+
+        # CPU of this thread only; the batched model call runs elsewhere,
+        # so the savings estimate is conservative
+        started = time.thread_time()
+        emotion, confidence, box = analyse_frame(frame, session_id)
+        if dedup:
+            frame_dedup.remember(session_id, frame, (emotion, confidence), box, time.thread_time() - started,
+                                 generation)
         return emotion, confidence
-        
+
     except Exception as e:
         print(f"❌ ERROR IN EMOTION DETECTION: {e}")
         print("=" * 50)
         return "Neutral", 0.5
 
-def detect_emotion_from_image(image_data):
-    """Detect emotion from a single image using face detection + emotion prediction"""
+def locate_face(frame, session_id=None):
+    """
+    Largest plausible face in a decoded frame
+
+    Returns:
+        tuple: (box in full-resolution pixels, colour crop, grayscale crop),
+        or None if there is no usable face
+    """
+    faces = face_tracker.detect(frame, session_id)
+
+    if len(faces) == 0:
+        return None
+
+    # Get the largest face
+    largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
+    return crop_face(frame, largest_face)
+
+def crop_face(frame, face):
+    """
+    Expanded crops of one detected face (frame pixel coordinates)
+
+    Returns:
+        tuple: (box in full-resolution pixels, colour crop, grayscale crop),
+        or None if the face is too small to be usable
+    """
+    x, y, w, h = face
+
+    # Validate face size - should be reasonable for a full face
+    if w * frame.scale < 20 or h * frame.scale < 20:
+        return None
+
+    # Expand ROI for better emotion detection
+    scale_w = 1.3  # Original horizontal expansion
+    scale_h = 1.5  # Original vertical expansion
+    new_x, new_y, new_w, new_h = expand_roi(x, y, w, h, scale_w, scale_h, frame.shape)
+
+    # Colour and grayscale crops are views into the decoded frame, no copies
+    face_roi = frame.color[new_y:new_y+new_h, new_x:new_x+new_w]
+    gray_roi = frame.gray[new_y:new_y+new_h, new_x:new_x+new_w]
+
+    box = tuple(value * frame.scale for value in face)
+    return box, face_roi, gray_roi
+
+def reported_emotion(emotion):
+    """Convert Surprise to Neutral (as in original)"""
+    return "Neutral" if emotion == "Surprise" else emotion
+
+def analyse_frame(frame, session_id=None):
+    """
+    Full face detection + emotion prediction for a decoded frame
+
+    Returns:
+        tuple: (emotion, confidence, face box in full-resolution pixels or None)
+    """
+    located = locate_face(frame, session_id)
+    if located is None:
+        return "No Face", 0.0, None
+    box, face_roi, gray_roi = located
+
+    # Predict emotion
+    emotion, confidence = predict_emotion(face_roi, gray_roi)
+    emotion = reported_emotion(emotion)
+
+    x, y, w, h = box
+    print(f"Face detected: {w}x{h} at ({x},{y}) - Emotion: {emotion} ({confidence:.2f})")
+
+    return emotion, confidence, box
+
+def analyse_faces(frame, session_id=None):
+    """
+    Emotions of every face in a decoded frame, classified in one batched call
+
+    Returns:
+        list: {"track_id", "emotion", "confidence", "box"} per face, largest first
+    """
+    crops = []
+    for track_id, face in multi_face_tracker.detect(frame, session_id):
+        located = crop_face(frame, face)
+        if located is not None:
+            crops.append((track_id, located))
+    if not crops:
+        return []
+
+    model = emotion_model
+    predictions = None
+    if model is not None:
+        try:
+            # Copies: to_model_input reuses one buffer per thread
+            tensors = [to_model_input(face_roi).copy() for _, (_, face_roi, _) in crops]
+            rows = emotion_batcher.predict_many(model, tensors)
+            predictions = [(EMOTION_LABELS[np.argmax(row)], float(np.max(row))) for row in rows]
+        except Exception as e:
+            print(f"Model prediction failed: {e}")
+    if predictions is None:
+        predictions = [predict_emotion_fallback(face_roi, gray_roi) for _, (_, face_roi, gray_roi) in crops]
+
+    faces = []
+    for (track_id, (box, _, _)), (emotion, confidence) in zip(crops, predictions):
+        faces.append({
+            "track_id": track_id,
+            "emotion": reported_emotion(emotion),
+            "confidence": confidence,
+            "box": [int(value) for value in box],
+        })
+    print(f"Faces detected: {len(faces)} - " + ", ".join(
+        f"#{face['track_id']} {face['emotion']} ({face['confidence']:.2f})" for face in faces))
+    return faces
+
+def detect_faces_from_image(image_data, session_id=None):
+    """
+    Multi-face variant of detect_emotion_from_image
+
+    Near-duplicate frames reuse the previous result, keyed separately from
+    the session's single-face results.
+    """
     try:
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if image is None:
-            return "Neutral", 0.3
-        
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces
-        if face_detector is None:
-            return "Neutral", 0.3
-            
-        faces = face_detector.detectMultiScale(
-            gray, 
-            scaleFactor=1.1,   # Original sensitivity
-            minNeighbors=3,    # Original strictness
-            minSize=(30, 30),  # Original minimum size
-            maxSize=(300, 300), # Original maximum size
-            flags=cv2.CASCADE_SCALE_IMAGE
-        )
-        
-        if len(faces) == 0:
-            return "No Face", 0.0
-        
-        # Get the largest face
-        largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
-        x, y, w, h = largest_face
-        
-        # Validate face size - should be reasonable for a full face
-        if w < 20 or h < 20:
-            return "No Face", 0.0
-        
-        # Expand ROI for better emotion detection
-        def expand_roi(x, y, w, h, scale_w, scale_h, img_shape):
-            new_x = max(int(x - w * (scale_w - 1) / 2), 0)
-            new_y = max(int(y - h * (scale_h - 1) / 2), 0)
-            new_w = min(int(w * scale_w), img_shape[1] - new_x)
-            new_h = min(int(h * scale_h), img_shape[0] - new_y)
-            return new_x, new_y, new_w, new_h
-        
-        scale_w = 1.3  # Original horizontal expansion
-        scale_h = 1.5  # Original vertical expansion
-        new_x, new_y, new_w, new_h = expand_roi(x, y, w, h, scale_w, scale_h, image.shape)
-        
-        # Extract face region
-        face_roi = image[new_y:new_y+new_h, new_x:new_x+new_w]
-        # Ensure face ROI is C-contiguous before processing
-        face_roi = np.ascontiguousarray(face_roi)
-        
-        # Predict emotion
-        emotion, confidence = predict_emotion(face_roi)
-        
-        # Convert Surprise to Neutral (as in original)
-        if emotion == "Surprise":
-            emotion = "Neutral"
-            
-        print(f"Face detected: {w}x{h} at ({x},{y}) - Emotion: {emotion} ({confidence:.2f})")
-        
-        return emotion, confidence
-        
+        frame = decode_frame(image_data)
+        if frame is None or multi_face_tracker is None:
+            return []
+
+        dedup_key = f"{session_id}#faces" if FRAME_DEDUP_ENABLED and session_id is not None else None
+        generation = model_status["generation"]
+        if dedup_key:
+            cached = frame_dedup.lookup(dedup_key, frame, generation)
+            if cached is not None:
+                return cached
+
+        started = time.thread_time()
+        faces = analyse_faces(frame, session_id)
+        if dedup_key:
+            box = tuple(faces[0]["box"]) if faces else None
+            frame_dedup.remember(dedup_key, frame, faces, box, time.thread_time() - started, generation)
+        return faces
+
     except Exception as e:
-        print(f"❌ ERROR IN EMOTION DETECTION: {e}")
-        print("=" * 50)
-        return "Neutral", 0.5
+        print(f"❌ ERROR IN MULTI-FACE EMOTION DETECTION: {e}")
+        return []
+
+def primary_face(faces):
+    """Session-level emotion, confidence and track id from the largest face"""
+    if not faces:
+        return "No Face", 0.0, None
+    return faces[0]["emotion"], faces[0]["confidence"], faces[0]["track_id"]
+
 def generate_therapist_response(message, emotion, session_id):
     """Generate AI therapist response using Groq"""
     print("=" * 80)
@@ -370,11 +544,10 @@ def generate_therapist_response(message, emotion, session_id):
         
         print("✅ Groq client is available")
         
-        # Get emotion history for this session
-        session_emotions = emotion_history.get(session_id, [])
-        recent_emotions = session_emotions[-5:] if len(session_emotions) > 5 else session_emotions
+        # Precomputed smoothed trend for this session (no history rescans)
+        emotion_trend = emotion_aggregator.describe(session_id)
         
-        print(f"📊 Session emotions: {len(session_emotions)} total, {len(recent_emotions)} recent")
+        print(f"📊 Session emotions: {emotion_store.count(session_id)} total, trend: {emotion_trend}")
         
         # Create context-aware prompt based on emotion
         emotion_guidelines = {
@@ -404,7 +577,7 @@ def generate_therapist_response(message, emotion, session_id):
         
         user_prompt = f"""Patient message: "{message}"
         Patient's current emotional state: {emotion}
-        Recent emotions: {', '.join([str(e.get('emotion', e)) if isinstance(e, dict) else str(e) for e in recent_emotions]) if recent_emotions else 'None'}
+        Recent emotions: {emotion_trend or 'None'}
         Respond as FIDO, acknowledging their {emotion} mood and providing appropriate support."""
         
         print(f"🎭 Generating response for emotion: '{emotion}' | Message: '{message[:30]}...'")
@@ -442,6 +615,49 @@ def generate_therapist_response(message, emotion, session_id):
         print("=" * 80)
         return "I'm here to listen and help. Could you tell me more about what you're experiencing?"
 
+async def state_call(function, *args):
+    """
+    Run an emotion_store call from async code. Shared backends do SQLite or
+    Redis I/O (BEGIN IMMEDIATE may wait seconds for a lock), so those calls
+    go to the thread pool; the memory backend is called directly.
+    """
+    if emotion_store.shared:
+        return await run_in_threadpool(function, *args)
+    return function(*args)
+
+def record_emotion(session_id, emotion, confidence):
+    """Append a detection to the session history and make it the current emotion"""
+    emotion_store.record_emotion(session_id, emotion, confidence)
+    emotion_aggregator.update(session_id, emotion, confidence)
+
+def next_frame_interval(session_id, emotion, confidence):
+    """How long the client should wait before its next frame (ms)"""
+    return frame_pacer.next_interval(session_id, emotion, confidence, emotion_aggregator.snapshot(session_id),
+                                     emotion_batcher.queue_depth())
+
+def session_mood(session_id):
+    """Smoothed emotion for the conversation, falling back to the last detection"""
+    smoothed = emotion_aggregator.snapshot(session_id).get("smoothed_emotion")
+    return smoothed or emotion_store.current(session_id).get("emotion", "neutral")
+
+@app.middleware("http")
+async def session_affinity_headers(request: Request, call_next):
+    """
+    Routing hints for multi-worker deployments: X-Served-By names this
+    worker, X-Session-Affinity is a stable shard for the session (for
+    consistent hashing) and X-Session-Owner the worker holding its
+    WebSocket, when that is a different one.
+    """
+    response = await call_next(request)
+    response.headers["X-Served-By"] = WORKER_ID
+    session_id = request.scope.get("path_params", {}).get("session_id") or request.headers.get("x-session-id")
+    if session_id:
+        response.headers["X-Session-Affinity"] = str(affinity_key(session_id))
+        owner = await state_call(emotion_store.session_owner, session_id)
+        if owner and owner != WORKER_ID:
+            response.headers["X-Session-Owner"] = owner
+    return response
+
 @app.get("/")
 async def root():
     return {"message": "AI Therapist API is running!", "status": "healthy"}
@@ -454,38 +670,93 @@ async def health_check():
             "opencv": face_detector is not None,
             "groq_ai": groq_client is not None,
             "emotion_model": emotion_model is not None
-        }
+        },
+        "emotion_model": dict(model_status),
+        "inference_batcher": emotion_batcher.stats(),
+        "face_tracker": face_tracker.stats() if face_tracker is not None else None,
+        "multi_face_tracker": multi_face_tracker.stats() if multi_face_tracker is not None else None,
+        "frame_dedup": frame_dedup.stats(),
+        "frame_pacing": frame_pacer.stats(emotion_batcher.queue_depth()),
+        "emotion_store": await state_call(emotion_store.stats),
+        "session_store": session_repository.stats(),
+        "thread_budget": thread_budget.as_dict()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics for emotion inference"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/detect-emotion", response_model=EmotionDetectionResponse)
 async def detect_emotion(request: EmotionDetectionRequest):
     try:
-        emotion, confidence = detect_emotion_from_image(request.image_data)
-        
-        # Store emotion in history
-        if request.session_id not in emotion_history:
-            emotion_history[request.session_id] = []
-        emotion_history[request.session_id].append({
-            "emotion": emotion,
-            "timestamp": datetime.now().isoformat()
-        })
+        # Off the event loop so concurrent sessions can share a model batch
+        emotion, confidence = await run_in_threadpool(detect_emotion_from_image, request.image_data, request.session_id)
         
-        # Update current emotions
-        current_emotions[request.session_id] = {
-                "emotion": emotion,
-                "confidence": confidence,
-            "timestamp": datetime.now().isoformat()
-        }
+        await state_call(record_emotion, request.session_id, emotion, confidence)
         
         return EmotionDetectionResponse(
             emotion=emotion,
             confidence=confidence,
-            session_id=request.session_id
+            session_id=request.session_id,
+            next_frame_interval_ms=next_frame_interval(request.session_id, emotion, confidence)
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error detecting emotion: {str(e)}")
 
+@app.post("/detect-emotions", response_model=MultiFaceEmotionResponse)
+async def detect_emotions(request: EmotionDetectionRequest):
+    """Every face in the frame (group sessions), each with a stable track id"""
+    try:
+        faces = await run_in_threadpool(detect_faces_from_image, request.image_data, request.session_id)
+        emotion, confidence, track_id = primary_face(faces)
+
+        await state_call(record_emotion, request.session_id, emotion, confidence)
+
+        return MultiFaceEmotionResponse(
+            faces=faces,
+            emotion=emotion,
+            confidence=confidence,
+            primary_track_id=track_id,
+            session_id=request.session_id,
+            next_frame_interval_ms=next_frame_interval(request.session_id, emotion, confidence)
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error detecting emotions: {str(e)}")
+
+@app.post("/admin/reload-model", status_code=202)
+async def reload_emotion_model(request: Request):
+    """
+    Load a model file in the background and swap it in once warm.
+
+    Body (optional): {"path": "..."}; defaults to EMOTION_MODEL_PATH, e.g.
+    after replacing the file on disk. Every call needs the X-Reload-Token
+    header to match EMOTION_MODEL_RELOAD_TOKEN; without that setting the
+    endpoint is disabled. Progress and the outcome are reported under
+    "emotion_model" in /health.
+    """
+    if not EMOTION_MODEL_RELOAD_TOKEN:
+        raise HTTPException(status_code=403, detail="Model reload is disabled; set EMOTION_MODEL_RELOAD_TOKEN to enable it")
+    if not hmac.compare_digest(request.headers.get("x-reload-token", ""), EMOTION_MODEL_RELOAD_TOKEN):
+        raise HTTPException(status_code=403, detail="A valid X-Reload-Token header is required")
+    if EMOTION_INFERENCE_SOCKET:
+        raise HTTPException(status_code=409, detail="The model is served by the inference server; restart it to load a new model")
+    body = await request.json() if await request.body() else {}
+    model_path = body.get("path") or EMOTION_MODEL_PATH
+    if not model_load_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A model load is already in progress")
+
+    def reload():
+        try:
+            _load_emotion_model(model_path)
+        finally:
+            model_load_lock.release()
+
+    threading.Thread(target=reload, name="emotion-model-reloader", daemon=True).start()
+    return {"status": "reloading", "path": model_path, "current": dict(model_status)}
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     print("=" * 80)
@@ -497,13 +768,13 @@ async def chat(request: ChatRequest):
     print("=" * 80)
     
     try:
-        # Use mood from request, fallback to stored emotion
-        mood = request.mood if request.mood else current_emotions.get(request.session_id, {}).get("emotion", "neutral")
+        # Use mood from request, fallback to the session's smoothed emotion
+        mood = request.mood if request.mood else await state_call(session_mood, request.session_id)
         
         print(f"FINAL MOOD USED: {mood}")
         print("CALLING generate_therapist_response...")
         
-        response = generate_therapist_response(request.message, mood, request.session_id)
+        response = await run_in_threadpool(generate_therapist_response, request.message, mood, request.session_id)
         
         print(f"RESPONSE RECEIVED: {response[:100]}")
         
@@ -528,83 +799,219 @@ async def chat(request: ChatRequest):
         print(f"{'='*60}\n")
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
+EMOTION_PAGE_MAX_LIMIT = 500
+SSE_KEEPALIVE_SECONDS = 15
+
 @app.get("/session/{session_id}/emotions")
-async def get_emotion_history(session_id: str):
-    """Get emotion history for a session"""
+async def get_emotion_history(
+    session_id: str,
+    since: int = Query(None, ge=0, description="Return events with seq >= since (next_cursor of the previous call)"),
+    limit: int = Query(None, ge=1, le=EMOTION_PAGE_MAX_LIMIT),
+):
+    """
+    Get emotion history for a session
+
+    Without parameters the whole retained history is returned. For delta
+    sync pass the previous response's next_cursor as since.
+    """
+    page = await state_call(emotion_store.page, session_id, since, limit)
     return {
         "session_id": session_id,
-        "emotions": emotion_history.get(session_id, []),
-        "current_emotion": current_emotions.get(session_id, {})
+        "emotions": page["events"],
+        "current_emotion": await state_call(emotion_store.current, session_id),
+        "aggregates": emotion_aggregator.snapshot(session_id),
+        "next_cursor": page["next_cursor"],
+        "has_more": page["has_more"],
+        "first_available": page["first_available"],
+        "total": page["total"]
     }
 
+@app.get("/session/{session_id}/emotions/stream")
+async def stream_emotion_history(request: Request, session_id: str, since: int = Query(None, ge=0)):
+    """
+    Server-Sent Events stream of a session's emotion/mood events.
+
+    Each event's id is its seq, so a reconnecting EventSource resumes via
+    Last-Event-ID. Without since/Last-Event-ID only new events are sent.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id) + 1
+    cursor = since if since is not None else await state_call(emotion_store.count, session_id)
+
+    async def events():
+        nonlocal cursor
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        changed.set()  # Replay anything already past the cursor
+        emotion_store.subscribe(session_id, loop, changed)
+        # Writes made by other workers don't wake us, so shared backends poll
+        poll_interval = STATE_POLL_SECONDS if emotion_store.shared else SSE_KEEPALIVE_SECONDS
+        idle = 0.0
+        try:
+            while not await request.is_disconnected():
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    idle += poll_interval
+                    if idle >= SSE_KEEPALIVE_SECONDS:
+                        idle = 0.0
+                        yield ": keepalive\n\n"
+                    if not emotion_store.shared:
+                        continue
+                changed.clear()
+                while True:
+                    page = await state_call(emotion_store.page, session_id, cursor, EMOTION_PAGE_MAX_LIMIT)
+                    if page["events"]:
+                        idle = 0.0
+                    for event in page["events"]:
+                        yield f"id: {event['seq']}\nevent: emotion\ndata: {json.dumps(event)}\n\n"
+                    cursor = page["next_cursor"]
+                    if not page["has_more"]:
+                        break
+        finally:
+            emotion_store.unsubscribe(session_id, loop, changed)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
+async def websocket_endpoint(websocket: WebSocket, session_id: str, multi_face: bool = False):
+    """
+    Real-time session channel.
+
+    Client -> server:
+        binary message                       raw JPEG/PNG frame (preferred)
+        {"type": "emotion_detection", "image_data": "<base64>"}
+        {"type": "chat", "message": "..."}
+    Server -> client:
+        {"type": "emotion_detected", "emotion": ..., "confidence": ...,
+         "next_frame_interval_ms": ...}
+        (connected with ?multi_face=true the push also carries
+         "faces": [{"track_id", "emotion", "confidence", "box"}, ...]
+         and the top-level emotion is the largest face's)
+        {"type": "chat_response", "response": ...}
+
+    Frames go through a latest-frame-wins queue and chat through its own
+    lane, so a slow inference never delays a chat reply.
+    """
     await websocket.accept()
     active_sessions[session_id] = websocket
-    
-    try:
-        while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            if message_data.get("type") == "emotion_detection":
-                # Handle emotion detection
-                emotion, confidence = detect_emotion_from_image(message_data["image_data"])
-                
-                # Store emotion
-                if session_id not in emotion_history:
-                    emotion_history[session_id] = []
-                emotion_history[session_id].append({
-                    "emotion": emotion,
-                    "timestamp": datetime.now().isoformat()
-                })
-                
-                current_emotions[session_id] = {
+    await state_call(emotion_store.claim_session, session_id)
+
+    frames = LatestFrameQueue()
+    chats = asyncio.Queue()
+    push_filter = EmotionPushFilter()
+    last_face_labels = []  # Multi-face mode: (track_id, emotion) of the last push
+    send_lock = asyncio.Lock()
+
+    async def send(payload):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
+
+    async def process_frame(image_data):
+        faces = None
+        if multi_face:
+            faces = await run_in_threadpool(detect_faces_from_image, image_data, session_id)
+            emotion, confidence, _ = primary_face(faces)
+        else:
+            emotion, confidence = await run_in_threadpool(detect_emotion_from_image, image_data, session_id)
+        ws_frames.inc(outcome="processed")
+        await state_call(record_emotion, session_id, emotion, confidence)
+
+        interval = next_frame_interval(session_id, emotion, confidence)
+
+        # Only push results the client hasn't effectively seen yet
+        send_result = push_filter.should_send(emotion, confidence)
+        if faces is not None:
+            labels = [(face["track_id"], face["emotion"]) for face in faces]
+            send_result = send_result or labels != last_face_labels
+            last_face_labels[:] = labels
+        if send_result:
+            payload = {
+                "type": "emotion_detected",
                 "emotion": emotion,
                 "confidence": confidence,
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-                await websocket.send_text(json.dumps({
-                    "type": "emotion_detected",
-                    "emotion": emotion,
-                    "confidence": confidence
-                }))
-                
-            elif message_data.get("type") == "chat":
-                # Handle chat message
-                current_emotion = current_emotions.get(session_id, {}).get("emotion", "neutral")
-                response = generate_therapist_response(message_data["message"], current_emotion, session_id)
-                
-                await websocket.send_text(json.dumps({
+                "next_frame_interval_ms": interval
+            }
+            if faces is not None:
+                payload["faces"] = faces
+            await send(payload)
+
+    async def process_frames():
+        # One bad frame (decode, state backend or send error) must not stop the lane
+        while True:
+            image_data = await frames.get()
+            try:
+                await process_frame(image_data)
+            except WebSocketDisconnect:
+                return
+            except Exception as e:
+                ws_frames.inc(outcome="failed")
+                print(f"❌ WebSocket frame error for session {session_id}: {e}")
+
+    async def process_chats():
+        while True:
+            message = await chats.get()
+            try:
+                current_emotion = await state_call(session_mood, session_id)
+                response = await run_in_threadpool(generate_therapist_response, message, current_emotion, session_id)
+                await send({
                     "type": "chat_response",
                     "response": response
-            }))
-            
+                })
+            except WebSocketDisconnect:
+                return
+            except Exception as e:
+                print(f"❌ WebSocket chat error for session {session_id}: {e}")
+
+    workers = [asyncio.create_task(process_frames()), asyncio.create_task(process_chats())]
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes") is not None:
+                frames.put(message["bytes"])
+                continue
+
+            message_data = json.loads(message.get("text") or "{}")
+            if message_data.get("type") == "emotion_detection":
+                frames.put(message_data["image_data"])
+            elif message_data.get("type") == "chat":
+                chats.put_nowait(message_data["message"])
+
     except Exception as e:
         print(f"WebSocket error: {e}")
     finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
         if session_id in active_sessions:
             del active_sessions[session_id]
+        await state_call(emotion_store.release_session, session_id)
+        if face_tracker is not None:
+            face_tracker.forget(session_id)
+        if multi_face_tracker is not None:
+            multi_face_tracker.forget(session_id)
+        frame_dedup.forget(session_id)
+        frame_dedup.forget(f"{session_id}#faces")
 
 @app.post("/update-mood")
 async def update_mood(request: dict):
     """Update mood for a session"""
+    session_id = request.get("session_id")
+    mood = request.get("mood")
+
+    if not session_id or not mood:
+        raise HTTPException(status_code=400, detail="session_id and mood are required")
+    if normalise_mood(mood) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown mood; expected one of: {', '.join(MOOD_LABELS)}")
+
     try:
-        session_id = request.get("session_id")
-        mood = request.get("mood")
-        
-        if not session_id or not mood:
-            raise HTTPException(status_code=400, detail="session_id and mood are required")
-        
         # Store mood in session data
-        if session_id not in emotion_history:
-            emotion_history[session_id] = []
-        
-        emotion_history[session_id].append({
-            "mood": mood,
-            "timestamp": datetime.now().isoformat()
-        })
+        await state_call(emotion_store.record_mood, session_id, mood)
         
         return {"status": "success", "message": "Mood updated successfully"}
     except Exception as e:
@@ -615,10 +1022,9 @@ async def update_mood(request: dict):
 async def save_session(request: dict):
     """Save therapy session data"""
     try:
-        # In a real application, you would save this to a database
-        # For now, we'll just return success
-        session_id = request.get("patient_id", "anonymous")
-        print(f"Session saved for patient: {session_id}")
+        # Queued for the background writer; the response doesn't wait on disk
+        session_id = session_repository.save(request)
+        print(f"Session {session_id} saved for patient: {request.get('patient_id', 'anonymous')}")
         
         return {
             "status": "success", 
@@ -630,15 +1036,22 @@ async def save_session(request: dict):
         raise HTTPException(status_code=500, detail="Failed to save session")
 
 @app.get("/session-history/{patient_id}")
-async def get_session_history(patient_id: str):
-    """Get session history for a patient"""
+async def get_session_history(
+    patient_id: str,
+    limit: int = Query(SESSION_HISTORY_PAGE_SIZE, ge=1, le=SESSION_HISTORY_MAX_PAGE_SIZE),
+    cursor: str = Query(None, description="next_cursor from the previous page")
+):
+    """Get session history for a patient, newest first"""
     try:
-        # In a real application, you would fetch this from a database
-        # For now, we'll return empty sessions
+        page = await run_in_threadpool(session_repository.list_sessions, patient_id, limit, cursor)
         return {
             "patient_id": patient_id,
-            "sessions": []
+            "sessions": page["sessions"],
+            "next_cursor": page["next_cursor"],
+            "has_more": page["next_cursor"] is not None
         }
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         print(f"Error getting session history: {e}")
         raise HTTPException(status_code=500, detail="Failed to get session history")
@@ -653,8 +1066,10 @@ if __name__ == "__main__":
     print("   POST /chat - Chat with AI therapist")
     print("   POST /update-mood - Update mood for session")
     print("   POST /save-session - Save therapy session")
-    print("   GET  /session-history/{patient_id} - Get session history")
-    print("   GET  /session/{session_id}/emotions - Get emotion history")
+    print("   GET  /session-history/{patient_id} - Get session history (limit/cursor paging)")
+    print("   GET  /session/{session_id}/emotions - Get emotion history (since/limit for delta sync)")
+    print("   GET  /session/{session_id}/emotions/stream - Live emotion events (SSE)")
+    print("   GET  /metrics - Prometheus metrics")
     print("   WS   /ws/{session_id} - WebSocket connection")
     print("[INFO] Server will be available at: http://localhost:8001")
     print("[INFO] API docs at: http://localhost:8001/docs")
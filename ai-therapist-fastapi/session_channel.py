@@ -0,0 +1,76 @@
+"""
+Session Channel
+Backpressure helpers for the therapist WebSocket.
+
+Frames go into a small latest-frame-wins queue: when inference falls behind
+the client's frame rate, stale frames are dropped instead of building a
+backlog, so the emotion label never lags by more than one inference.
+Emotion results are pushed only when the label changes or the confidence
+moves by more than WS_CONFIDENCE_DELTA (plus a periodic heartbeat).
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+from therapist_metrics import Counter
+
+WS_FRAME_QUEUE_SIZE = int(os.getenv("WS_FRAME_QUEUE_SIZE", "1"))
+WS_CONFIDENCE_DELTA = float(os.getenv("WS_CONFIDENCE_DELTA", "0.1"))
+WS_EMOTION_HEARTBEAT_SECONDS = float(os.getenv("WS_EMOTION_HEARTBEAT_SECONDS", "10"))
+
+ws_frames = Counter(
+    "therapist_ws_frames_total",
+    "WebSocket frames by outcome (processed, dropped as stale, failed).",
+)
+ws_emotion_pushes = Counter(
+    "therapist_ws_emotion_pushes_total",
+    "Emotion results by outcome (sent, suppressed as unchanged).",
+)
+
+
+class LatestFrameQueue:
+    """Bounded frame queue that drops the oldest frame when full"""
+
+    def __init__(self, maxsize=WS_FRAME_QUEUE_SIZE):
+        self._frames = deque(maxlen=max(1, maxsize))
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, frame):
+        if len(self._frames) == self._frames.maxlen:
+            self.dropped += 1
+            ws_frames.inc(outcome="dropped")
+        self._frames.append(frame)
+        self._ready.set()
+
+    async def get(self):
+        while not self._frames:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._frames.popleft()
+
+
+class EmotionPushFilter:
+    """Decides whether an emotion result is worth sending to the client"""
+
+    def __init__(self, confidence_delta=WS_CONFIDENCE_DELTA, heartbeat=WS_EMOTION_HEARTBEAT_SECONDS):
+        self.confidence_delta = confidence_delta
+        self.heartbeat = heartbeat
+        self._last = None
+        self._last_sent_at = 0.0
+
+    def should_send(self, emotion, confidence):
+        now = time.monotonic()
+        send = (
+            self._last is None
+            or emotion != self._last[0]
+            or abs(confidence - self._last[1]) >= self.confidence_delta
+            or now - self._last_sent_at >= self.heartbeat
+        )
+        if send:
+            self._last = (emotion, confidence)
+            self._last_sent_at = now
+        ws_emotion_pushes.inc(outcome="sent" if send else "suppressed")
+        return send
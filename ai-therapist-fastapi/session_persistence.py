@@ -0,0 +1,299 @@
+"""
+Session Persistence
+Durable storage for saved therapy sessions.
+
+Sessions live in an embedded SQLite database in WAL mode. /save-session
+only enqueues the row; a writer thread drains the queue and inserts rows
+in batches (one transaction per batch), so saving never waits on disk.
+History is listed newest first with keyset pagination over the
+(patient_id, start_time, session_id) index, which covers the page query;
+full payloads are then fetched by primary key for that page only.
+
+Session ids are always generated here, never taken from the request, so
+one caller can't overwrite another patient's session. If the database
+can't be opened or written, the writer keeps the batch and retries with
+backoff; the failure shows up in stats() (and /health) meanwhile.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+THERAPIST_DB_PATH = os.path.abspath(os.getenv(
+    "THERAPIST_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "therapist_data", "sessions.sqlite3"),
+))
+SESSION_WRITE_BATCH_SIZE = int(os.getenv("SESSION_WRITE_BATCH_SIZE", "200"))
+SESSION_WRITE_INTERVAL_MS = float(os.getenv("SESSION_WRITE_INTERVAL_MS", "50"))
+# Backoff between attempts while the database can't be opened or written
+SESSION_WRITE_RETRY_SECONDS = 0.5
+SESSION_WRITE_MAX_RETRY_SECONDS = 30
+SESSION_HISTORY_PAGE_SIZE = 20
+SESSION_HISTORY_MAX_PAGE_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER,
+    saved_at REAL NOT NULL,
+    crisis_detected INTEGER NOT NULL DEFAULT 0,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_patient_time ON sessions(patient_id, start_time, session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_saved_at ON sessions(saved_at);
+"""
+
+INSERT_SQL = (
+    "INSERT INTO sessions "
+    "(session_id, patient_id, start_time, end_time, saved_at, crisis_detected, payload) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def encode_cursor(start_time, session_id):
+    return f"{start_time}:{session_id}"
+
+
+def decode_cursor(cursor):
+    """Parse a history cursor; raises ValueError if it is malformed"""
+    start_time, session_id = cursor.split(":", 1)
+    return int(start_time), session_id
+
+
+def _epoch_ms(value, default):
+    """Timestamps arrive as epoch ms from Date.now(); tolerate missing/odd values"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class SessionRepository:
+    def __init__(self, db_path=THERAPIST_DB_PATH, batch_size=SESSION_WRITE_BATCH_SIZE,
+                 flush_interval_ms=SESSION_WRITE_INTERVAL_MS):
+        self.db_path = db_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue = queue.Queue()
+        self._pending = {}            # session_id -> row, until the writer commits it
+        self._pending_lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.last_error = None        # Message of the latest failure, cleared by the next success
+        self.dropped = 0
+
+    # ------------------------------------------------------------------
+    # Connections
+    # ------------------------------------------------------------------
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        connection = sqlite3.connect(self.db_path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def _reader(self):
+        """One read connection per thread; WAL lets them run alongside the writer"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def save(self, session):
+        """
+        Queue a session for writing and return its new id immediately.
+
+        Args:
+            session: Payload from the frontend (patient_id, start_time,
+                end_time, messages, mood_history, ...). A session_id in it
+                is replaced by the generated one.
+        """
+        now = time.time()
+        session_id = uuid.uuid4().hex
+        payload = dict(session, session_id=session_id)
+        row = (
+            session_id,
+            str(session.get("patient_id") or "anonymous"),
+            _epoch_ms(session.get("start_time"), int(now * 1000)),
+            _epoch_ms(session.get("end_time"), None),
+            now,
+            1 if session.get("crisis_detected") else 0,
+            json.dumps(payload, separators=(",", ":")),
+        )
+        with self._pending_lock:
+            self._pending[session_id] = row
+        self._ensure_writer()
+        self._queue.put(row)
+        return session_id
+
+    def _ensure_writer(self):
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._stopping.clear()
+                self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        connection = None
+        batch = None
+        delay = SESSION_WRITE_RETRY_SECONDS
+        while True:
+            if batch is None:
+                batch = self._next_batch()
+                if batch is None:
+                    if self._stopping.is_set():
+                        break
+                    continue
+
+            try:
+                if connection is None:
+                    connection = self._connect()
+                with connection:
+                    connection.executemany(INSERT_SQL, batch)
+                self.written += len(batch)
+                self.batches += 1
+                self.last_error = None
+                delay = SESSION_WRITE_RETRY_SECONDS
+            except sqlite3.IntegrityError as e:
+                # Not going to succeed on a retry
+                print(f"❌ Dropping {len(batch)} session(s) that can't be stored: {e}")
+                self.dropped += len(batch)
+            except (sqlite3.Error, OSError) as e:
+                self.write_errors += 1
+                self.last_error = str(e)
+                if self._stopping.is_set():
+                    print(f"❌ Giving up on {len(batch)} unsaved session(s) at shutdown: {e}")
+                    self.dropped += len(batch)
+                else:
+                    print(f"❌ Failed to persist {len(batch)} session(s), retrying in {delay:.1f}s: {e}")
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                    self._stopping.wait(delay)
+                    delay = min(delay * 2, SESSION_WRITE_MAX_RETRY_SECONDS)
+                    continue
+
+            with self._pending_lock:
+                for row in batch:
+                    if self._pending.get(row[0]) is row:
+                        del self._pending[row[0]]
+            for _ in batch:
+                self._queue.task_done()
+            batch = None
+        if connection is not None:
+            connection.close()
+
+    def _next_batch(self):
+        """Wait briefly for a queued row, then collect up to batch_size; None if idle"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far is committed"""
+        if self._writer is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        """Flush queued writes and stop the writer (used at shutdown)"""
+        self.flush()
+        self._stopping.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def list_sessions(self, patient_id, limit=SESSION_HISTORY_PAGE_SIZE, cursor=None):
+        """
+        Newest-first page of a patient's sessions.
+
+        Returns:
+            dict: sessions (saved payloads), next_cursor (None on the last page)
+        """
+        limit = max(1, min(limit, SESSION_HISTORY_MAX_PAGE_SIZE))
+        before = decode_cursor(cursor) if cursor else None
+
+        # Rows still waiting for the writer are merged in so a save is
+        # visible to the very next history request
+        with self._pending_lock:
+            pending = [row for row in self._pending.values() if row[1] == patient_id]
+
+        connection = self._reader()
+        if before is None:
+            keys = connection.execute(
+                "SELECT start_time, session_id FROM sessions WHERE patient_id = ? "
+                "ORDER BY start_time DESC, session_id DESC LIMIT ?",
+                (patient_id, limit + 1),
+            ).fetchall()
+        else:
+            keys = connection.execute(
+                "SELECT start_time, session_id FROM sessions WHERE patient_id = ? "
+                "AND (start_time < ? OR (start_time = ? AND session_id < ?)) "
+                "ORDER BY start_time DESC, session_id DESC LIMIT ?",
+                (patient_id, before[0], before[0], before[1], limit + 1),
+            ).fetchall()
+
+        candidates = {session_id: (start_time, session_id, None) for start_time, session_id in keys}
+        for row in pending:
+            if before is None or (row[2], row[0]) < before:
+                candidates[row[0]] = (row[2], row[0], row[6])
+        ordered = sorted(candidates.values(), reverse=True)
+        page, has_more = ordered[:limit], len(ordered) > limit
+
+        missing = [session_id for _, session_id, payload in page if payload is None]
+        payloads = {}
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            payloads = dict(connection.execute(
+                f"SELECT session_id, payload FROM sessions WHERE session_id IN ({placeholders})", missing
+            ).fetchall())
+
+        sessions = [json.loads(payload if payload is not None else payloads[session_id])
+                    for _, session_id, payload in page]
+        next_cursor = encode_cursor(page[-1][0], page[-1][1]) if has_more and page else None
+        return {"sessions": sessions, "next_cursor": next_cursor}
+
+    def stats(self):
+        return {
+            "database": self.db_path,
+            "queued_writes": self._queue.qsize(),
+            "written": self.written,
+            "write_batches": self.batches,
+            "pending_rows": len(self._pending),
+            "write_errors": self.write_errors,
+            "last_error": self.last_error,
+            "dropped": self.dropped,
+        }
+
+
+session_repository = SessionRepository()
@@ -0,0 +1,520 @@
+"""
+State Backend
+Where per-session emotion/mood events and session ownership live.
+
+THERAPIST_STATE_BACKEND selects the implementation:
+  memory  in-process ring buffers (EmotionStore); single worker only
+  sqlite  one SQLite file in WAL mode shared by every worker on the host
+  redis   any Redis-protocol server (Redis, Valkey, KeyDB, ...), shared
+          across hosts
+
+All backends expose the EmotionStore API (record_emotion, record_mood,
+page, current, count, ...) so the endpoints don't care which one is used.
+Shared backends set `shared = True`: writes from other workers don't wake
+local subscribers, so streams poll every STATE_POLL_SECONDS instead.
+
+Sessions are also claimed by the worker holding their WebSocket. Responses
+carry affinity hints (see affinity_key / session_owner) so a load balancer
+can keep a session on one worker, where its face track and smoothed
+aggregates are cached.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+from emotion_store import (
+    EMOTION_HISTORY_MAX_EVENTS,
+    EMOTION_SESSION_TTL_SECONDS,
+    KIND_EMOTION,
+    KIND_MOOD,
+    EmotionStore,
+    _isoformat,
+    _now_us,
+    normalise_mood,
+)
+
+THERAPIST_STATE_BACKEND = os.getenv("THERAPIST_STATE_BACKEND", "memory").lower()
+THERAPIST_STATE_DB = os.path.abspath(os.getenv(
+    "THERAPIST_STATE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "therapist_data", "state.sqlite3"),
+))
+THERAPIST_REDIS_URL = os.getenv("THERAPIST_REDIS_URL", "redis://localhost:6379/0")
+THERAPIST_REDIS_PREFIX = os.getenv("THERAPIST_REDIS_PREFIX", "therapist")
+STATE_POLL_SECONDS = float(os.getenv("STATE_POLL_SECONDS", "1"))
+AFFINITY_SHARDS = int(os.getenv("AFFINITY_SHARDS", "1024"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def affinity_key(session_id, shards=AFFINITY_SHARDS):
+    """Stable shard number for a session, for consistent-hash routing"""
+    digest = hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def _redact_url(url):
+    """URL without credentials (user:password@ or ?password=...), for /health"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc.rsplit('@', 1)[-1]}{parts.path}"
+
+
+def _entry(kind, label, timestamp_us, seq=None):
+    """Event in the EmotionStore JSON shape"""
+    entry = {"mood" if kind == KIND_MOOD else "emotion": label, "timestamp": _isoformat(timestamp_us)}
+    if seq is not None:
+        entry["seq"] = seq
+    return entry
+
+
+def _empty_page(since):
+    return {"events": [], "next_cursor": since or 0, "has_more": False, "first_available": 0, "total": 0}
+
+
+class _LocalSubscribers:
+    """Wake-ups for streams in this process (same contract as EmotionStore)"""
+
+    def _init_subscribers(self):
+        self._subscribers = {}
+        self._subscribers_lock = threading.Lock()
+
+    def subscribe(self, session_id, loop, event):
+        with self._subscribers_lock:
+            self._subscribers.setdefault(session_id, set()).add((loop, event))
+
+    def unsubscribe(self, session_id, loop, event):
+        with self._subscribers_lock:
+            subscribers = self._subscribers.get(session_id)
+            if subscribers:
+                subscribers.discard((loop, event))
+                if not subscribers:
+                    del self._subscribers[session_id]
+
+    def _notify(self, session_id):
+        for loop, event in list(self._subscribers.get(session_id, ())):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                self.unsubscribe(session_id, loop, event)
+
+
+class MemoryStateBackend(EmotionStore):
+    """In-process state; fastest, but every worker sees only its own sessions"""
+
+    name = "memory"
+    shared = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owners = {}
+
+    def claim_session(self, session_id, worker_id=WORKER_ID):
+        self._owners[session_id] = worker_id
+
+    def release_session(self, session_id, worker_id=WORKER_ID):
+        if self._owners.get(session_id) == worker_id:
+            del self._owners[session_id]
+
+    def session_owner(self, session_id):
+        return self._owners.get(session_id)
+
+    def stats(self):
+        return dict(super().stats(), backend=self.name, worker=WORKER_ID)
+
+
+class SqliteStateBackend(_LocalSubscribers):
+    """State in a WAL-mode SQLite file shared by all workers on one host"""
+
+    name = "sqlite"
+    shared = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS state_sessions (
+        session_id TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        current_label TEXT,
+        current_confidence REAL,
+        current_ts_us INTEGER,
+        owner TEXT,
+        last_active REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS state_events (
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        kind INTEGER NOT NULL,
+        label TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        ts_us INTEGER NOT NULL,
+        PRIMARY KEY (session_id, seq)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_state_sessions_last_active ON state_sessions(last_active);
+    """
+
+    def __init__(self, db_path=THERAPIST_STATE_DB, max_events=EMOTION_HISTORY_MAX_EVENTS,
+                 idle_ttl=EMOTION_SESSION_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_events = max(1, max_events)
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._last_eviction = time.monotonic()
+        self.evicted = 0
+        self._init_subscribers()
+        self._connection()  # Create the schema up front
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            # Autocommit mode; write transactions are opened explicitly
+            connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def _record(self, session_id, label, kind, confidence, timestamp_us):
+        timestamp_us = timestamp_us or _now_us()
+        connection = self._connection()
+        # IMMEDIATE takes the write lock first, so seq allocation can't race
+        # with another worker
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO state_sessions (session_id, last_active) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO NOTHING",
+                (session_id, time.time()),
+            )
+            seq = connection.execute(
+                "SELECT total FROM state_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            connection.execute(
+                "INSERT INTO state_events (session_id, seq, kind, label, confidence, ts_us) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, seq, kind, label, float(confidence), int(timestamp_us)),
+            )
+            if kind == KIND_EMOTION:
+                connection.execute(
+                    "UPDATE state_sessions SET total = total + 1, last_active = ?, current_label = ?, "
+                    "current_confidence = ?, current_ts_us = ? WHERE session_id = ?",
+                    (time.time(), label, float(confidence), int(timestamp_us), session_id),
+                )
+            else:
+                connection.execute(
+                    "UPDATE state_sessions SET total = total + 1, last_active = ? WHERE session_id = ?",
+                    (time.time(), session_id),
+                )
+            # Keep the same bound as the in-memory ring buffer
+            connection.execute(
+                "DELETE FROM state_events WHERE session_id = ? AND seq <= ?",
+                (session_id, seq - self.max_events),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._notify(session_id)
+        self._maybe_evict()
+        return seq
+
+    def record_emotion(self, session_id, emotion, confidence, timestamp_us=None):
+        return self._record(session_id, emotion, KIND_EMOTION, confidence, timestamp_us)
+
+    def record_mood(self, session_id, mood, timestamp_us=None):
+        label = normalise_mood(mood)
+        if label is None:
+            raise ValueError(f"Unknown mood: {mood!r}")
+        return self._record(session_id, label, KIND_MOOD, 0.0, timestamp_us)
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def _total(self, connection, session_id):
+        row = connection.execute("SELECT total FROM state_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def _events(self, connection, session_id, start, limit):
+        return connection.execute(
+            "SELECT seq, kind, label, ts_us FROM state_events WHERE session_id = ? AND seq >= ? "
+            "ORDER BY seq LIMIT ?",
+            (session_id, start, -1 if limit is None else limit),
+        ).fetchall()
+
+    def page(self, session_id, since=None, limit=None):
+        connection = self._connection()
+        total = self._total(connection, session_id)
+        if total is None:
+            return _empty_page(since)
+        first_available = max(total - self.max_events, 0)
+        start = first_available if since is None else min(max(since, first_available), total)
+        events = [_entry(kind, label, ts_us, seq) for seq, kind, label, ts_us
+                  in self._events(connection, session_id, start, limit)]
+        next_cursor = start + len(events)
+        return {
+            "events": events,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor < total,
+            "first_available": first_available,
+            "total": total,
+        }
+
+    def history(self, session_id, since=None, limit=None):
+        return [{key: value for key, value in event.items() if key != "seq"}
+                for event in self.page(session_id, since, limit)["events"]]
+
+    def recent(self, session_id, n):
+        return self.history(session_id, since=max(self.count(session_id) - n, 0))
+
+    def current(self, session_id):
+        row = self._connection().execute(
+            "SELECT current_label, current_confidence, current_ts_us FROM state_sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return {}
+        return {"emotion": row[0], "confidence": float(row[1]), "timestamp": _isoformat(row[2])}
+
+    def count(self, session_id):
+        return self._total(self._connection(), session_id) or 0
+
+    def __contains__(self, session_id):
+        return self._total(self._connection(), session_id) is not None
+
+    # ------------------------------------------------------------------
+    # Ownership
+    # ------------------------------------------------------------------
+    def claim_session(self, session_id, worker_id=WORKER_ID):
+        self._connection().execute(
+            "INSERT INTO state_sessions (session_id, owner, last_active) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET owner = excluded.owner, last_active = excluded.last_active",
+            (session_id, worker_id, time.time()),
+        )
+
+    def release_session(self, session_id, worker_id=WORKER_ID):
+        self._connection().execute(
+            "UPDATE state_sessions SET owner = NULL WHERE session_id = ? AND owner = ?", (session_id, worker_id)
+        )
+
+    def session_owner(self, session_id):
+        row = self._connection().execute(
+            "SELECT owner FROM state_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    # ------------------------------------------------------------------
+    # Eviction and reporting
+    # ------------------------------------------------------------------
+    def _maybe_evict(self):
+        if time.monotonic() - self._last_eviction >= 60:
+            self.evict_idle()
+
+    def evict_idle(self):
+        self._last_eviction = time.monotonic()
+        cutoff = time.time() - self.idle_ttl
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            idle = [row[0] for row in connection.execute(
+                "SELECT session_id FROM state_sessions WHERE last_active < ? AND owner IS NULL", (cutoff,)
+            )]
+            for session_id in idle:
+                connection.execute("DELETE FROM state_events WHERE session_id = ?", (session_id,))
+                connection.execute("DELETE FROM state_sessions WHERE session_id = ?", (session_id,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self.evicted += len(idle)
+        return len(idle)
+
+    def stats(self):
+        connection = self._connection()
+        return {
+            "backend": self.name,
+            "worker": WORKER_ID,
+            "database": self.db_path,
+            "sessions": connection.execute("SELECT COUNT(*) FROM state_sessions").fetchone()[0],
+            "events": connection.execute("SELECT COUNT(*) FROM state_events").fetchone()[0],
+            "max_events_per_session": self.max_events,
+            "idle_ttl_seconds": self.idle_ttl,
+            "evicted_sessions": self.evicted,
+        }
+
+
+class RedisStateBackend(_LocalSubscribers):
+    """
+    State on a Redis-protocol server, shared across hosts.
+
+    Per session: a counter for the next seq, a sorted set of JSON events
+    scored by seq (so concurrent writers can't reorder it), a hash with the
+    latest detection and an owner key. The counter and the event are
+    written in one WATCH/MULTI/EXEC transaction, so once a seq is counted
+    its event is readable and pages never see gaps. Every key expires after
+    idle_ttl seconds without writes, which replaces the eviction sweep.
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, client=None, url=THERAPIST_REDIS_URL, prefix=THERAPIST_REDIS_PREFIX,
+                 max_events=EMOTION_HISTORY_MAX_EVENTS, idle_ttl=EMOTION_SESSION_TTL_SECONDS):
+        if client is None:
+            import redis  # Optional dependency, only needed for this backend
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.url = url
+        self.prefix = prefix
+        self.max_events = max(1, max_events)
+        self.idle_ttl = idle_ttl
+        self._init_subscribers()
+
+    def _key(self, session_id, name):
+        return f"{self.prefix}:session:{session_id}:{name}"
+
+    @staticmethod
+    def _text(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def _record(self, session_id, label, kind, confidence, timestamp_us):
+        timestamp_us = int(timestamp_us or _now_us())
+        ttl = max(1, int(self.idle_ttl))
+        seq_key = self._key(session_id, "seq")
+
+        def append(pipe):
+            # Runs again if another writer bumps the counter before EXEC
+            seq = int(pipe.get(seq_key) or 0)
+            event = json.dumps({"s": seq, "k": kind, "l": label, "c": float(confidence), "t": timestamp_us},
+                               separators=(",", ":"))
+            pipe.multi()
+            pipe.set(seq_key, seq + 1, ex=ttl)
+            pipe.zadd(self._key(session_id, "events"), {event: seq})
+            pipe.zremrangebyscore(self._key(session_id, "events"), "-inf", seq - self.max_events)
+            if kind == KIND_EMOTION:
+                pipe.hset(self._key(session_id, "current"),
+                          mapping={"emotion": label, "confidence": float(confidence), "ts_us": timestamp_us})
+            for name in ("events", "current"):
+                pipe.expire(self._key(session_id, name), ttl)
+            return seq
+
+        seq = self.client.transaction(append, seq_key, value_from_callable=True)
+        self._notify(session_id)
+        return seq
+
+    def record_emotion(self, session_id, emotion, confidence, timestamp_us=None):
+        return self._record(session_id, emotion, KIND_EMOTION, confidence, timestamp_us)
+
+    def record_mood(self, session_id, mood, timestamp_us=None):
+        label = normalise_mood(mood)
+        if label is None:
+            raise ValueError(f"Unknown mood: {mood!r}")
+        return self._record(session_id, label, KIND_MOOD, 0.0, timestamp_us)
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def count(self, session_id):
+        value = self.client.get(self._key(session_id, "seq"))
+        return int(value) if value is not None else 0
+
+    def __contains__(self, session_id):
+        return bool(self.client.exists(self._key(session_id, "seq")))
+
+    def page(self, session_id, since=None, limit=None):
+        total = self.client.get(self._key(session_id, "seq"))
+        if total is None:
+            return _empty_page(since)
+        total = int(total)
+        first_available = max(total - self.max_events, 0)
+        start = first_available if since is None else min(max(since, first_available), total)
+        if limit is None:
+            raw = self.client.zrangebyscore(self._key(session_id, "events"), start, "+inf")
+        else:
+            raw = self.client.zrangebyscore(self._key(session_id, "events"), start, "+inf", start=0, num=limit)
+        events = []
+        for item in raw:
+            event = json.loads(self._text(item))
+            events.append(_entry(event["k"], event["l"], event["t"], event["s"]))
+        next_cursor = start + len(events)
+        return {
+            "events": events,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor < total,
+            "first_available": first_available,
+            "total": total,
+        }
+
+    def history(self, session_id, since=None, limit=None):
+        return [{key: value for key, value in event.items() if key != "seq"}
+                for event in self.page(session_id, since, limit)["events"]]
+
+    def recent(self, session_id, n):
+        return self.history(session_id, since=max(self.count(session_id) - n, 0))
+
+    def current(self, session_id):
+        current = {self._text(key): self._text(value)
+                   for key, value in self.client.hgetall(self._key(session_id, "current")).items()}
+        if not current:
+            return {}
+        return {
+            "emotion": current["emotion"],
+            "confidence": float(current["confidence"]),
+            "timestamp": _isoformat(int(current["ts_us"])),
+        }
+
+    # ------------------------------------------------------------------
+    # Ownership
+    # ------------------------------------------------------------------
+    def claim_session(self, session_id, worker_id=WORKER_ID):
+        self.client.set(self._key(session_id, "owner"), worker_id, ex=max(1, int(self.idle_ttl)))
+
+    def release_session(self, session_id, worker_id=WORKER_ID):
+        key = self._key(session_id, "owner")
+        if self._text(self.client.get(key)) == worker_id:
+            self.client.delete(key)
+
+    def session_owner(self, session_id):
+        return self._text(self.client.get(self._key(session_id, "owner")))
+
+    # ------------------------------------------------------------------
+    # Eviction and reporting
+    # ------------------------------------------------------------------
+    def evict_idle(self):
+        """Keys expire on their own"""
+        return 0
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "worker": WORKER_ID,
+            "url": _redact_url(self.url),
+            "prefix": self.prefix,
+            "max_events_per_session": self.max_events,
+            "idle_ttl_seconds": self.idle_ttl,
+        }
+
+
+BACKENDS = {
+    "memory": MemoryStateBackend,
+    "sqlite": SqliteStateBackend,
+    "redis": RedisStateBackend,
+}
+
+
+def create_state_backend(kind=THERAPIST_STATE_BACKEND, **kwargs):
+    """Build the configured backend; raises ValueError for unknown names"""
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown state backend {kind!r} (expected one of: {', '.join(BACKENDS)})")
+    backend = BACKENDS[kind](**kwargs)
+    print(f"[INFO] Session state backend: {backend.name} (worker {WORKER_ID})")
+    return backend
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Test the session state backends (memory, SQLite, Redis-protocol)
+
+Runs the same checks against every backend. The Redis backend uses
+fakeredis when it is installed, otherwise the small in-memory stand-in
+below, so no server is needed.
+
+Run with pytest or directly: python test_state_backend.py
+"""
+
+import os
+import tempfile
+
+from state_backend import (
+    MemoryStateBackend,
+    RedisStateBackend,
+    SqliteStateBackend,
+    affinity_key,
+)
+
+
+class FakeRedis:
+    """Just the commands RedisStateBackend uses (decode_responses=True semantics)"""
+
+    def __init__(self):
+        self.data = {}
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = str(value)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zremrangebyscore(self, key, low, high):
+        members = self.data.get(key, {})
+        high = float(high)
+        for member in [m for m, score in members.items() if score <= high]:
+            del members[member]
+
+    def zrangebyscore(self, key, low, high, start=None, num=None):
+        members = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        selected = [member for member, score in members if score >= float(low)]
+        if start is not None:
+            selected = selected[start:start + num]
+        return selected
+
+    def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        """WATCH/MULTI/EXEC: run func again while a watched key changed before EXEC"""
+        while True:
+            watched = {key: self.data.get(key) for key in watches}
+            pipe = FakePipeline(self, immediate=True)
+            value = func(pipe)
+            if all(self.data.get(key) == before for key, before in watched.items()):
+                results = pipe.execute()
+                return value if value_from_callable else results
+
+
+class FakePipeline:
+    def __init__(self, client, immediate=False):
+        self.client = client
+        self.calls = []
+        self.immediate = immediate  # Watching: commands run until multi()
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        if self.immediate:
+            return getattr(self.client, name)
+
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return queue
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+def redis_client():
+    try:
+        import fakeredis
+        return fakeredis.FakeRedis(decode_responses=True)
+    except ImportError:
+        return FakeRedis()
+
+
+def make_backends(tmpdir, max_events=5):
+    return [
+        MemoryStateBackend(max_events=max_events),
+        SqliteStateBackend(os.path.join(tmpdir, "state.sqlite3"), max_events=max_events),
+        RedisStateBackend(client=redis_client(), max_events=max_events),
+    ]
+
+
+def check_backend(backend):
+    """Same behaviour as the in-memory EmotionStore"""
+    assert "s1" not in backend
+    assert backend.page("s1")["events"] == []
+    assert backend.current("s1") == {}
+
+    seqs = [backend.record_emotion("s1", label, 0.8) for label in ["Happy", "Sad", "Neutral"]]
+    seqs.append(backend.record_mood("s1", "calm"))
+    assert seqs == [0, 1, 2, 3], f"{backend.name}: unexpected seqs {seqs}"
+    assert "s1" in backend and backend.count("s1") == 4
+    assert backend.current("s1")["emotion"] == "Neutral", f"{backend.name}: current should skip moods"
+
+    page = backend.page("s1", since=1, limit=2)
+    assert [e["seq"] for e in page["events"]] == [1, 2]
+    assert page["next_cursor"] == 3 and page["has_more"]
+    assert page["events"][0]["emotion"] == "Sad"
+
+    tail = backend.page("s1", since=page["next_cursor"])
+    assert tail["events"] == [{"mood": "calm", "timestamp": tail["events"][0]["timestamp"], "seq": 3}]
+    assert not tail["has_more"]
+
+    # Bounded like the ring buffer: only the last max_events are kept
+    for _ in range(6):
+        backend.record_emotion("s1", "Angry", 0.5)
+    page = backend.page("s1")
+    assert page["total"] == 10 and page["first_available"] == 5
+    assert [e["seq"] for e in page["events"]] == [5, 6, 7, 8, 9], f"{backend.name}: {page}"
+    assert len(backend.history("s1")) == 5
+    assert len(backend.recent("s1", 2)) == 2
+
+    # Ownership hints
+    backend.claim_session("s1", "worker-a")
+    assert backend.session_owner("s1") == "worker-a"
+    backend.release_session("s1", "worker-b")
+    assert backend.session_owner("s1") == "worker-a", "only the owner can release"
+    backend.release_session("s1", "worker-a")
+    assert backend.session_owner("s1") is None
+
+    assert backend.stats()["backend"] == backend.name
+    print(f"✅ {backend.name} backend OK")
+
+
+def test_backends():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for backend in make_backends(tmpdir):
+            check_backend(backend)
+
+
+def test_sqlite_shared_between_workers():
+    """Two instances on one file behave like two workers"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "state.sqlite3")
+        worker_a, worker_b = SqliteStateBackend(path), SqliteStateBackend(path)
+        worker_a.record_emotion("shared", "Happy", 0.9)
+        assert worker_b.record_emotion("shared", "Sad", 0.7) == 1
+        assert [e["emotion"] for e in worker_a.page("shared")["events"]] == ["Happy", "Sad"]
+        assert worker_a.current("shared")["emotion"] == "Sad"
+        print("✅ SQLite backend shared between instances OK")
+
+
+def test_redis_interleaved_writers():
+    """A write landing inside another worker's transaction can't leave a gap in the seqs"""
+    client = FakeRedis()
+    worker_a, worker_b = RedisStateBackend(client=client), RedisStateBackend(client=client)
+    read_seq = client.get
+    interleaved = []
+
+    def get(key):
+        value = read_seq(key)
+        if key.endswith(":seq") and not interleaved:
+            interleaved.append(None)
+            # Worker B commits between worker A's read of the counter and its EXEC
+            interleaved[0] = worker_b.record_emotion("shared", "Sad", 0.7)
+        return value
+
+    client.get = get
+    assert worker_a.record_emotion("shared", "Happy", 0.9) == 1
+    assert interleaved == [0]
+    client.get = read_seq
+
+    page = worker_a.page("shared", since=0, limit=1)
+    assert [e["seq"] for e in page["events"]] == [0] and page["next_cursor"] == 1 and page["has_more"]
+    page = worker_b.page("shared", since=page["next_cursor"])
+    assert [(e["seq"], e["emotion"]) for e in page["events"]] == [(1, "Happy")] and page["next_cursor"] == 2
+    print("✅ Redis backend interleaved writers OK")
+
+
+def test_affinity_key_is_stable():
+    assert affinity_key("session-1") == affinity_key("session-1")
+    assert 0 <= affinity_key("session-1", shards=8) < 8
+    print("✅ Affinity key OK")
+
+
+if __name__ == "__main__":
+    print("🧪 Testing session state backends")
+    print("=" * 50)
+    test_backends()
+    test_sqlite_shared_between_workers()
+    test_redis_interleaved_writers()
+    test_affinity_key_is_stable()
+    print("🎉 All state backend tests passed")
@@ -0,0 +1,102 @@
+"""
+Thread Budget
+Sizes every thread pool in the therapist service from one number: the
+CPU cores each worker process may use.
+
+Left alone, OpenCV, TensorFlow/TFLite/ONNX, OpenMP/BLAS and the anyio
+thread pool each size themselves from the machine's core count, so with
+several workers and concurrent frames the CPU is oversubscribed many
+times over and tail latency suffers. The budget splits the cores instead:
+
+  model_threads       intra-op threads for the single batched inference
+                      thread (it is the only caller, so it gets all cores)
+  cv2_threads         OpenCV's internal pool; frames are already decoded and
+                      detected concurrently on request threads, so 1
+  blas_threads        OpenMP / BLAS pools used by numpy (1 for the same reason)
+  threadpool_tokens   anyio threads for blocking endpoint work; mostly
+                      waiting on Groq and SQLite, so several per core
+
+THREAD_BUDGET_CORES sets the cores per worker (default: usable cores
+divided by WEB_CONCURRENCY); each value can be overridden on its own.
+Import this module before numpy/cv2 so the OpenMP/BLAS variables apply.
+"""
+
+import os
+import sys
+
+# Worker processes sharing the machine (uvicorn/gunicorn convention)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+THREAD_BUDGET_CORES = int(os.getenv("THREAD_BUDGET_CORES", "0"))
+THREADPOOL_TOKENS_PER_CORE = int(os.getenv("THREADPOOL_TOKENS_PER_CORE", "4"))
+
+BLAS_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+
+
+def usable_cores():
+    """Cores this process may run on (respects CPU affinity / cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def cores_per_worker():
+    if THREAD_BUDGET_CORES > 0:
+        return THREAD_BUDGET_CORES
+    return max(1, usable_cores() // max(1, WEB_CONCURRENCY))
+
+
+class ThreadBudget:
+    def __init__(self, cores):
+        self.cores = max(1, cores)
+        self.model_threads = int(os.getenv("THREAD_BUDGET_MODEL_THREADS", str(self.cores)))
+        self.cv2_threads = int(os.getenv("THREAD_BUDGET_CV2_THREADS", "1"))
+        self.blas_threads = int(os.getenv("THREAD_BUDGET_BLAS_THREADS", "1"))
+        self.threadpool_tokens = int(os.getenv(
+            "THREAD_BUDGET_THREADPOOL_TOKENS", str(max(8, self.cores * THREADPOOL_TOKENS_PER_CORE))
+        ))
+
+    def as_dict(self):
+        return {
+            "cores": self.cores,
+            "workers": WEB_CONCURRENCY,
+            "model_threads": self.model_threads,
+            "cv2_threads": self.cv2_threads,
+            "blas_threads": self.blas_threads,
+            "threadpool_tokens": self.threadpool_tokens,
+        }
+
+
+thread_budget = ThreadBudget(cores_per_worker())
+
+# Read by OpenMP/BLAS and TensorFlow when they load, so set them right away
+for _name in BLAS_ENV_VARS:
+    os.environ.setdefault(_name, str(thread_budget.blas_threads))
+os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(thread_budget.model_threads))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+
+def apply_thread_budget(budget=thread_budget):
+    """Apply the budget to libraries that are configured at runtime"""
+    try:
+        import cv2
+        cv2.setNumThreads(budget.cv2_threads)
+    except ImportError:
+        pass
+
+    if "numpy" in sys.modules:
+        # numpy loaded before this module: limit its BLAS pool directly if we can
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(budget.blas_threads)
+        except ImportError:
+            pass
+
+    print(f"[INFO] Thread budget: {budget.cores} core(s) per worker -> model {budget.model_threads}, "
+          f"cv2 {budget.cv2_threads}, blas {budget.blas_threads}, threadpool {budget.threadpool_tokens}")
+
+
+def apply_threadpool_budget(budget=thread_budget):
+    """Size the anyio pool behind run_in_threadpool (needs a running event loop)"""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = budget.threadpool_tokens
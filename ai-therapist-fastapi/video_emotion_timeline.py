@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Video to emotion timeline
+
+Runs a recorded therapy session through the therapist's emotion pipeline
+offline and writes a compact timeline.
+
+Frames are sampled at --fps. The video is split into one contiguous
+segment per worker thread; each worker decodes its own segment (OpenCV
+releases the GIL while decoding) and detects/crops faces with the same
+face tracking as live sessions. Crops are classified on the main thread
+in batches of --batch-size. Finished rows are appended to
+<output>.partial as they come in, so an interrupted run continues where it
+stopped with --resume. The final file is written sorted by time:
+
+    {"video": ..., "sample_fps": ..., "columns": ["t", "frame", "emotion", "confidence"], ...}
+    [0.0, 0, "Neutral", 0.71]
+    [0.5, 15, "Happy", 0.88]
+
+Usage:
+    python video_emotion_timeline.py session.webm [--fps 2] [--output session.emotions.jsonl]
+                                     [--workers 4] [--batch-size 64] [--resume]
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from thread_budget import thread_budget
+
+PROGRESS_INTERVAL = 5
+# Grab (decode-free) up to this many frames forward before seeking instead
+MAX_GRAB_GAP = 120
+
+_DONE = object()
+
+
+def sample_frames(frame_count, video_fps, sample_fps):
+    """Frame indexes to analyse, one every video_fps / sample_fps frames"""
+    step = max(video_fps / sample_fps, 1.0)
+    return [int(round(k * step)) for k in range(int(frame_count / step)) if round(k * step) < frame_count]
+
+
+def to_frame(image):
+    """Frame at the same reduced resolution live frames are analysed at"""
+    from frame_pipeline import Frame, reduction_for
+    height, width = image.shape[:2]
+    scale = reduction_for((width, height))
+    if scale > 1:
+        image = cv2.resize(image, (width // scale, height // scale), interpolation=cv2.INTER_AREA)
+    return Frame(image, scale)
+
+
+def read_partial(path, header):
+    """Rows already written by an interrupted run with the same settings"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as handle:
+        lines = handle.read().splitlines()
+    if not lines or json.loads(lines[0]) != header:
+        raise SystemExit(f"❌ {path} was written with different settings; remove it or drop --resume")
+    rows = []
+    for line in lines[1:]:
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            break  # Torn last line from the interruption
+    return rows
+
+
+class TimelineRun:
+    def __init__(self, video_path, frame_indexes, video_fps, workers, batch_size, partial):
+        import main  # Face detector, emotion model and fallback of the live service
+
+        self.main = main
+        self.video_path = video_path
+        self.video_fps = video_fps
+        self.batch_size = max(1, batch_size)
+        self.partial = partial
+        self.crops = queue.Queue(maxsize=self.batch_size * 2)
+        self.processed = 0
+        self.workers = [
+            threading.Thread(target=self._worker, args=(index, segment), name=f"timeline-{index}", daemon=True)
+            for index, segment in enumerate(np.array_split(np.asarray(frame_indexes, dtype=np.int64), workers))
+            if len(segment)
+        ]
+
+    def _worker(self, index, segment):
+        """Decode this worker's frames, locate faces and queue crops"""
+        capture = cv2.VideoCapture(self.video_path)
+        position = 0
+        seek = False
+        session_id = f"timeline-{index}"
+        try:
+            for frame_index in segment.tolist():
+                if seek or frame_index < position or frame_index - position > MAX_GRAB_GAP:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                    position = frame_index
+                while position < frame_index:
+                    capture.grab()
+                    position += 1
+                ok, image = capture.read()
+                position += 1
+                # After a failed read the decoder position is unknown; seek for the next sample
+                seek = not ok
+                if not ok:
+                    print(f"⚠️ Cannot read frame {frame_index}, skipping it")
+                    continue
+
+                row = [round(frame_index / self.video_fps, 3), frame_index]
+                located = self.main.locate_face(to_frame(image), session_id)
+                if located is None:
+                    self.crops.put((row, "No Face", 0.0))
+                elif self.main.emotion_model is None:
+                    emotion, confidence = self.main.predict_emotion_fallback(located[1], located[2])
+                    self.crops.put((row, self.main.reported_emotion(emotion), confidence))
+                else:
+                    # Copy: to_model_input reuses this thread's buffer for the next crop
+                    self.crops.put((row, self.main.to_model_input(located[1]).copy(), None))
+        finally:
+            capture.release()
+            self.crops.put(_DONE)
+
+    def _write(self, rows):
+        for row in rows:
+            self.partial.write(json.dumps(row, separators=(",", ":")) + "\n")
+        self.partial.flush()
+        self.processed += len(rows)
+
+    def _classify(self, pending):
+        model = self.main.emotion_model
+        probabilities = model.predict(np.stack([tensor for _, tensor, _ in pending]))
+        rows = []
+        for (row, _, _), scores in zip(pending, probabilities):
+            index = int(np.argmax(scores))
+            emotion = self.main.reported_emotion(self.main.EMOTION_LABELS[index])
+            rows.append(row + [emotion, round(float(scores[index]), 3)])
+        return rows
+
+    def run(self):
+        for worker in self.workers:
+            worker.start()
+        running = len(self.workers)
+        pending, finished = [], []
+        started = last_report = time.perf_counter()
+
+        while running:
+            try:
+                item = self.crops.get(timeout=0.1)
+            except queue.Empty:
+                item = None
+            if item is _DONE:
+                running -= 1
+            elif item is not None:
+                row, value, confidence = item
+                if confidence is None:
+                    pending.append(item)
+                else:
+                    finished.append(row + [value, round(float(confidence), 3)])
+
+            # Full batch, or nothing arriving: classify what is waiting
+            if len(pending) >= self.batch_size or (pending and (item is None or not running)):
+                finished.extend(self._classify(pending))
+                pending = []
+            if len(finished) >= self.batch_size or (finished and (item is None or not running)):
+                self._write(finished)
+                finished = []
+
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                print(f"⏱️ {self.processed} frames, {self.processed / (now - started):.1f} frames/sec")
+
+        return self.processed, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write an emotion timeline for a recorded session")
+    parser.add_argument("video")
+    parser.add_argument("--fps", type=float, default=2.0, help="Frames analysed per second of video")
+    parser.add_argument("--output", help="Timeline file (default: <video>.emotions.jsonl)")
+    parser.add_argument("--workers", type=int, default=thread_budget.cores, help="Decode/detect threads")
+    parser.add_argument("--batch-size", type=int, default=64, help="Face crops per model call")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run")
+    args = parser.parse_args()
+
+    capture = cv2.VideoCapture(args.video)
+    if not capture.isOpened():
+        print(f"❌ Cannot open video: {args.video}")
+        return 1
+    video_fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+
+    output = args.output or os.path.splitext(args.video)[0] + ".emotions.jsonl"
+    partial_path = output + ".partial"
+    header = {
+        "video": os.path.abspath(args.video),
+        "video_fps": round(video_fps, 3),
+        "frame_count": frame_count,
+        "sample_fps": args.fps,
+        "columns": ["t", "frame", "emotion", "confidence"],
+    }
+
+    done = read_partial(partial_path, header) if args.resume else []
+    done_frames = {row[1] for row in done}
+    sampled = sample_frames(frame_count, video_fps, args.fps)
+    todo = [index for index in sampled if index not in done_frames]
+    print(f"🎬 {args.video}: {frame_count} frames at {video_fps:.1f} fps, analysing {len(todo)} "
+          f"(sampled at {args.fps} fps{f', {len(done)} already done' if done else ''})")
+
+    run_started = time.perf_counter()
+    # Rewritten on resume too, which drops a line torn by the interruption
+    with open(partial_path, "w") as partial:
+        partial.write(json.dumps(header) + "\n")
+        for row in done:
+            partial.write(json.dumps(row, separators=(",", ":")) + "\n")
+        partial.flush()
+        run = TimelineRun(args.video, todo, video_fps, max(1, args.workers), args.batch_size, partial)
+        load_started = time.perf_counter()
+        run.main.load_emotion_model()
+        print(f"🧠 Model: {run.main.model_status['backend'] or 'fallback heuristic'} "
+              f"({(time.perf_counter() - load_started) * 1000:.0f} ms)")
+        processed, elapsed = run.run()
+
+    rows = sorted(read_partial(partial_path, header), key=lambda row: row[1])
+    missing = len(sampled) - len(rows)  # Sampled frames that could not be decoded
+    temporary = output + ".tmp"
+    with open(temporary, "w") as handle:
+        handle.write(json.dumps(dict(header, frames=len(rows), missing=missing)) + "\n")
+        for row in rows:
+            handle.write(json.dumps(row, separators=(",", ":")) + "\n")
+    os.replace(temporary, output)
+    os.remove(partial_path)
+
+    print(f"✅ {processed} frames in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} frames/sec, "
+          f"{time.perf_counter() - run_started:.1f}s total{f', {missing} unreadable frames missing' if missing else ''}) "
+          f"-> {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
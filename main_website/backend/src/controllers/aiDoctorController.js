@@ -98,16 +98,39 @@ export const getAudioResponse = async (req, res) => {
   try {
     const { filename } = req.params;
     
+    // Forward range and revalidation headers so seeking and 304s work end to end
+    const forwardedHeaders = {};
+    ['range', 'if-range', 'if-none-match', 'if-modified-since', 'accept'].forEach((header) => {
+      if (req.headers[header]) {
+        forwardedHeaders[header] = req.headers[header];
+      }
+    });
+    
     // Forward request to FastAPI audio endpoint
-    const response = await axios.get(`${AI_DOCTOR_API_URL}/audio/${filename}`, {
-      responseType: 'stream'
+    const response = await axios.get(`${AI_DOCTOR_API_URL}/audio/${encodeURIComponent(filename)}`, {
+      responseType: 'stream',
+      headers: forwardedHeaders,
+      params: req.query,
+      validateStatus: (status) => status < 400 || status === 416
     });
     
-    res.set({
-      'Content-Type': 'audio/mpeg',
+    const passthroughHeaders = {
       'Content-Disposition': `attachment; filename="${filename}"`
+    };
+    ['content-type', 'content-length', 'content-range', 'accept-ranges', 'etag', 'last-modified', 'cache-control', 'vary'].forEach((header) => {
+      if (response.headers[header]) {
+        passthroughHeaders[header] = response.headers[header];
+      }
     });
     
+    res.status(response.status);
+    res.set(passthroughHeaders);
+    
+    if (response.status === 304 || response.status === 416) {
+      response.data.resume();
+      return res.end();
+    }
+    
     response.data.pipe(res);
     
   } catch (error) {
@@ -296,6 +296,9 @@ const AITherapist = ({ isVisible, onClose, patientData }) => {
   const startEmotionDetection = () => {
     console.log('🚀 Starting emotion detection loop...');
     const detectEmotions = async () => {
+      // The backend recommends when to send the next frame (faster while the emotion is changing)
+      let nextDetectionDelay = 3000;
+
       // Enhanced webcam status check
       const hasVideo = videoRef.current && videoRef.current.srcObject;
       const hasCanvas = canvasRef.current;
@@ -360,7 +363,7 @@ const AITherapist = ({ isVisible, onClose, patientData }) => {
               },
               body: JSON.stringify({ 
                 image_data: base64Data,
-                session_id: `session_${Date.now()}_${patientData?.id || 'anonymous'}`
+                session_id: sessionId // Stable per session so the backend can track the face between frames
               })
             });
             
@@ -373,6 +376,9 @@ const AITherapist = ({ isVisible, onClose, patientData }) => {
               
               // Always update emotion data
               setEmotionData(data);
+              if (data.next_frame_interval_ms) {
+                nextDetectionDelay = data.next_frame_interval_ms;
+              }
               
               // Update mood based on detected emotion
               console.log(`🎭 Backend returned emotion: "${data.emotion}"`);
@@ -407,8 +413,8 @@ const AITherapist = ({ isVisible, onClose, patientData }) => {
       }
       
       if (isWebcamActive || (videoRef.current && videoRef.current.srcObject && videoRef.current.readyState >= 2)) {
-        console.log('⏰ Scheduling next detection in 3 seconds...');
-        setTimeout(detectEmotions, 3000); // Check every 3 seconds for better performance
+        console.log(`⏰ Scheduling next detection in ${nextDetectionDelay} ms...`);
+        setTimeout(detectEmotions, nextDetectionDelay);
       } else {
         console.log('⏹️ Webcam inactive, stopping detection loop');
         // Try to reinitialize webcam after 5 seconds